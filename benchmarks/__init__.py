@@ -0,0 +1 @@
+"""Benchmarks for xorca.  Run with `asv run` from the repository root."""
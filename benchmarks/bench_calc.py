@@ -0,0 +1,82 @@
+"""Benchmarks for the calculations on synthetic NEMO output."""
+
+import dask
+import numpy as np
+
+from xorca.budget import calculate_budget
+from xorca.calc import (calculate_divergence, calculate_eke, calculate_moc,
+                        calculate_psi, calculate_speed,
+                        calculate_vertical_remapping, calculate_vorticity)
+from xorca.lib import load_xorca_dataset
+
+from .bench_load import _select_files, _write_all_configs, configs
+
+
+class Calc:
+    """Time and peak memory of computing the diagnostics."""
+
+    params = configs
+    param_names = ["config"]
+    timeout = 600
+
+    def setup_cache(self):
+        return _write_all_configs()
+
+    def setup(self, files, config):
+        dask.config.set(scheduler="threads")
+        self.ds = load_xorca_dataset(**_select_files(files[config], 4))
+
+    def time_calculate_moc(self, files, config):
+        calculate_moc(self.ds).compute()
+
+    def peakmem_calculate_moc(self, files, config):
+        calculate_moc(self.ds).compute()
+
+    def time_calculate_psi(self, files, config):
+        calculate_psi(self.ds).compute()
+
+    def peakmem_calculate_psi(self, files, config):
+        calculate_psi(self.ds).compute()
+
+    def time_calculate_psi_lsq(self, files, config):
+        calculate_psi(self.ds, integrate_along="lsq").compute()
+
+    def time_calculate_speed(self, files, config):
+        calculate_speed(self.ds).compute()
+
+    def peakmem_calculate_speed(self, files, config):
+        calculate_speed(self.ds).compute()
+
+    def time_calculate_vorticity(self, files, config):
+        calculate_vorticity(self.ds).compute()
+
+    def peakmem_calculate_vorticity(self, files, config):
+        calculate_vorticity(self.ds).compute()
+
+    def time_calculate_divergence(self, files, config):
+        calculate_divergence(self.ds).compute()
+
+    def peakmem_calculate_eke(self, files, config):
+        calculate_eke(self.ds).compute()
+
+    def time_calculate_vertical_remapping(self, files, config):
+        calculate_vertical_remapping(self.ds, self.ds.vosaline,
+                                     self.ds.votemper,
+                                     np.linspace(-20, 20, 41)).compute()
+
+    def peakmem_calculate_vertical_remapping(self, files, config):
+        calculate_vertical_remapping(self.ds, self.ds.vosaline,
+                                     self.ds.votemper,
+                                     np.linspace(-20, 20, 41)).compute()
+
+    def time_calculate_budget_20_regions(self, files, config):
+        regions = {
+            "band{}".format(n): [(lon, -90), (lon + 18, -90), (lon + 18, 90),
+                                 (lon, 90)]
+            for n, lon in enumerate(range(-180, 180, 18))}
+        calculate_budget(self.ds, "heat", regions=regions).compute()
+
+    def track_moc_graph_tasks(self, files, config):
+        return len(calculate_moc(self.ds).__dask_graph__())
+
+    track_moc_graph_tasks.unit = "tasks"
@@ -0,0 +1,18 @@
+"""Benchmarks for importing xorca in a fresh interpreter."""
+
+
+class Import:
+    """Time of the imports (in a new process each, see `timeraw_*` in asv)."""
+
+    def timeraw_import_xorca(self):
+        return "import xorca"
+
+    def timeraw_import_xorca_lib(self):
+        return "import xorca.lib"
+
+    def timeraw_import_xorca_calc(self):
+        return "import xorca.calc"
+
+    def timeraw_import_xarray(self):
+        # lower bound for `xorca.lib` and `xorca.calc`
+        return "import xarray"
@@ -0,0 +1,107 @@
+"""Benchmarks for loading synthetic NEMO output."""
+
+import os
+import tempfile
+
+import xarray as xr
+
+from xorca.lib import (load_xorca_dataset, load_xorca_dataset_auto,
+                       preprocess_orca, rename_dims)
+
+from .synthetic import write_synthetic_nemo_output
+
+
+# Benchmarked configurations.  Pass, e.g.,
+# `XORCA_BENCHMARK_CONFIGS="ORCA1,ORCA025"` to also benchmark larger grids.
+configs = os.environ.get("XORCA_BENCHMARK_CONFIGS", "ORCA1").split(",")
+n_files = [1, 4, 16]
+scale = float(os.environ.get("XORCA_BENCHMARK_SCALE", "0.5"))
+
+
+def _write_all_configs():
+    """Write output for all configs to one temporary directory per config."""
+    return {
+        config: write_synthetic_nemo_output(
+            tempfile.mkdtemp(prefix="xorca_bench_"), config=config,
+            scale=scale, n_files=max(n_files))
+        for config in configs}
+
+
+def _select_files(files, n):
+    """Select the grid_T, grid_U, and grid_V files of the first n periods."""
+    return {"aux_files": files["aux_files"],
+            "data_files": files["data_files"][:3 * n]}
+
+
+class Load:
+    """Time, peak memory, and graph size of the loaders."""
+
+    params = (configs, n_files)
+    param_names = ["config", "n_files"]
+    timeout = 600
+
+    def setup_cache(self):
+        return _write_all_configs()
+
+    def time_load_xorca_dataset(self, files, config, n):
+        load_xorca_dataset(**_select_files(files[config], n),
+                           mesh_cache=False)
+
+    def time_load_xorca_dataset_auto(self, files, config, n):
+        load_xorca_dataset_auto(**_select_files(files[config], n),
+                                mesh_cache=False)
+
+    def peakmem_load_xorca_dataset(self, files, config, n):
+        load_xorca_dataset(**_select_files(files[config], n),
+                           mesh_cache=False)
+
+    def time_load_xorca_dataset_cached_mesh(self, files, config, n):
+        load_xorca_dataset(**_select_files(files[config], n))
+
+    def track_graph_tasks(self, files, config, n):
+        ds = load_xorca_dataset(**_select_files(files[config], n))
+        return len(ds.__dask_graph__())
+
+    track_graph_tasks.unit = "tasks"
+
+    def track_graph_layers(self, files, config, n):
+        ds = load_xorca_dataset(**_select_files(files[config], n))
+        return len(ds.__dask_graph__().layers)
+
+    track_graph_layers.unit = "layers"
+
+    def track_graph_tasks_collapsed(self, files, config, n):
+        ds = load_xorca_dataset(**_select_files(files[config], n),
+                                collapse_graph=True)
+        return len(ds.__dask_graph__())
+
+    track_graph_tasks_collapsed.unit = "tasks"
+
+    def time_load_region_and_compute(self, files, config, n):
+        load_xorca_dataset(**_select_files(files[config], n),
+                           region={"lon": (-40, 0), "lat": (20, 60)}
+                           ).votemper.compute()
+
+
+class Preprocess:
+    """Time and peak memory of preprocessing one file."""
+
+    params = configs
+    param_names = ["config"]
+    timeout = 600
+
+    def setup_cache(self):
+        return _write_all_configs()
+
+    def setup(self, files, config):
+        files = files[config]
+        self.mesh_mask = rename_dims(xr.open_dataset(
+            files["aux_files"][0], decode_cf=False, chunks={}))
+        self.ds = rename_dims(xr.open_dataset(
+            files["data_files"][0], chunks={}))
+
+    def time_preprocess_orca(self, files, config):
+        preprocess_orca(self.mesh_mask, self.ds)
+
+    def peakmem_preprocess_orca(self, files, config):
+        preprocess_orca(self.mesh_mask, self.ds)
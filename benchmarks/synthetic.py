@@ -0,0 +1,168 @@
+"""Write synthetic NEMO output with the shapes of the common ORCA grids."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+# Number of grid points (including the halo) of the common ORCA grids.
+orca_shapes = {
+    "ORCA2": {"z": 31, "y": 149, "x": 182},
+    "ORCA1": {"z": 75, "y": 292, "x": 362},
+    "ORCA05": {"z": 46, "y": 511, "x": 722},
+    "ORCA025": {"z": 75, "y": 1021, "x": 1442},
+    "ORCA12": {"z": 75, "y": 3059, "x": 4322},
+}
+
+
+def get_shape(config="ORCA1", scale=1.0, n_z=None):
+    """Return the number of grid points of a (scaled) ORCA configuration.
+
+    Parameters
+    ----------
+    config : str
+        One of the keys of `orca_shapes`.
+    scale : float
+        Factor for the number of horizontal grid points.  Use, e.g.,
+        `scale=0.25` for a quick test with a grid that is 16 times smaller.
+    n_z : int
+        Number of vertical levels.  Defaults to the levels of `config`.
+
+    Returns
+    -------
+    dict
+        Number of grid points in `z`, `y`, and `x`.
+
+    """
+    shape = orca_shapes[config]
+    return {"z": n_z or shape["z"],
+            "y": max(int(shape["y"] * scale), 4),
+            "x": max(int(shape["x"] * scale), 4)}
+
+
+def create_mesh_mask(z=75, y=292, x=362):
+    """Create a mesh mask with a bowl-shaped basin and an idealized grid."""
+    lat = np.linspace(-78.0, 89.0, y)[:, np.newaxis] * np.ones((1, x))
+    lon = np.linspace(73.0, 433.0, x, endpoint=False)[np.newaxis]
+    lon = (lon + 180.0) % 360.0 - 180.0
+    lon = lon * np.ones((y, 1))
+
+    gdepw = np.concatenate([[0.0], np.cumsum(np.linspace(1.0, 250.0, z))])
+    gdept = 0.5 * (gdepw[:-1] + gdepw[1:])
+    e3_1d = np.diff(gdepw)
+    gdepw = gdepw[:-1]
+
+    # bottom depth is deepest in the middle of the domain
+    yy, xx = np.meshgrid(np.linspace(-1, 1, y), np.linspace(-1, 1, x),
+                         indexing="ij")
+    bottom = gdepw[-1] * (1.0 - 0.8 * (xx ** 2 + yy ** 2))
+    tmask = (gdept[:, np.newaxis, np.newaxis] <
+             bottom[np.newaxis]).astype("int8")
+    umask = tmask * np.roll(tmask, -1, axis=-1)
+    vmask = tmask * np.roll(tmask, -1, axis=-2)
+    fmask = umask * np.roll(umask, -1, axis=-2)
+
+    e1 = 1.11e5 * np.cos(np.deg2rad(lat)) * 360.0 / x
+    e2 = 1.11e5 * 167.0 / y * np.ones((y, x))
+    e3 = e3_1d[:, np.newaxis, np.newaxis] * np.ones((1, y, x))
+
+    def _t(a):
+        return a[np.newaxis]
+
+    data_vars = {}
+    for gp, mask in zip("tuvf", [tmask, umask, vmask, fmask]):
+        data_vars[gp + "mask"] = (("t", "z", "y", "x"), _t(mask))
+        data_vars["glam" + gp] = (("t", "y", "x"), _t(lon))
+        data_vars["gphi" + gp] = (("t", "y", "x"), _t(lat))
+        data_vars["e1" + gp] = (("t", "y", "x"), _t(e1))
+        data_vars["e2" + gp] = (("t", "y", "x"), _t(e2))
+    for gp in "tuvw":
+        data_vars["e3{}_0".format(gp)] = (("t", "z", "y", "x"), _t(e3))
+    data_vars["gdept_1d"] = (("t", "z"), _t(gdept))
+    data_vars["gdepw_1d"] = (("t", "z"), _t(gdepw))
+
+    return xr.Dataset(data_vars)
+
+
+def create_grid_files(times, z=75, y=292, x=362, seed=137):
+    """Create the contents of one set of grid_T, grid_U, and grid_V files."""
+    rng = np.random.RandomState(seed=seed)
+    shape = (len(times), z, y, x)
+
+    def _random(scale=1.0):
+        return (scale * rng.randn(*shape)).astype("float32")
+
+    coords = {"time_counter": ("time_counter", times)}
+    grid_T = xr.Dataset(
+        {"votemper": (("time_counter", "deptht", "y", "x"), _random(5.0)),
+         "vosaline": (("time_counter", "deptht", "y", "x"), _random(0.5)),
+         "sossheig": (("time_counter", "y", "x"),
+                      _random()[:, 0])},
+        coords=coords)
+    grid_U = xr.Dataset(
+        {"vozocrtx": (("time_counter", "depthu", "y", "x"), _random(0.1))},
+        coords=coords)
+    grid_V = xr.Dataset(
+        {"vomecrty": (("time_counter", "depthv", "y", "x"), _random(0.1))},
+        coords=coords)
+    return {"grid_T": grid_T, "grid_U": grid_U, "grid_V": grid_V}
+
+
+def write_synthetic_nemo_output(path, config="ORCA1", scale=1.0, n_z=None,
+                                n_files=1, n_t_per_file=1, freq="5d",
+                                start="1958-01-01"):
+    """Write a mesh mask and grid_T/U/V files with NEMO names and shapes.
+
+    File names follow the XIOS conventions like
+    `ORCA1_5d_19580101_19580105_grid_T.nc`.
+
+    Parameters
+    ----------
+    path : Path | str
+        Directory to write to.  Will be created if necessary.
+    config : str
+        One of the keys of `orca_shapes`.
+    scale : float
+        Factor for the number of horizontal grid points.
+    n_z : int
+        Number of vertical levels.  Defaults to the levels of `config`.
+    n_files : int
+        Number of files per grid.
+    n_t_per_file : int
+        Number of time steps per file.
+    freq : str
+        Output frequency.
+    start : str
+        First time step.
+
+    Returns
+    -------
+    dict
+        With the `"aux_files"` and the `"data_files"`.
+
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    shape = get_shape(config, scale=scale, n_z=n_z)
+
+    mesh_mask_file = path / "mesh_mask.nc"
+    create_mesh_mask(**shape).to_netcdf(mesh_mask_file)
+
+    times = pd.date_range(start, periods=n_files * n_t_per_file, freq=freq)
+    period = pd.Timedelta(freq)
+    data_files = []
+    for n in range(n_files):
+        file_times = times[n * n_t_per_file:(n + 1) * n_t_per_file]
+        first = file_times[0].strftime("%Y%m%d")
+        last = (file_times[-1] + period -
+                pd.Timedelta("1d")).strftime("%Y%m%d")
+        for grid, ds in create_grid_files(file_times, seed=n,
+                                          **shape).items():
+            file_name = path / "{}_{}_{}_{}_{}.nc".format(
+                config, freq, first, last, grid)
+            ds.to_netcdf(file_name)
+            data_files.append(file_name)
+
+    return {"aux_files": [mesh_mask_file, ], "data_files": data_files}
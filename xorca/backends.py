@@ -0,0 +1,274 @@
+"""Detect the format of input files and open them with the right backend."""
+
+from functools import lru_cache
+import os
+from pathlib import Path
+
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+from .cache import LRUCache
+
+
+# Leading bytes of the files for all formats that can be detected from the
+# file content.
+magic_bytes = {
+    b"CDF\x01": "netcdf3",
+    b"CDF\x02": "netcdf3",
+    b"CDF\x05": "netcdf3",
+    b"\x89HDF\r\n\x1a\n": "netcdf4",
+}
+
+# Entries of a directory which identify it as a Zarr store.
+zarr_markers = (".zgroup", ".zarray", ".zmetadata", "zarr.json")
+
+# File suffixes used if the format cannot be detected from the content.
+suffixes = {
+    ".nc": "netcdf4",
+    ".nc4": "netcdf4",
+    ".zarr": "zarr",
+    ".json": "kerchunk",
+    ".parq": "kerchunk",
+}
+
+
+def _open_netcdf(path, **kwargs):
+    return xr.open_dataset(path, **kwargs)
+
+
+def _open_zarr(path, **kwargs):
+    return xr.open_dataset(path, engine="zarr", **kwargs)
+
+
+def _open_kerchunk(path, storage_options=None, **kwargs):
+    storage_options = dict(storage_options or {}, fo=str(path))
+    return xr.open_dataset(
+        "reference://", engine="zarr",
+        backend_kwargs={"consolidated": False,
+                        "storage_options": storage_options},
+        **kwargs)
+
+
+# Datasets backed by memory maps of netCDF3 files and the memory maps of the
+# files in this process.  Both are keyed by path and hold the modification
+# time of the file, so that entries of changed files are replaced.
+_memmapped_datasets = LRUCache(max_entries=16)
+_memmaps = LRUCache(max_entries=16)
+
+
+def _get_memmap(path, mtime):
+    entry = _memmaps.get(path)
+    if entry is None or entry[0] != mtime:
+        if os.stat(path).st_mtime_ns != mtime:
+            raise RuntimeError(f"{path} changed since it was opened.")
+        entry = (mtime, np.memmap(path, dtype=np.uint8, mode="r"))
+        _memmaps.put(path, entry)
+    return entry[1]
+
+
+class NetCDF3MemmapArray(BackendArray):
+    """A variable stored contiguously at a fixed offset of a netCDF3 file.
+
+    Only the path and the layout of the variable are held (and pickled), so
+    dask graphs of these arrays stay small.  Each process maps the file on
+    first access (see `_get_memmap`), and every chunk is read from the shared
+    pages and converted to the native byte order.
+    """
+
+    def __init__(self, path, mtime, offset, shape, strides, dtype):
+        self.path = path
+        self.mtime = mtime
+        self.offset = offset
+        self.shape = shape
+        self.strides = strides
+        self.file_dtype = dtype
+        self.dtype = dtype.newbyteorder("=")
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.BASIC, self._getitem)
+
+    def _getitem(self, key):
+        array = np.ndarray(self.shape, dtype=self.file_dtype,
+                           buffer=_get_memmap(self.path, self.mtime),
+                           offset=self.offset, strides=self.strides)
+        return np.asarray(array[key], dtype=self.dtype)
+
+
+def _get_memmapped_dataset(path, mtime):
+    """Read the header of a netCDF3 file and wrap all variables."""
+    from scipy.io import netcdf_file
+
+    def _decode_attrs(attrs):
+        return {k: v.decode() if isinstance(v, bytes) else v
+                for k, v in attrs.items()}
+
+    variables = {}
+    with netcdf_file(path, mode="r", mmap=True, maskandscale=False) as nc:
+        start = nc._mm_buf.__array_interface__["data"][0]
+        for name, var in nc.variables.items():
+            data = var.data
+            if data.size == 0:
+                data = np.array(data, dtype=data.dtype.newbyteorder("="))
+            else:
+                data = indexing.LazilyIndexedArray(NetCDF3MemmapArray(
+                    path, mtime, data.__array_interface__["data"][0] - start,
+                    data.shape, data.strides, data.dtype))
+            variables[name] = xr.Variable(var.dimensions, data,
+                                          attrs=_decode_attrs(var._attributes))
+        attrs = _decode_attrs(nc._attributes)
+        del data, var
+    ds = xr.Dataset(variables, attrs=attrs)
+    return ds.set_coords([d for d in ds.dims if d in ds.variables])
+
+
+def open_netcdf3_memmap(path, decode_cf=False, chunks=None, **kwargs):
+    """Open an uncompressed netCDF3 (classic) file as read-only memory maps.
+
+    The variables of classic netCDF files are stored contiguously at fixed
+    offsets.  All data variables of the returned dataset are therefore lazy
+    arrays reading from a read-only memory map of the file (see
+    `NetCDF3MemmapArray`).  No data is read before it is accessed, and the
+    pages of the file are shared between all processes on the same node.
+    Datasets are cached per path and modification time, so repeated opens are
+    essentially free.
+
+    Parameters
+    ----------
+    path : Path | str
+        File name.
+    decode_cf : bool
+        Decode the dataset?  Defaults to False.
+    chunks : dict
+        If given, the (memory mapped) variables are wrapped in dask arrays with
+        these chunks.
+
+    Returns
+    -------
+    xarray dataset
+
+    """
+    path = str(path)
+    mtime = os.stat(path).st_mtime_ns
+    entry = _memmapped_datasets.get(path)
+    if entry is None or entry[0] != mtime:
+        entry = (mtime, _get_memmapped_dataset(path, mtime))
+        _memmapped_datasets.put(path, entry)
+
+    ds = entry[1]
+    if decode_cf:
+        ds = xr.decode_cf(ds, **kwargs)
+    if chunks is not None:
+        ds = ds.chunk(chunks)
+    return ds
+
+
+# All known backends.  Each backend has a function to open a path and default
+# options passed to this function.  Use `register_backend` to add backends or
+# to change the default options.
+backends = {
+    "netcdf3": {"open": _open_netcdf, "options": {}},
+    "netcdf4": {"open": _open_netcdf, "options": {}},
+    "zarr": {"open": _open_zarr, "options": {}},
+    "kerchunk": {"open": _open_kerchunk, "options": {}},
+}
+
+
+def register_backend(name, open_function=None, **options):
+    """Register a backend or update the options of a known backend.
+
+    Parameters
+    ----------
+    name : str
+        Name of the format.  This is what `detect_format` returns.
+    open_function : callable
+        Will be called with the path and all options and has to return an
+        xarray dataset.  May be omitted to only update the options of an
+        existing backend.
+    **options
+        Default options for `open_function`.  Examples: `lock=False` or
+        `cache=False` for netCDF files, `consolidated=True` for Zarr stores,
+        or `engine="h5netcdf", phony_dims="sort"` for HDF5 files without
+        dimension scales.
+
+    """
+    backend = backends.setdefault(name, {"open": open_function,
+                                         "options": {}})
+    if open_function is not None:
+        backend["open"] = open_function
+    backend["options"].update(options)
+
+
+@lru_cache(maxsize=None)
+def _detect_format(path, mtime):
+    path = Path(path)
+
+    if path.is_dir():
+        if any((path / marker).exists() for marker in zarr_markers):
+            return "zarr"
+        raise ValueError(f"Directory {path} is not a Zarr store.")
+
+    if path.is_file():
+        with open(path, "rb") as f:
+            head = f.read(8)
+        for magic, file_format in magic_bytes.items():
+            if head.startswith(magic):
+                return file_format
+
+    try:
+        return suffixes[path.suffix.lower()]
+    except KeyError:
+        raise ValueError(f"Could not detect format of {path}.")
+
+
+def detect_format(path):
+    """Detect the format of a file or store.
+
+    Zarr stores are detected from their metadata entries, netCDF files from
+    their leading bytes, and everything else from the suffix of the path.  The
+    decision is cached per path and modification time.
+
+    Parameters
+    ----------
+    path : Path | str
+        File name or path of the store.
+
+    Returns
+    -------
+    str
+        One of the keys of `xorca.backends.backends`.
+
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    return _detect_format(str(path), mtime)
+
+
+def open_dataset(path, backend_options=None, **kwargs):
+    """Open a file or store with the backend matching its format.
+
+    Parameters
+    ----------
+    path : Path | str
+        File name or path of the store.
+    backend_options : dict
+        Options per format overriding the defaults of the backend.  Example:
+        `{"zarr": {"consolidated": True}, "netcdf4": {"lock": False}}`.
+    **kwargs
+        Passed on to the backend.  Examples: `chunks`, `decode_cf`.
+
+    Returns
+    -------
+    xarray dataset
+
+    """
+    file_format = detect_format(path)
+    backend = backends[file_format]
+    options = dict(backend["options"])
+    options.update((backend_options or {}).get(file_format, {}))
+    options.update(kwargs)
+    return backend["open"](path, **options)
@@ -0,0 +1,256 @@
+"""Heat and salt budgets of regions from the fluxes on the C grid.
+
+The budget of a tracer (like the heat content) in each region and depth range
+is split into the storage tendency, the convergence of the advective fluxes
+through the cell faces, and the surface flux.  The residual collects
+everything else (mixing, penetrative radiation, and errors from the time
+sampling):
+```python
+ds = add_thickness_weights(ds)  # re-used for all budgets
+budget = calculate_budget(ds, "heat", regions=polygons,
+                          depth_range=(0, 700)).compute()
+budget.to_dataframe()
+```
+All regions are integrated at the same time along a new dim `"region"`, so
+the data are read only once no matter how many regions there are.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .calc import (_apply_stencil, _assign_index_coords, _get_fold_type,
+                   calculate_thickness_weights)
+from .halo import pad_north_fold
+from .lib import get_name_dict, unpack
+from .regions import add_region_masks
+
+
+def _advection_kernel(u, v, tracer, e2u, e3u, e1v, e3v, umask, vmask):
+    # net advective flux into the T cells with the tracer interpolated to
+    # the faces
+    tracer = np.where(np.isfinite(tracer), tracer, 0)
+    ue = np.where(umask > 0, e2u * e3u * u, 0)
+    ve = np.where(vmask > 0, e1v * e3v * v, 0)
+    dtype = np.result_type(ue, ve, tracer, np.float64)
+    flux_u = np.zeros(ue.shape, dtype=dtype)
+    flux_v = np.zeros(ve.shape, dtype=dtype)
+    flux_u[..., :-1] = ue[..., :-1] * 0.5 * (tracer[..., :-1] +
+                                             tracer[..., 1:])
+    flux_v[..., :-1, :] = ve[..., :-1, :] * 0.5 * (tracer[..., :-1, :] +
+                                                   tracer[..., 1:, :])
+    conv = np.zeros(flux_u.shape, dtype=dtype)
+    conv[..., 1:, 1:] = (flux_u[..., 1:, :-1] - flux_u[..., 1:, 1:] +
+                         flux_v[..., :-1, 1:] - flux_v[..., 1:, 1:])
+    return conv
+
+
+def calculate_advective_convergence(ds, tracer, fold_type="auto"):
+    """Calculate the convergence of the advective fluxes of a tracer.
+
+    The tracer is interpolated to the U and V faces (mean of the two
+    neighbouring cells) and multiplied with the transports through the faces
+    in one fused stencil per chunk (see `xorca.calc._apply_stencil`).  If
+    there is a vertical velocity `vovecrtz`, the fluxes through the upper
+    and lower faces are added.  The fluxes through the faces of the last row
+    use the halo of the north fold (like `xorca.calc.calculate_vorticity`).
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    tracer : str
+        Name of a variable on the central (T) grid.
+    fold_type : str
+        `"T"` or `"F"` for the north fold of the ORCA grids (see
+        `xorca.halo.get_fold_type`), or None for a closed northern boundary.
+        Default is `"auto"`, which detects the fold type or assumes a closed
+        boundary if there is no fold.
+
+    Returns
+    -------
+    xarray data array
+        Net advective flux into the T cells in units of the tracer times
+        `[m3/s]`.  Zero on land.
+
+    """
+    fold_type = _get_fold_type(ds, fold_type)
+
+    name = tracer
+    tmask = ds.tmask.reset_coords(drop=True)
+    tracer = unpack(ds[name]).reset_coords(drop=True)
+    tracer = tracer.where(tmask > 0, 0)
+
+    arrays = [unpack(ds.vozocrtx), unpack(ds.vomecrty), tracer,
+              ds.e2u, ds.e3u, ds.e1v, ds.e3v, ds.umask, ds.vmask]
+    if fold_type is not None:
+        # the meridional fluxes of the last row need the tracer north of
+        # the fold
+        signs = [-1.0, -1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+        arrays = [pad_north_fold(a, fold_type, sign=sign)
+                  for a, sign in zip(arrays, signs)]
+    conv = _apply_stencil(_advection_kernel, arrays, "y_c", "x_c")
+    conv = conv.isel(y_c=slice(0, ds.sizes["y_c"]))
+
+    if "vovecrtz" in ds:
+        # tracer at the W points (upper faces), with the value of the first
+        # cell at the surface
+        tracer_w = 0.5 * (tracer + tracer.shift(z_c=1))
+        tracer_w = tracer_w.fillna(tracer).drop_vars(
+            [c for c in tracer_w.coords if c == "z_c"]).rename(z_c="z_l")
+        w = unpack(ds.vovecrtz).reset_coords(drop=True)
+        w_mask = tmask.drop_vars(
+            [c for c in tmask.coords if c == "z_c"]).rename(z_c="z_l")
+        flux_w = (w.where(w_mask > 0, 0) * tracer_w *
+                  (ds.e1t * ds.e2t).reset_coords(drop=True))
+        conv_w = flux_w.shift(z_l=-1, fill_value=0) - flux_w
+        conv_w = conv_w.drop_vars(
+            [c for c in conv_w.coords if c == "z_l"]).rename(z_l="z_c")
+        conv = conv + conv_w.transpose(*conv.dims)
+
+    conv = conv.where(tmask > 0, 0)
+    return _assign_index_coords(conv, ds).rename("conv_" + name)
+
+
+def _get_region_names(ds, regions, cache_dir=None, **kwargs):
+    """Return the dataset with all region masks and the names of the regions.
+
+    See `calculate_budget` for `regions`.
+    """
+    if regions is None:
+        regions = ["global", ] + [
+            c[len("tmask"):] for c in ds.coords
+            if c.startswith("tmask") and c != "tmask" and
+            ds[c].dims == ("y_c", "x_c")]
+    elif isinstance(regions, dict):
+        ds = add_region_masks(ds, regions=regions, cache_dir=cache_dir,
+                              **kwargs)
+        regions = list(regions)
+    return ds, list(regions)
+
+
+def get_region_weights(ds, regions):
+    """Stack the masks of the regions times the area of the T cells.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset with masks `"tmask{name}"` on the T points (like
+        the basin masks or those added by `xorca.regions.add_region_masks`).
+    regions : sequence
+        Names of the regions.  `"global"` is the whole (wet) domain.
+
+    Returns
+    -------
+    xarray data array
+        Areas in `[m2]` with dims `("region", "y_c", "x_c")`.  Zero outside
+        of the regions.
+
+    """
+    masks = []
+    for name in regions:
+        if name == "global":
+            mask = ds.tmask.isel(z_c=0)
+        else:
+            mask = ds["tmask" + name]
+        masks.append(mask.reset_coords(drop=True).astype(bool))
+    masks = xr.concat(masks, dim=pd.Index(regions, name="region"))
+    area = (ds.e1t * ds.e2t).reset_coords(drop=True)
+    return area.where(masks, 0).astype(np.float64)
+
+
+def _integrate(da, weights, region_weights, dims):
+    """Contract `da` with the weights of all regions in one pass per chunk."""
+    da = da.reset_coords(drop=True)
+    if weights is not None:
+        da = da.where(weights > 0, 0)
+        return xr.dot(da.astype(np.float64), weights.astype(np.float64),
+                      region_weights, dim=dims)
+    da = da.where(np.isfinite(da), 0)
+    return xr.dot(da.astype(np.float64), region_weights, dim=dims)
+
+
+def calculate_budget(ds, budget="heat", regions=None, depth_range=None,
+                     cache_dir=None, fold_type="auto", **kwargs):
+    """Calculate the budget of a tracer for many regions at once.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca` with
+        the tracer, the velocities `vozocrtx`, `vomecrty`, and (optionally)
+        `vovecrtz`, and (optionally) the surface flux.
+    budget : str
+        One of the keys of `xorca.orca_names.budget_tracers`:  `"heat"` or
+        `"salt"`.  Defaults to `"heat"`.
+    regions : sequence | dict
+        Names of regions with masks `"tmask{name}"` in `ds`, where
+        `"global"` is the whole domain, or polygons per region name which are
+        turned into masks with `xorca.regions.add_region_masks` (and cached,
+        see `cache_dir`).  Defaults to the whole domain and all regions with
+        masks in `ds`.
+    depth_range : tuple
+        Depth range `(d0, d1)` in `[m]` (positive downward).  Cells partially
+        inside the range contribute with the part inside (see
+        `xorca.calc.calculate_thickness_weights`, which re-uses the weights
+        added with `xorca.calc.add_thickness_weights`).  The surface flux is
+        only included if the range starts at the surface.  Defaults to
+        `None` which selects the full water column.
+    cache_dir : Path | str
+        See `xorca.regions.get_region_bits`.
+    fold_type : str
+        See `calculate_advective_convergence`.  Default is `"auto"`.
+
+    Returns
+    -------
+    xarray dataset
+        With dims `("t", "region")` and the variables `"content"` (the
+        tracer content), `"storage"` (its tendency, by centered differences
+        in time), `"advection"`, `"surface"`, and `"residual"` (storage minus
+        the other terms) in the units of the budget.  Use `to_dataframe()`
+        for a table.
+
+    """
+    names = get_name_dict("budget_tracers", **kwargs)[budget]
+    factor = names["factor"]
+    ds, regions = _get_region_names(ds, regions, cache_dir=cache_dir,
+                                    **kwargs)
+    region_weights = get_region_weights(ds, regions)
+    weights = calculate_thickness_weights(ds, "t", depth_range, **kwargs)
+    volume_dims = ["z_c", "y_c", "x_c"]
+
+    tracer = unpack(ds[names["tracer"]])
+    content = factor * _integrate(tracer, weights, region_weights,
+                                  volume_dims)
+    conv = calculate_advective_convergence(ds, names["tracer"],
+                                           fold_type=fold_type)
+    # per volume, so that partial cells get their part of the convergence
+    volume = (ds.e1t * ds.e2t * ds.e3t).reset_coords(drop=True)
+    conv = conv / volume.where(volume > 0)
+    advection = factor * _integrate(conv, weights, region_weights,
+                                    volume_dims)
+
+    terms = {"content": content, "advection": advection}
+    if ds.sizes.get("t", 0) > 1:
+        # the contents are small, so all time steps fit into one chunk
+        if content.chunks is not None:
+            content = content.chunk({"t": -1})
+        terms["storage"] = content.differentiate("t", datetime_unit="s")
+    else:
+        terms["storage"] = xr.full_like(content, np.nan)
+    surface_flux = names["surface_flux"]
+    with_surface = depth_range is None or depth_range[0] <= 0
+    if surface_flux is not None and surface_flux in ds and with_surface:
+        terms["surface"] = _integrate(unpack(ds[surface_flux]), None,
+                                      region_weights, ["y_c", "x_c"])
+    else:
+        terms["surface"] = xr.zeros_like(advection)
+    terms["residual"] = (terms["storage"] - terms["advection"] -
+                         terms["surface"])
+
+    budget_ds = xr.Dataset(
+        {name: da.transpose(..., "region") for name, da in terms.items()})
+    budget_ds["content"].attrs["units"] = names["content_units"]
+    for name in ["storage", "advection", "surface", "residual"]:
+        budget_ds[name].attrs["units"] = names["units"]
+    return budget_ds
@@ -0,0 +1,88 @@
+"""Caches shared by all loaders of a process."""
+
+from collections import OrderedDict
+import threading
+
+
+class LRUCache(object):
+    """Cache evicting the least recently used entries.
+
+    The cache is bounded in the number of entries and in the total number of
+    bytes of the entries.  Entries larger than `max_bytes` are not cached at
+    all.  All methods are thread safe.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximal number of entries.  Default is 8.
+    max_bytes : int | str
+        Maximal total size of the entries.  Strings like `"1GB"` are parsed
+        with `dask.utils.parse_bytes`.  Default is None (no bound).
+
+    """
+
+    def __init__(self, max_entries=8, max_bytes=None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.resize(max_entries=max_entries, max_bytes=max_bytes)
+
+    def resize(self, max_entries=None, max_bytes=None):
+        """Set new bounds and evict entries until they are met.
+
+        Bounds which are not given (None) are not changed.
+        """
+        if isinstance(max_bytes, str):
+            from dask.utils import parse_bytes
+            max_bytes = parse_bytes(max_bytes)
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None or not hasattr(self, "max_bytes"):
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (
+                len(self._entries) > self.max_entries or
+                (self.max_bytes is not None and
+                 self._nbytes() > self.max_bytes)):
+            self._entries.popitem(last=False)
+
+    def _nbytes(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    @property
+    def nbytes(self):
+        """Total size of all entries."""
+        with self._lock:
+            return self._nbytes()
+
+    def get(self, key, default=None):
+        """Return the entry for `key` and mark it as recently used."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes=0):
+        """Add an entry of size `nbytes` and evict old entries if needed."""
+        with self._lock:
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
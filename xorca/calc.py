@@ -1,6 +1,335 @@
 """Calculations with grid-aware data sets."""
 
-import xgcm
+from functools import lru_cache
+import json
+import os
+
+import numpy as np
+import xarray as xr
+
+from .halo import get_fold_type, get_grid, interp, pad_north_fold
+from .lib import get_name_dict, unpack
+
+
+def calculate_thickness_weights(ds, grid_point="t", depth_range=None,
+                                **kwargs):
+    """Calculate masked vertical cell thicknesses.
+
+    If the dataset already carries a coordinate `"weights_{grid_point}"` (see
+    `add_thickness_weights`) and no `depth_range` is given, this coordinate is
+    returned as is.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    grid_point : str
+        One of the keys of `xorca.orca_names.thickness_weights`:  `"t"`,
+        `"u"`, `"v"`, or `"w"`.  Defaults to `"t"`.
+    depth_range : tuple
+        Upper and lower bound `(d0, d1)` of the depth range in `[m]`
+        (positive downward).  Cells that are only partially inside the depth
+        range are weighted with the thickness of the part inside the range.
+        Defaults to `None` which selects the full water column.
+
+    Returns
+    -------
+    weights : xarray data array
+        Thickness weights in `[m]` which are zero on land.
+
+    """
+    names = get_name_dict("thickness_weights", **kwargs)[grid_point]
+    weights_name = "weights_" + grid_point
+    if depth_range is None and weights_name in ds.coords:
+        return ds.coords[weights_name]
+
+    z_dim = names["dims"][0]
+    e3 = ds[names["e3"]]
+    mask = ds[names["mask"]].reset_coords(drop=True)
+    if z_dim not in mask.dims:
+        mask = mask.rename({"z_c": z_dim}).assign_coords(
+            {z_dim: ds.coords[z_dim]})
+
+    weights = e3.where(mask.astype(bool), 0)
+
+    if depth_range is not None:
+        # Depth of the upper and lower cell faces (positive downward).  For
+        # T, U, and V points, the upper face is at the W point above.  For W
+        # points, the lower face is at the T point below.  With time-varying
+        # thicknesses, the faces are found by summing up the thicknesses.
+        if "t" in e3.dims:
+            bottom = e3.cumsum(z_dim)
+            top = bottom - e3
+        elif z_dim == "z_c":
+            top = xr.DataArray(- ds.coords["depth_l"].data, dims=[z_dim, ])
+            bottom = top + e3
+        else:
+            bottom = xr.DataArray(- ds.coords["depth_c"].data,
+                                  dims=[z_dim, ])
+            top = bottom - e3
+        d0, d1 = depth_range
+        overlap = (bottom.clip(max=d1) - top.clip(min=d0)).clip(min=0)
+        weights = overlap.where(weights > 0, 0)
+
+    return weights.rename(weights_name)
+
+
+def add_thickness_weights(ds, grid_points=("t", "u", "v", "w"),
+                          persist=False, **kwargs):
+    """Add masked vertical cell thicknesses as coordinates.
+
+    This precomputes `calculate_thickness_weights` for all `grid_points` and
+    stores them as coordinates `"weights_t"`, `"weights_u"`, etc.  All
+    functions of `xorca.calc` will re-use these coordinates.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    grid_points : sequence
+        Grid points to calculate weights for.  Defaults to all grid points.
+    persist : bool
+        Persist the weights in (distributed) memory?  Defaults to False.
+
+    Returns
+    -------
+    dataset
+
+    """
+    ds = ds.copy()
+    for grid_point in grid_points:
+        weights = calculate_thickness_weights(ds, grid_point, **kwargs)
+        if persist:
+            weights = weights.persist()
+        ds.coords[weights.name] = weights
+    return ds
+
+
+def _sum(da, dim):
+    """Sum single-precision data with a double-precision accumulator.
+
+    The result has the same dtype as `da`.
+    """
+    if da.dtype == np.float32:
+        return da.sum(dim, dtype=np.float64).astype(np.float32)
+    return da.sum(dim)
+
+
+def _cumsum(grid, da, axis, **kwargs):
+    """Cumulative sum along a grid axis with a double-precision accumulator.
+
+    The result has the same dtype as `da`.
+    """
+    if da.dtype == np.float32:
+        return grid.cumsum(da.astype(np.float64), axis,
+                           **kwargs).astype(np.float32)
+    return grid.cumsum(da, axis, **kwargs)
+
+
+def _prefix_sum(da, dim, coord):
+    """Cumulative sum along `dim` ending up on the grid points of `coord`.
+
+    For dask arrays, this is a blocked scan: All chunks are summed up in
+    parallel and only the totals of the chunks are propagated (as a tree,
+    `method="blelloch"`) before they are added to the chunks, again in
+    parallel.  So chunking along `dim` does not serialize the computation.
+    Single-precision data are accumulated in double precision.
+    """
+    import dask
+
+    axis = da.get_axis_num(dim)
+    dtype = np.float64 if da.dtype == np.float32 else None
+    if dask.is_dask_collection(da.data):
+        data = da.data.cumsum(axis=axis, dtype=dtype, method="blelloch")
+    else:
+        data = np.cumsum(da.data, axis=axis, dtype=dtype)
+
+    new_dim = coord.dims[0]
+    coords = {k: v for k, v in da.coords.items() if dim not in v.dims}
+    coords[new_dim] = coord
+    return xr.DataArray(data.astype(da.dtype),
+                        dims=[new_dim if d == dim else d for d in da.dims],
+                        coords=coords)
+
+
+def _vertical_sum(da, weights, z_dim):
+    """Weighted vertical sum fusing product and reduction per chunk.
+
+    Land points are set to zero first so that missing values on land do not
+    propagate.  The contraction is done with `xr.dot` which, for dask arrays,
+    multiplies and reduces each chunk in one task and then only adds up one
+    partial sum per chunk along `z_dim`.  Single-precision data are cast to
+    double precision inside this task only.  Packed variables are unpacked
+    within the same tasks.
+    """
+    da = unpack(da)
+    # vertically varying coordinates (such as the weights themselves, if they
+    # are coordinates of the dataset) would prevent the contraction
+    da = da.drop_vars([c for c in da.coords
+                       if z_dim in da[c].dims and c != z_dim])
+    weights = weights.reset_coords(drop=True)
+    da = da.where(weights > 0, 0)
+    dtype = np.result_type(da.dtype, weights.dtype)
+    if dtype == np.float32:
+        return xr.dot(da.astype(np.float64), weights.astype(np.float64),
+                      dim=z_dim).astype(np.float32)
+    return xr.dot(da, weights, dim=z_dim)
+
+
+def calculate_vertical_integral(ds, da, grid_point="t", depth_range=None,
+                                **kwargs):
+    """Calculate the vertical integral of a data array.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    da : xarray data array
+        Data array living on `grid_point`.
+    grid_point : str
+        One of `"t"`, `"u"`, `"v"`, or `"w"`.  Defaults to `"t"`.
+    depth_range : tuple
+        Depth range `(d0, d1)` in `[m]` (positive downward).  Defaults to
+        `None` which integrates over the full water column.
+
+    Returns
+    -------
+    xarray data array
+        The vertical integral in units of `da` times `[m]`.
+
+    """
+    weights = calculate_thickness_weights(ds, grid_point, depth_range,
+                                          **kwargs)
+    z_dim = weights.dims[0]
+    return _vertical_sum(da, weights, z_dim)
+
+
+def calculate_vertical_mean(ds, da, grid_point="t", depth_range=None,
+                            **kwargs):
+    """Calculate the thickness-weighted vertical mean of a data array.
+
+    See `calculate_vertical_integral` for the parameters.  Land columns will
+    be NaN.
+    """
+    weights = calculate_thickness_weights(ds, grid_point, depth_range,
+                                          **kwargs)
+    z_dim = weights.dims[0]
+    thickness = _sum(weights, z_dim)
+    return (_vertical_sum(da, weights, z_dim) /
+            thickness.where(thickness > 0))
+
+
+def _remap_kernel(data, target, thickness, bounds):
+    """Remap columns (along the last axis) conservatively to layers.
+
+    Within each cell, the target coordinate is linear between its values at
+    the upper and lower faces, which are the means of the neighbouring cells
+    (or the value of the cell itself next to land, the surface, and the
+    bottom).  Each cell contributes to each layer with the fraction of the
+    cell in the layer.  Only one layer is held in memory at a time.
+
+    Returns the content (data times thickness) and the thickness of all
+    layers along a new last axis.
+    """
+    thickness = np.where(np.isfinite(data) & np.isfinite(target),
+                         thickness, 0).astype(np.float64)
+    wet = thickness > 0
+    data = np.where(wet, data, 0).astype(np.float64)
+    target = np.where(wet, target, 0).astype(np.float64)
+
+    upper = target.copy()
+    lower = target.copy()
+    both_wet = wet[..., :-1] & wet[..., 1:]
+    face = 0.5 * (target[..., :-1] + target[..., 1:])
+    upper[..., 1:] = np.where(both_wet, face, target[..., 1:])
+    lower[..., :-1] = np.where(both_wet, face, target[..., :-1])
+    low = np.minimum(upper, lower)
+    high = np.maximum(upper, lower)
+    span = high - low
+    thin = span == 0
+
+    shape = data.shape[:-1] + (len(bounds) - 1, )
+    content = np.zeros(shape)
+    layer_thickness = np.zeros(shape)
+    for n, (b0, b1) in enumerate(zip(bounds[:-1], bounds[1:])):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(
+                thin, (low >= b0) & (low < b1),
+                (np.minimum(high, b1) - np.maximum(low, b0)).clip(min=0) /
+                span)
+        h = thickness * fraction
+        content[..., n] = (data * h).sum(-1)
+        layer_thickness[..., n] = h.sum(-1)
+    return content, layer_thickness
+
+
+def calculate_vertical_remapping(ds, da, target, bounds, grid_point="t",
+                                 **kwargs):
+    """Remap a data array conservatively from depth levels to other layers.
+
+    The layers are bounded by values of any `target` coordinate (like
+    density, temperature, or depth).  Each cell is split between the layers
+    assuming that `target` varies linearly within the cell (see
+    `_remap_kernel`), so the thickness-weighted vertical integral of each
+    column is conserved (as long as `bounds` cover all values of `target`).
+    Non-monotonic profiles of `target` are allowed.
+
+    All columns of a chunk are remapped in one vectorized task.  The
+    vertical dim is merged into a single chunk, while the horizontal chunks
+    are kept, so the memory needed per task is bounded by the size of the
+    horizontal chunks.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    da : xarray data array
+        Data array living on `grid_point`.
+    target : xarray data array
+        Target coordinate on the same grid point as `da`.
+    bounds : array like
+        Increasing bounds of the layers in units of `target`.  Parts of cells
+        outside of all layers are left out.
+    grid_point : str
+        One of `"t"`, `"u"`, or `"v"`.  Defaults to `"t"`.
+
+    Returns
+    -------
+    xarray data array
+        The thickness-weighted mean of `da` per layer, along a new dim
+        `"layer"` (with the mid points of the layers as coordinate) in place
+        of the vertical dim.  The thickness of the layers in `[m]` is added as
+        coordinate `"e3_layer"`.  Empty layers are NaN.
+
+    """
+    bounds = np.asarray(bounds, dtype=np.float64)
+    weights = calculate_thickness_weights(ds, grid_point, **kwargs)
+    z_dim = weights.dims[0]
+
+    arrays = []
+    for a in [unpack(da), target, weights]:
+        a = a.reset_coords(drop=True)
+        if a.chunks is not None:
+            a = a.chunk({z_dim: -1})
+        arrays.append(a)
+
+    content, thickness = xr.apply_ufunc(
+        _remap_kernel, *arrays,
+        kwargs={"bounds": bounds},
+        input_core_dims=[[z_dim], [z_dim], [z_dim]],
+        output_core_dims=[["layer"], ["layer"]],
+        dask="parallelized",
+        output_dtypes=[np.float64, np.float64],
+        dask_gufunc_kwargs={"output_sizes": {"layer": len(bounds) - 1}})
+
+    dtype = np.result_type(da.dtype, np.float32)
+    remapped = (content / thickness.where(thickness > 0)).astype(dtype)
+    remapped = remapped.assign_coords(e3_layer=thickness).transpose(
+        *["layer" if d == z_dim else d for d in da.dims
+          if d == z_dim or d in remapped.dims], ...)
+    remapped = _assign_index_coords(remapped, ds)
+    remapped.coords["layer"] = 0.5 * (bounds[:-1] + bounds[1:])
+    return remapped.rename(da.name)
 
 
 def calculate_moc(ds, region=""):
@@ -11,8 +340,8 @@ def calculate_moc(ds, region=""):
     ds : xarray dataset
         A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
     region : str
-        A region string.  Examples: `"atl"`, `"pac"`, `"ind"`.
-        Defaults to `""`.
+        A region string.  Examples: `"atl"`, `"pac"`, `"ind"`, or any region
+        added with `xorca.regions.add_region_masks`.  Defaults to `""`.
 
     Returns
     -------
@@ -23,26 +352,29 @@ def calculate_moc(ds, region=""):
         latitudes for the given point on the y-axis.
 
     """
-    grid = xgcm.Grid(ds, periodic=["Y", "X"])
+    grid = get_grid(ds)
 
     vmaskname = "vmask" + region
     mocname = "moc" + region
     latname = "lat_moc" + region
 
-    weights = ds[vmaskname] * ds.e3v * ds.e1v
+    weights = (ds.e3v * ds.e1v).where(ds[vmaskname].astype(bool), 0)
 
-    Ve3 = weights * ds.vomecrty
+    Ve3 = weights * unpack(ds.vomecrty)
 
-    # calculate indefinite vertical integral of V from bottom to top, then
-    # integrate zonally, convert to [Sv], and rename to region
-    moc = grid.cumsum(Ve3, "Z", to="left", boundary="fill") - Ve3.sum("z_c")
-    moc = moc.sum("x_c")
+    # integrate zonally, then calculate indefinite vertical integral of V
+    # from bottom to top, convert to [Sv], and rename to region
+    Ve3 = _sum(Ve3, "x_c")
+    moc = (_cumsum(grid, Ve3, "Z", to="left", boundary="fill") -
+           _sum(Ve3, "z_c"))
     moc /= 1.0e6
     moc = moc.rename(mocname)
 
     # calculate the weighted zonal and vertical mean of latitude
-    lat_moc = ((weights * ds.llat_rc).sum(dim=["z_c", "x_c"]) /
-               (weights).sum(dim=["z_c", "x_c"]))
+    if "t" in weights.dims:
+        weights = weights.isel(t=0)
+    lat_moc = (_sum(weights * ds.llat_rc, ["z_c", "x_c"]) /
+               _sum(weights, ["z_c", "x_c"]))
     moc.coords[latname] = (["y_r", ], lat_moc.data)
 
     # also copy the relevant depth-coordinates
@@ -51,25 +383,144 @@ def calculate_moc(ds, region=""):
     return moc
 
 
-def calculate_psi(ds):
+@lru_cache(maxsize=4)
+def _get_psi_lsq_solver(shape, wet_u_bits, wet_v_bits, land_weight=100.0):
+    """Factorize the least-squares problem for psi on the F points.
+
+    Each U face relates the F points south and north of it and each V face
+    relates the F points west and east of it (periodically in X).  South of
+    the first row, psi vanishes.  Dry faces enforce (with a weight of
+    `land_weight`) that there is no flow through the coasts, so each island
+    gets a single value of psi which fits the flow around it best.
+
+    The masks of the wet U and V faces are given as packed bits (see
+    `np.packbits`), so that the factorization is cached per mask in each
+    process.  Returns a function mapping the transports through the U and V
+    faces (with the horizontal dims last) to psi.
+    """
+    from scipy import sparse
+    from scipy.sparse.linalg import factorized
+
+    N_y, N_x = shape
+    wet_u = np.unpackbits(np.frombuffer(wet_u_bits, dtype=np.uint8),
+                          count=N_y * N_x)
+    wet_v = np.unpackbits(np.frombuffer(wet_v_bits, dtype=np.uint8),
+                          count=N_y * N_x)
+    index = np.arange(N_y * N_x).reshape(N_y, N_x)
+
+    # U faces: psi[j - 1, i] - psi[j, i] = U_flux[j, i]
+    u_rows = np.concatenate([index.ravel(), index[1:].ravel()])
+    u_cols = np.concatenate([index.ravel(), index[:-1].ravel()])
+    u_vals = np.concatenate([-np.ones(N_y * N_x),
+                             np.ones((N_y - 1) * N_x)])
+    # V faces: psi[j, i] - psi[j, i - 1] = V_flux[j, i]
+    v_rows = N_y * N_x + np.concatenate([index.ravel(), index.ravel()])
+    v_cols = np.concatenate([index.ravel(),
+                             np.roll(index, 1, axis=-1).ravel()])
+    v_vals = np.concatenate([np.ones(N_y * N_x), -np.ones(N_y * N_x)])
+
+    weights = np.where(np.concatenate([wet_u, wet_v]), 1.0, land_weight)
+    A = sparse.csr_matrix(
+        (np.concatenate([u_vals, v_vals]),
+         (np.concatenate([u_rows, v_rows]), np.concatenate([u_cols, v_cols]))),
+        shape=(2 * N_y * N_x, N_y * N_x))
+    A = sparse.diags(weights) @ A
+    solve = factorized((A.T @ A).tocsc())
+
+    def _solve_psi(U_flux, V_flux):
+        shape = U_flux.shape
+        b = np.concatenate([U_flux.reshape(-1, N_y * N_x),
+                            V_flux.reshape(-1, N_y * N_x)], axis=-1)
+        b = np.nan_to_num(b) * weights
+        psi = np.stack([solve(A.T @ b_t) for b_t in b])
+        return psi.reshape(shape)
+
+    return _solve_psi
+
+
+def _solve_psi_lsq(U_flux, V_flux, wet_u, wet_v):
+    """Solve for psi of all transports with the masks of one chunk.
+
+    Only the masks pass through the graph.  The solver is created (and
+    cached) in the process computing the chunk.
+    """
+    shape = U_flux.shape[-2:]
+    wet_u = np.reshape(wet_u, shape).astype(bool)
+    wet_v = np.reshape(wet_v, shape).astype(bool)
+    solve = _get_psi_lsq_solver(shape, np.packbits(wet_u).tobytes(),
+                                np.packbits(wet_v).tobytes())
+    return solve(U_flux, V_flux)
+
+
+def calculate_psi(ds, integrate_along="Y"):
     """Calculate the barotropic stream function.
 
+    With `U = - d psi / dy` and `V = d psi / dx`, psi can be obtained by
+    integrating the transports along either axis.  This is exact for a
+    divergence-free (barotropic) flow.  The least-squares solution (solving
+    the Poisson problem for psi) is the best fit of the rotational flow if the
+    transports are not divergence free (like for time means of runs with a
+    free surface) and gives each island the value of psi that fits the flow
+    around it best.
+
     Parameters
     ----------
     ds : xarray dataset
         A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    integrate_along : str
+        `"Y"` integrates the zonal transports northward from the southern
+        boundary.  `"X"` integrates the meridional transports eastward from
+        the first column (which is integrated along Y).  `"lsq"` solves the
+        least-squares problem for all transports (see `_get_psi_lsq_solver`)
+        for one time step at a time.  This needs `scipy`.  Default is `"Y"`.
 
     Returns
     -------
     psi : xarray data array
         A grid-aware data array with the barotropic stream function in `[Sv]`.
+        It vanishes at the upper right corner.
 
     """
-    grid = xgcm.Grid(ds, periodic=["Y", "X"])
+    U_flux = (calculate_vertical_integral(ds, ds.vozocrtx, "u") *
+              ds.e2u.reset_coords(drop=True))
+
+    if integrate_along == "Y":
+        psi = _prefix_sum(- U_flux, "y_c", ds.y_r)
+
+    elif integrate_along in ("X", "lsq"):
+        V_flux = (calculate_vertical_integral(ds, ds.vomecrty, "v") *
+                  ds.e1v.reset_coords(drop=True))
+
+        if integrate_along == "X":
+            psi_west = _prefix_sum(- U_flux.isel(x_r=[0, ]), "y_c",
+                                   ds.y_r)
+            psi = (_prefix_sum(V_flux, "x_c", ds.x_r) -
+                   V_flux.isel(x_c=0, drop=True))
+            psi = psi + psi_west.isel(x_r=0, drop=True)
 
-    U_bt = (ds.vozocrtx * ds.e3u).sum("z_c")
+        else:
+            wet_u = ds.umask.astype(bool).any("z_c").reset_coords(drop=True)
+            wet_v = ds.vmask.astype(bool).any("z_c").reset_coords(drop=True)
+            if U_flux.chunks:
+                U_flux = U_flux.chunk({"y_c": -1, "x_r": -1})
+                V_flux = V_flux.chunk({"y_r": -1, "x_c": -1})
+            if wet_u.chunks:
+                wet_u = wet_u.chunk({"y_c": -1, "x_r": -1})
+                wet_v = wet_v.chunk({"y_r": -1, "x_c": -1})
+            psi = xr.apply_ufunc(
+                _solve_psi_lsq, U_flux, V_flux, wet_u, wet_v,
+                input_core_dims=[["y_c", "x_r"], ["y_r", "x_c"],
+                                 ["y_c", "x_r"], ["y_r", "x_c"]],
+                output_core_dims=[["y_r", "x_r"]],
+                dask="parallelized",
+                output_dtypes=[np.float64]).astype(U_flux.dtype)
 
-    psi = grid.cumsum(- U_bt * ds.e2u, "Y") / 1.0e6
+    else:
+        raise ValueError(
+            "integrate_along has to be one of 'Y', 'X', or 'lsq', not "
+            "{!r}.".format(integrate_along))
+
+    psi = psi / 1.0e6
     psi -= psi.isel(y_r=-1, x_r=-1)  # normalize upper right corner
     psi = psi.rename("psi")
 
@@ -93,11 +544,408 @@ def calculate_speed(ds):
         A grid-aware data array with the speed in `[m/s]`.
 
     """
-    grid = xgcm.Grid(ds, periodic=["Y", "X"])
+    grid = get_grid(ds)
 
-    U_cc = grid.interp(ds.vozocrtx, "X", to="center")
-    V_cc = grid.interp(ds.vomecrty, "Y", to="center")
+    U_cc = grid.interp(unpack(ds.vozocrtx), "X", to="center")
+    V_cc = grid.interp(unpack(ds.vomecrty), "Y", to="center")
 
     speed = (U_cc**2 + V_cc**2)**0.5
 
     return speed
+
+
+def _get_fold_type(ds, fold_type):
+    """Detect the fold type for `fold_type="auto"`.  None if there is none."""
+    if fold_type != "auto":
+        return fold_type
+    try:
+        return get_fold_type(ds)
+    except (ValueError, AttributeError):
+        return None
+
+
+def _apply_stencil(kernel, arrays, y_dim, x_dim):
+    """Apply a horizontal stencil to all chunks in one task per chunk.
+
+    All arrays are broadcast against each other on common horizontal dims.
+    For dask arrays, each chunk gets a halo of one point from its neighbours
+    with `dask.array.map_overlap` (periodic in X and filled with zero
+    outside of Y).  Then, `kernel` computes the result for the chunk and its
+    halo in one go, and the halo is trimmed again.  NumPy arrays are padded
+    the same way.
+
+    Parameters
+    ----------
+    kernel : callable
+        Maps blocks (with halos) of all `arrays` to a block of the result of
+        the same shape.  The horizontal dims are the last two dims.  Values
+        in the outermost rows and columns are discarded.
+    arrays : sequence
+        Data arrays on any of the horizontal grid points.
+    y_dim, x_dim : str
+        Horizontal dims of the result.
+
+    Returns
+    -------
+    xarray data array
+        Without coordinates.
+
+    """
+    horizontal = {"y_c": "y", "y_r": "y", "x_c": "x", "x_r": "x"}
+    arrays = [xr.DataArray(a.data, dims=[horizontal.get(d, d)
+                                         for d in a.dims])
+              for a in arrays]
+    arrays = xr.broadcast(*arrays)
+    dims = [d for d in arrays[0].dims if d not in ("y", "x")] + ["y", "x"]
+    data = [a.transpose(*dims).data for a in arrays]
+    dtype = np.result_type(*data)
+    n = len(dims)
+
+    import dask
+
+    if any(dask.is_dask_collection(d) for d in data):
+        import dask.array as dsa
+        result = dsa.map_overlap(
+            kernel, *[dsa.asarray(d) for d in data],
+            depth={n - 2: 1, n - 1: 1},
+            boundary={n - 2: 0, n - 1: "periodic"},
+            dtype=dtype, align_arrays=True)
+    else:
+        def _pad(d):
+            d = np.pad(d, [(0, 0)] * (n - 2) + [(1, 1), (0, 0)])
+            return np.pad(d, [(0, 0)] * (n - 1) + [(1, 1)], mode="wrap")
+        result = kernel(*[_pad(d) for d in data])[..., 1:-1, 1:-1]
+
+    return xr.DataArray(result, dims=dims[:-2] + [y_dim, x_dim])
+
+
+def _assign_index_coords(da, ds):
+    return da.assign_coords({d: ds[d] for d in da.dims if d in ds.coords})
+
+
+def _vorticity_kernel(u, v, e1u, e2v, e1f, e2f, fmask):
+    # circulation around the F points north-east of the T points
+    ue = e1u * u
+    ve = e2v * v
+    zeta = np.zeros(ue.shape, dtype=np.result_type(ue, ve, e1f))
+    zeta[..., :-1, :-1] = (ve[..., :-1, 1:] - ve[..., :-1, :-1] -
+                           ue[..., 1:, :-1] + ue[..., :-1, :-1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        zeta /= e1f * e2f
+    return np.where(fmask > 0, zeta, np.nan)
+
+
+def _divergence_kernel(u, v, e2u, e3u, e1v, e3v, e1t, e2t, e3t, tmask):
+    # net transport out of the T cells
+    ue = e2u * e3u * u
+    ve = e1v * e3v * v
+    div = np.zeros(ue.shape, dtype=np.result_type(ue, ve, e3t))
+    div[..., 1:, 1:] = (ue[..., 1:, 1:] - ue[..., 1:, :-1] +
+                        ve[..., 1:, 1:] - ve[..., :-1, 1:])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        div /= e1t * e2t * e3t
+    return np.where(tmask > 0, div, np.nan)
+
+
+def _eke_kernel(u, u_mean, v, v_mean, tmask):
+    u2 = (u - u_mean) ** 2
+    v2 = (v - v_mean) ** 2
+    eke = np.zeros(u2.shape, dtype=np.result_type(u2, v2))
+    eke[..., 1:, 1:] = 0.25 * (u2[..., 1:, 1:] + u2[..., 1:, :-1] +
+                               v2[..., 1:, 1:] + v2[..., :-1, 1:])
+    return np.where(tmask > 0, eke, np.nan)
+
+
+def calculate_vorticity(ds, fold_type="auto"):
+    """Calculate the relative vorticity on the F grid.
+
+    The vorticity is the circulation around each F point divided by the area
+    of the F cell.  It is computed in one fused stencil per chunk (see
+    `_apply_stencil`).
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    fold_type : str
+        `"T"` or `"F"` for the north fold of the ORCA grids (see
+        `xorca.halo.get_fold_type`), or None for a closed northern boundary.
+        Default is `"auto"`, which detects the fold type or assumes a closed
+        boundary if there is no fold.
+
+    Returns
+    -------
+    zeta : xarray data array
+        A grid-aware data array with the relative vorticity in `[1/s]`.  Land
+        points (where `fmask` is zero) are NaN.
+
+    """
+    fold_type = _get_fold_type(ds, fold_type)
+
+    arrays = [unpack(ds.vozocrtx), unpack(ds.vomecrty),
+              ds.e1u, ds.e2v, ds.e1f, ds.e2f, ds.fmask]
+    if fold_type is not None:
+        # the vorticity of the last row needs U north of the fold
+        signs = [-1.0, -1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+        arrays = [pad_north_fold(a, fold_type, sign=sign)
+                  for a, sign in zip(arrays, signs)]
+
+    zeta = _apply_stencil(_vorticity_kernel, arrays, "y_r", "x_r")
+    zeta = zeta.isel(y_r=slice(0, ds.sizes["y_r"]))
+    return _assign_index_coords(zeta, ds).rename("zeta")
+
+
+def calculate_divergence(ds):
+    """Calculate the horizontal divergence on the central (T) grid.
+
+    The divergence is the net transport out of each T cell divided by the
+    volume of the cell.  It is computed in one fused stencil per chunk (see
+    `_apply_stencil`).
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+
+    Returns
+    -------
+    div : xarray data array
+        A grid-aware data array with the horizontal divergence in `[1/s]`.
+        Land points (where `tmask` is zero) are NaN.
+
+    """
+    arrays = [unpack(ds.vozocrtx), unpack(ds.vomecrty),
+              ds.e2u, ds.e3u, ds.e1v, ds.e3v, ds.e1t, ds.e2t, ds.e3t,
+              ds.tmask]
+    div = _apply_stencil(_divergence_kernel, arrays, "y_c", "x_c")
+    return _assign_index_coords(div, ds).rename("div")
+
+
+def calculate_eke(ds, mean=None):
+    """Calculate the eddy kinetic energy on the central (T) grid.
+
+    The squared velocity anomalies are averaged from the U and V points
+    around each T point.  This is computed in one fused stencil per chunk
+    (see `_apply_stencil`).
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    mean : xarray dataset
+        Mean velocities `vozocrtx` and `vomecrty` the anomalies are relative
+        to.  Defaults to the mean over `"t"` of `ds`.
+
+    Returns
+    -------
+    eke : xarray data array
+        A grid-aware data array with the eddy kinetic energy in `[m2/s2]`.
+        Land points (where `tmask` is zero) are NaN.
+
+    """
+    u = unpack(ds.vozocrtx)
+    v = unpack(ds.vomecrty)
+    if mean is None:
+        u_mean, v_mean = u.mean("t"), v.mean("t")
+    else:
+        u_mean, v_mean = unpack(mean.vozocrtx), unpack(mean.vomecrty)
+
+    eke = _apply_stencil(_eke_kernel, [u, u_mean, v, v_mean, ds.tmask],
+                         "y_c", "x_c")
+    return _assign_index_coords(eke, ds).rename("eke")
+
+
+def _colocate(ds, da, target_dims, fold_type=None):
+    """Interpolate `da` to the horizontal grid points of `target_dims`."""
+    for axis, center, right in [("Y", "y_c", "y_r"), ("X", "x_c", "x_r")]:
+        for here, there in [(center, right), (right, center)]:
+            if here in da.dims and there in target_dims:
+                da = interp(ds, da, axis, fold_type=fold_type)
+    return da
+
+
+class StreamingMoments(object):
+    """Accumulate means and covariances in one pass over the time steps.
+
+    The time steps are processed in blocks.  For each block, the means and
+    the co-moments (sums of products of the anomalies) are computed in one
+    pass over the data and then merged into the totals with the pairwise
+    update of Chan et al. (1979).  This is numerically stable even for
+    small anomalies of large means (like temperatures).
+
+    For products of variables on different grid points, the second variable
+    is interpolated to the grid points of the first one (aware of the north
+    fold, see `xorca.halo.interp`).  Use a scalar as the second variable.
+
+    The state can be written to and read from netCDF files, so a job can be
+    resumed after it was killed:
+    ```python
+    try:
+        moments = StreamingMoments.from_netcdf("moments.nc")
+    except FileNotFoundError:
+        moments = StreamingMoments()
+    moments.update(ds, checkpoint="moments.nc")
+    vT_eddy = moments.covariance("vomecrty", "votemper")
+    ```
+
+    Parameters
+    ----------
+    variables : sequence
+        Names of the variables to calculate means for.
+    products : sequence
+        Pairs of names of the variables to calculate covariances for.
+        Defaults to the eddy heat fluxes `u'T'` and `v'T'` and the variances
+        of `u` and `v` (for the eddy kinetic energy).
+    fold_type : str
+        Passed on to `xorca.halo.interp`.  Default is `"auto"` (see
+        `calculate_vorticity`).
+
+    Attributes
+    ----------
+    n : int
+        Number of time steps accumulated so far.
+    t_last : numpy datetime64 | cftime datetime
+        Last time step accumulated so far.  Earlier time steps are skipped by
+        `update`.
+    state : xarray dataset
+        The means (`mean_{name}`) and co-moments (`comoment_{name}_{name}`).
+
+    """
+
+    def __init__(self, variables=(), products=None, fold_type="auto"):
+        if products is None:
+            products = [("vozocrtx", "votemper"), ("vomecrty", "votemper"),
+                        ("vozocrtx", "vozocrtx"), ("vomecrty", "vomecrty")]
+        self.products = [tuple(p) for p in products]
+        self.variables = list(dict.fromkeys(
+            list(variables) + [v for p in self.products for v in p]))
+        self.fold_type = fold_type
+        self.n = 0
+        self.t_last = None
+        self.state = None
+
+    def _get_block_moments(self, ds, fold_type):
+        import dask
+
+        means = {v: unpack(ds[v]).reset_coords(drop=True).mean("t")
+                 for v in self.variables}
+        comoments = {}
+        for a, b in self.products:
+            anomaly_a = unpack(ds[a]).reset_coords(drop=True) - means[a]
+            anomaly_b = _colocate(
+                ds, unpack(ds[b]).reset_coords(drop=True) - means[b],
+                ds[a].dims, fold_type=fold_type)
+            comoments[a, b] = (anomaly_a * anomaly_b).sum("t")
+        return dask.compute(means, comoments)
+
+    def _merge(self, ds, n_block, means, comoments, fold_type):
+        if self.state is None:
+            self.state = xr.Dataset(
+                {**{"mean_" + v: m for v, m in means.items()},
+                 **{"comoment_{}_{}".format(a, b): c
+                    for (a, b), c in comoments.items()}})
+            return
+
+        n = self.n + n_block
+        deltas = {v: means[v] - self.state["mean_" + v]
+                  for v in self.variables}
+        for a, b in self.products:
+            delta_b = _colocate(ds, deltas[b], ds[a].dims,
+                                fold_type=fold_type)
+            name = "comoment_{}_{}".format(a, b)
+            self.state[name] = (self.state[name] + comoments[a, b] +
+                                deltas[a] * delta_b * self.n * n_block / n)
+        for v in self.variables:
+            self.state["mean_" + v] = (self.state["mean_" + v] +
+                                       deltas[v] * n_block / n)
+
+    def update(self, ds, t_block=12, checkpoint=None):
+        """Accumulate all time steps of `ds` after `t_last`.
+
+        Parameters
+        ----------
+        ds : xarray dataset
+            A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+        t_block : int
+            Number of time steps per block.  Each block is read once.
+        checkpoint : Path | str
+            If given, the state is written to this netCDF file after each
+            block.  See `from_netcdf`.
+
+        Returns
+        -------
+        self
+
+        """
+        fold_type = _get_fold_type(ds, self.fold_type)
+        if self.t_last is not None:
+            ds = ds.sel(t=ds.t > self.t_last)
+
+        for start in range(0, ds.sizes["t"], t_block):
+            block = ds.isel(t=slice(start, start + t_block))
+            means, comoments = self._get_block_moments(block, fold_type)
+            self._merge(block, block.sizes["t"], means, comoments,
+                        fold_type)
+            self.n += block.sizes["t"]
+            self.t_last = block.t.values[-1]
+            if checkpoint is not None:
+                self.to_netcdf(checkpoint)
+
+        return self
+
+    def mean(self, name):
+        """Return the mean of variable `name`."""
+        return self.state["mean_" + name].rename(name)
+
+    def covariance(self, a, b):
+        """Return the covariance `<ab> - <a><b>` on the grid points of `a`."""
+        return (self.state["comoment_{}_{}".format(a, b)] /
+                self.n).rename("{}_{}".format(a, b))
+
+    def eke(self):
+        """Return the eddy kinetic energy on the central (T) grid.
+
+        This is the time mean of `calculate_eke`.  It needs the variances of
+        `vozocrtx` and `vomecrty`.
+        """
+        grid = get_grid(self.state)
+        var_u = grid.interp(self.covariance("vozocrtx", "vozocrtx"), "X")
+        var_v = grid.interp(self.covariance("vomecrty", "vomecrty"), "Y")
+        return (0.5 * (var_u + var_v)).rename("eke")
+
+    def to_netcdf(self, path):
+        """Write the state to a netCDF file.
+
+        The file is written next to `path` first and then moved, so an
+        existing state is never left half-written.  `t_last` is stored as a
+        time variable, so it keeps its calendar.
+        """
+        state = xr.Dataset() if self.state is None else self.state.copy()
+        if self.t_last is not None:
+            state["t_last"] = ((), self.t_last)
+        state.attrs["xorca_streaming_moments"] = json.dumps({
+            "variables": self.variables,
+            "products": self.products,
+            "fold_type": self.fold_type,
+            "n": self.n,
+        })
+        tmp_path = str(path) + ".tmp"
+        state.to_netcdf(tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_netcdf(cls, path):
+        """Read a state written with `to_netcdf`."""
+        with xr.open_dataset(path) as state:
+            state = state.load()
+        info = json.loads(state.attrs.pop("xorca_streaming_moments"))
+        moments = cls(variables=info["variables"],
+                      products=info["products"],
+                      fold_type=info["fold_type"])
+        moments.n = info["n"]
+        if "t_last" in state:
+            moments.t_last = state["t_last"].values[()]
+            state = state.drop_vars("t_last")
+        if state.data_vars:
+            moments.state = state
+        return moments
@@ -0,0 +1,265 @@
+"""Catalogs of the metadata of large sets of NEMO output files.
+
+Listing and opening tens of thousands of files just to learn which of them
+are needed takes long.  `scan_files` reads the dimensions, variables, and time
+range of all files concurrently (with a bounded number of threads) and
+returns a catalog table.  The loaders accept a catalog instead of a list of
+data files and open only the files with the requested variables (and time
+range):
+```python
+catalog = scan_files(glob("ORCA12-*_grid_?.nc"), max_workers=32)
+catalog.to_pickle("catalog.pkl")
+ds = load_xorca_dataset(data_files=catalog, aux_files=aux_files,
+                        variables=["votemper", "vomecrty"],
+                        t_start="1990-01-01", t_end="1999-12-31")
+```
+Without a catalog, the time ranges are taken from the file names if they
+follow the conventions of XIOS (see `get_time_range_from_file_name`).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from . import backends
+from .lib import get_name_dict, rename_dims
+
+
+# Columns of the catalogs
+catalog_columns = ["file", "grid", "t_start", "t_end", "n_t", "variables",
+                   "dims"]
+
+# Grid types in the names of files written by XIOS (like `*_grid_T.nc`)
+_grid_type_pattern = re.compile(r"grid_?([TUVW])(?![A-Za-z])")
+
+# First and last day in the names of files written by XIOS (like
+# `*_1d_19580101_19581231_grid_T.nc`), optionally with hours and minutes (and
+# seconds)
+_time_range_pattern = re.compile(
+    r"(?<!\d)(\d{8})(?:\d{4}|\d{6})?[_-](\d{8})(?:\d{4}|\d{6})?(?!\d)")
+
+
+def get_grid_type(path, dims, **kwargs):
+    """Find the grid type (`"T"`, `"U"`, `"V"`, or `"W"`) of a data file.
+
+    The grid type is taken from the file name if possible, and from the
+    vertical dimension (see `xorca.orca_names.grid_types`) otherwise.
+    Returns None if both fail.
+    """
+    match = _grid_type_pattern.search(os.path.basename(str(path)))
+    if match is not None:
+        return match.group(1)
+    grid_types = get_name_dict("grid_types", **kwargs)
+    for dim in dims:
+        if dim in grid_types:
+            return grid_types[dim]
+    return None
+
+
+def get_time_range_from_file_name(path):
+    """Find the first and the last day covered by a file from its name.
+
+    This follows the naming conventions of XIOS (like
+    `ORCA025_1d_19580101_19581231_grid_T.nc`).
+
+    Returns
+    -------
+    tuple | None
+        Timestamps of the first and of the last day, or None if the file name
+        does not contain a time range.
+
+    """
+    match = _time_range_pattern.search(os.path.basename(str(path)))
+    if match is None:
+        return None
+    try:
+        return (pd.Timestamp(match.group(1)), pd.Timestamp(match.group(2)))
+    except ValueError:
+        return None
+
+
+def select_files_by_name(files, t_start=None, t_end=None):
+    """Select the files with time steps in a time range from their names.
+
+    Files are left out if their names (see `get_time_range_from_file_name`)
+    show that all of their time steps are before `t_start` or after `t_end`.
+    All other files are selected.
+
+    Parameters
+    ----------
+    files : sequence
+        File names or paths of stores.
+    t_start, t_end : datetime like
+        Time range (including both ends).  Default is None (open ended).
+
+    Returns
+    -------
+    list
+
+    """
+    selected = []
+    for path in files:
+        time_range = get_time_range_from_file_name(path)
+        if time_range is not None:
+            first_day, last_day = time_range
+            if (t_start is not None and
+                    last_day + pd.Timedelta(days=1) <= pd.Timestamp(t_start)):
+                continue
+            if t_end is not None and first_day > pd.Timestamp(t_end):
+                continue
+        selected.append(path)
+    return selected
+
+
+def scan_file(path, open_dataset=backends.open_dataset, **kwargs):
+    """Read the metadata of a single file.
+
+    Only the header and the time coordinate are read.
+
+    Parameters
+    ----------
+    path : Path | str
+        File name or path of the store.
+    open_dataset : callable
+        Function opening the file.  Defaults to `xorca.backends.open_dataset`.
+
+    Returns
+    -------
+    dict
+        With an entry for each of `xorca.catalog.catalog_columns`.
+
+    """
+    with open_dataset(path) as ds:
+        ds = rename_dims(ds, **kwargs)
+        t_start = t_end = None
+        n_t = ds.sizes.get("t", 0)
+        if n_t > 0 and "t" in ds.coords:
+            t_start, t_end = ds.coords["t"].values[[0, -1]]
+        return {
+            "file": str(path),
+            "grid": get_grid_type(path, ds.dims, **kwargs),
+            "t_start": t_start,
+            "t_end": t_end,
+            "n_t": n_t,
+            "variables": tuple(sorted(str(v) for v in ds.data_vars)),
+            "dims": dict(ds.sizes),
+        }
+
+
+def scan_files(files, max_workers=16, errors="raise", open_dataset=None,
+               **kwargs):
+    """Read the metadata of many files concurrently.
+
+    Parameters
+    ----------
+    files : sequence
+        File names or paths of stores.
+    max_workers : int
+        Maximal number of files read at the same time.  Default is 16.
+    errors : str
+        With `"raise"` (default), the first file which cannot be read raises.
+        With `"warn"`, such files are left out of the catalog with a warning.
+    open_dataset : callable
+        See `scan_file`.
+
+    Returns
+    -------
+    pandas data frame
+        With one row per file, sorted by grid type and start time, and the
+        columns `catalog_columns`.
+
+    """
+    if open_dataset is None:
+        open_dataset = backends.open_dataset
+
+    def _scan(path):
+        try:
+            return scan_file(path, open_dataset=open_dataset, **kwargs)
+        except Exception as e:
+            if errors == "raise":
+                raise
+            warnings.warn("Could not scan {}: {}".format(path, e),
+                          RuntimeWarning)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = [row for row in executor.map(_scan, files) if row is not None]
+
+    catalog = pd.DataFrame(rows, columns=catalog_columns)
+    for column in ["t_start", "t_end"]:
+        try:
+            catalog[column] = pd.to_datetime(catalog[column])
+        except (TypeError, ValueError):
+            pass  # keep non-standard calendars as they are
+    return catalog.sort_values(["grid", "t_start", "file"],
+                               na_position="first").reset_index(drop=True)
+
+
+def is_catalog(obj):
+    """Is `obj` a catalog as returned by `scan_files`?"""
+    return isinstance(obj, pd.DataFrame) and "file" in obj.columns
+
+
+def _get_comparable_times(times, t):
+    """Return a column of times of a catalog and `t` in the same calendar.
+
+    Times of non-standard calendars are kept as cftime dates by `scan_files`.
+    Then, `t` is converted to a date of the same calendar, and missing times
+    are replaced by `t`.
+    """
+    calendars = {v.calendar for v in times.dropna() if hasattr(v, "calendar")}
+    if not calendars:
+        return pd.to_datetime(times), pd.Timestamp(t)
+    if not isinstance(t, str):
+        t = (t if hasattr(t, "calendar") else pd.Timestamp(t)).isoformat()
+    t = xr.date_range(t, periods=1, calendar=calendars.pop(),
+                      use_cftime=True)[0]
+    return times.where(times.notna(), t), t
+
+
+def select_files(catalog, variables=None, t_start=None, t_end=None,
+                 grid=None):
+    """Select the files needed for some variables and a time range.
+
+    Parameters
+    ----------
+    catalog : pandas data frame
+        As returned by `scan_files`.
+    variables : sequence
+        Only select files containing at least one of these variables.
+        Default is None (all files).
+    t_start, t_end : datetime like
+        Only select files with time steps overlapping this range (including
+        both ends).  Files without a time dimension are always selected.
+        Strings are read as dates of the calendar of the catalog.  Default is
+        None (open ended).
+    grid : str | sequence
+        Only select files of these grid types.  Default is None (all files).
+
+    Returns
+    -------
+    list
+        File names.
+
+    """
+    selected = np.ones(len(catalog), dtype=bool)
+    if variables is not None:
+        variables = set(variables)
+        selected &= catalog["variables"].map(
+            lambda file_vars: bool(variables.intersection(file_vars))).values
+    has_time = catalog["t_start"].notna().values
+    if t_start is not None:
+        t_ends, t_start = _get_comparable_times(catalog["t_end"], t_start)
+        selected &= ~has_time | (t_ends >= t_start).values
+    if t_end is not None:
+        t_starts, t_end = _get_comparable_times(catalog["t_start"], t_end)
+        selected &= ~has_time | (t_starts <= t_end).values
+    if grid is not None:
+        if isinstance(grid, str):
+            grid = [grid, ]
+        selected &= catalog["grid"].isin(grid).values
+    return list(catalog["file"][selected])
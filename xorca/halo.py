@@ -0,0 +1,208 @@
+"""North-fold aware halos and grid operations for ORCA tripolar grids.
+
+The northern boundary of the ORCA grids is a fold: Rows beyond the last row
+are rows south of it, mirrored in X.  Depending on the configuration, the
+pivot points of the fold are T points (e.g., ORCA2 and ORCA025) or F points
+(e.g., ORCA1 and ORCA05).  See `lbc_nfd` in NEMO.
+"""
+
+import numpy as np
+import xarray as xr
+
+
+# Fold types for the values of the NEMO namelist parameter `jperio`.
+jperio_fold_types = {3: "T", 4: "T", 5: "F", 6: "F"}
+
+# Grid points of the horizontal dimensions of the grid-aware data sets.
+grid_points = {
+    ("y_c", "x_c"): "t",
+    ("y_c", "x_r"): "u",
+    ("y_r", "x_c"): "v",
+    ("y_r", "x_r"): "f",
+}
+
+# Source of the halo row north of the (trimmed) grid per fold type and grid
+# point: the row (counted from the north) and the offset of the mirrored
+# column.  The halo at column `i` is the source row at column
+# `(offset - i) % N_x`.
+fold_sources = {
+    "T": {"t": (-2, 0), "u": (-2, -1), "v": (-3, 0), "f": (-3, -1)},
+    "F": {"t": (-1, -1), "u": (-1, -2), "v": (-2, -1), "f": (-2, -2)},
+}
+
+
+def _get_grid_point(da):
+    y_dim = "y_r" if "y_r" in da.dims else "y_c"
+    x_dim = "x_r" if "x_r" in da.dims else "x_c"
+    return y_dim, x_dim, grid_points[(y_dim, x_dim)]
+
+
+def get_fold_type(ds):
+    """Find the fold type of the north fold of a (trimmed) ORCA grid.
+
+    If there is a variable or an attribute `jperio`, the fold type is taken
+    from there.  Otherwise, it is detected from the symmetry of the
+    coordinates along the last row of the grid:  With T-point pivots, the
+    last row of T points maps onto itself at columns `i` and `N_x - i`.  With
+    F-point pivots, the last row of V points maps onto itself at columns `i`
+    and `N_x - i - 1`.  Both the latitudes and the longitudes (modulo 360)
+    have to be symmetric, because the last row of many grids without a fold
+    (like regular grids or regional windows) has constant latitudes.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+
+    Returns
+    -------
+    str | None
+        `"T"` or `"F"`, or None if there is no north fold (or if it cannot be
+        detected).
+
+    """
+    jperio = ds.attrs.get("jperio", ds.get("jperio"))
+    if jperio is not None:
+        return jperio_fold_types.get(int(jperio))
+
+    def _is_symmetric(row, offset, period=None):
+        difference = row - row[(offset - np.arange(row.size)) % row.size]
+        if period is not None:
+            difference = (difference + period / 2) % period - period / 2
+        return np.allclose(difference, 0)
+
+    for fold_type, lon, lat, y_dim, offset in [
+            ("T", "llon_cc", "llat_cc", "y_c", 0),
+            ("F", "llon_rc", "llat_rc", "y_r", -1)]:
+        if lon not in ds.variables or lat not in ds.variables:
+            continue
+        if (_is_symmetric(ds[lat].isel({y_dim: -1}).values, offset) and
+                _is_symmetric(ds[lon].isel({y_dim: -1}).values, offset,
+                              period=360.0)):
+            return fold_type
+    return None
+
+
+def get_north_fold_halo(da, fold_type, sign=1.0):
+    """Return the row north of the last row of `da`.
+
+    This is a vectorized index permutation of one of the last rows.  Only
+    chunks at the northern end of `da` are involved.
+
+    Parameters
+    ----------
+    da : xarray data array
+        Variable on any of the horizontal grid points.
+    fold_type : str
+        `"T"` or `"F"`.  See `get_fold_type`.
+    sign : float
+        Use `-1.0` for the components of vectors, which change their
+        direction across the fold.
+
+    Returns
+    -------
+    xarray data array
+        With one row along `"y_c"` or `"y_r"`.  The coordinate is the one of
+        the last row plus one.
+
+    """
+    y_dim, x_dim, grid_point = _get_grid_point(da)
+    row, offset = fold_sources[fold_type][grid_point]
+
+    N_x = da.sizes[x_dim]
+    columns = (offset - np.arange(N_x)) % N_x
+
+    da = da.reset_coords(drop=True)
+    halo = sign * da.isel({y_dim: [row, ]}).isel({x_dim: columns})
+    halo = halo.assign_coords({y_dim: da[y_dim].values[-1:] + 1,
+                               x_dim: da[x_dim].values})
+    return halo
+
+
+def pad_north_fold(da, fold_type, sign=1.0):
+    """Append the halo row of the north fold to `da`.
+
+    See `get_north_fold_halo` for the parameters.
+    """
+    y_dim, _, _ = _get_grid_point(da)
+    return xr.concat([da.reset_coords(drop=True),
+                      get_north_fold_halo(da, fold_type, sign=sign)],
+                     dim=y_dim)
+
+
+def get_grid(ds):
+    """Create an xgcm grid with the boundaries of the ORCA grids.
+
+    X is periodic.  Y and Z are not:  South of the first row and below the
+    last level, values are filled with zero.  Operations from `"y_c"` to
+    `"y_r"` which need the north fold are done with `diff` and `interp`.
+    """
+    import xgcm
+
+    return xgcm.Grid(ds, periodic=["X"],
+                     boundary={"Y": "fill", "Z": "fill"},
+                     fill_value={"Y": 0.0, "Z": 0.0})
+
+
+def _get_north_neighbours(ds, da, fold_type, sign):
+    """Return `da` and its northern neighbours, both on `"y_r"`."""
+    if fold_type == "auto":
+        fold_type = get_fold_type(ds)
+    here = da.reset_coords(drop=True)
+    if fold_type is None:
+        north = here.shift(y_c=-1, fill_value=0)
+    else:
+        north = pad_north_fold(here, fold_type, sign=sign).isel(
+            y_c=slice(1, None))
+
+    def _to_y_r(da):
+        return da.drop_vars("y_c").rename(y_c="y_r").assign_coords(
+            y_r=ds.y_r)
+
+    return _to_y_r(here), _to_y_r(north)
+
+
+def diff(ds, da, axis, fold_type="auto", sign=1.0, **kwargs):
+    """Difference to the neighbouring grid points, aware of the north fold.
+
+    Like `xgcm.Grid.diff` with the grid of `get_grid`.  Differences from
+    `"y_c"` to `"y_r"` use the halo of the north fold for the last row.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    da : xarray data array
+        Variable to difference.
+    axis : str
+        `"X"`, `"Y"`, or `"Z"`.
+    fold_type : str
+        `"T"` or `"F"`, or None for a closed northern boundary.  Default is
+        `"auto"`, which detects the fold type with `get_fold_type` (and
+        assumes a closed boundary if there is no fold).
+    sign : float
+        Use `-1.0` for the components of vectors.
+    **kwargs
+        Passed on to `xgcm.Grid.diff` for all other cases.
+
+    Returns
+    -------
+    xarray data array
+
+    """
+    if axis == "Y" and "y_c" in da.dims:
+        here, north = _get_north_neighbours(ds, da, fold_type, sign)
+        return north - here
+    return get_grid(ds).diff(da, axis, **kwargs)
+
+
+def interp(ds, da, axis, fold_type="auto", sign=1.0, **kwargs):
+    """Interpolate to the neighbouring grid points, aware of the north fold.
+
+    Like `xgcm.Grid.interp` with the grid of `get_grid`.  See `diff` for the
+    parameters.
+    """
+    if axis == "Y" and "y_c" in da.dims:
+        here, north = _get_north_neighbours(ds, da, fold_type, sign)
+        return 0.5 * (north + here)
+    return get_grid(ds).interp(da, axis, **kwargs)
@@ -1,9 +1,51 @@
 """Library for the conversion from NEMO output to XGCM data sets."""
 
+import functools
+import os
+import warnings
+
 import numpy as np
 import xarray as xr
 
-from . import orca_names
+from . import backends, cache, orca_names, profiling
+
+
+# Opened and preprocessed aux files (and grid templates) of earlier loads.
+# Change the bounds with `mesh_cache.resize(max_entries=..., max_bytes=...)`.
+mesh_cache = cache.LRUCache(max_entries=8, max_bytes=2 ** 30)
+
+
+def get_trimming_slices(model_config="GLOBAL", y_slice=None, x_slice=None,
+                        **kwargs):
+    """Return the slices used for trimming along `"y"` and `"x"`.
+
+    See `trim_and_squeeze` for the parameters.
+
+    Returns
+    -------
+    dict
+        With a slice for each of `"y"` and `"x"` which will be trimmed.
+
+    """
+    # Be case-insensitive
+    if isinstance(model_config, str):
+        model_config = model_config.upper()
+
+    how_to_trim = {
+        "GLOBAL": {"y": (1, -1), "x": (1, -1)},
+        "NEST": {},
+    }
+
+    yx_slice_dict = how_to_trim.get(
+        model_config, {})
+    if y_slice is None:
+        y_slice = yx_slice_dict.get("y")
+    if x_slice is None:
+        x_slice = yx_slice_dict.get("x")
+
+    return {dim: slice(*dim_slice)
+            for dim, dim_slice in [("y", y_slice), ("x", x_slice)]
+            if dim_slice is not None}
 
 
 def trim_and_squeeze(ds,
@@ -37,35 +79,20 @@ def trim_and_squeeze(ds,
     trimmed ds
 
     """
-
-    # Be case-insensitive
-    if isinstance(model_config, str):
-        model_config = model_config.upper()
-
-    how_to_trim = {
-        "GLOBAL": {"y": (1, -1), "x": (1, -1)},
-        "NEST": {},
-    }
-
-    yx_slice_dict = how_to_trim.get(
-        model_config, {})
-    if y_slice is None:
-        y_slice = yx_slice_dict.get("y")
-    if x_slice is None:
-        x_slice = yx_slice_dict.get("x")
-
-    if (y_slice is not None) and ("y" in ds.dims):
-        ds = ds.isel(y=slice(*y_slice))
-    if (x_slice is not None) and ("x" in ds.dims):
-        ds = ds.isel(x=slice(*x_slice))
+    trimming_slices = get_trimming_slices(model_config=model_config,
+                                          y_slice=y_slice, x_slice=x_slice)
+    ds = ds.isel({dim: dim_slice
+                  for dim, dim_slice in trimming_slices.items()
+                  if dim in ds.dims})
 
     def _is_singleton(ds, dim):
         return (ds[dim].size == 1)
 
     def _is_time_dim(ds, dim):
+        # times of non-standard calendars are cftime dates
         return (dim in orca_names.t_dims and
-                np.issubdtype(ds[dim].dtype,
-                              np.datetime64))
+                (np.issubdtype(ds[dim].dtype, np.datetime64) or
+                 hasattr(ds[dim].values[0], "calendar")))
 
     def _is_z_dim(ds, dim):
         return (dim in orca_names.z_dims)
@@ -79,6 +106,96 @@ def trim_and_squeeze(ds,
     return ds
 
 
+def _get_horizontal_values(mesh_mask, name, **kwargs):
+    """Return the values of coordinate `name` of the raw mesh mask on y, x."""
+    names = get_name_dict("orca_coords", **kwargs)[name]
+    for old_name in names.get("old_names", [name, ]):
+        if old_name in mesh_mask.variables:
+            da = mesh_mask[old_name]
+            da = da.isel({dim: 0 for dim in da.dims if dim not in ("y", "x")})
+            return da.transpose("y", "x").values
+    raise KeyError("No {} in the mesh mask.".format(name))
+
+
+def get_region_slices(mesh_mask, region, **kwargs):
+    """Find the window of raw `"y"` and `"x"` indices covering a region.
+
+    For a box in longitude and latitude, the window covers all T points
+    inside the box.  Longitudes are compared modulo 360, so boxes may cross
+    the date line (like `{"lon": (170, -170)}`).  The window is the smallest
+    index window containing all points inside the box.  For boxes crossing
+    the periodic seam of the grid or reaching the north fold (where the
+    points inside the box are on both sides of the fold), the window spans
+    most of (or all) the grid along `"x"`.
+
+    Parameters
+    ----------
+    mesh_mask : xarray dataset
+        The raw mesh mask (with dimensions `"y"` and `"x"`).  Only the T-point
+        coordinates are read.
+    region : dict
+        Either a box `{"lon": (west, east), "lat": (south, north)}` in
+        degrees, or an index window `{"y": (start, stop), "x": (start,
+        stop)}` counted along the trimmed grid (that is, positions along
+        `"y_c"` and `"x_c"` of the grid-aware data set).  Missing keys select
+        everything.
+    **kwargs
+        Trimming (see `trim_and_squeeze`).  The window never includes points
+        which would be trimmed.
+
+    Returns
+    -------
+    dict
+        With a slice of raw indices for each of `"y"` and `"x"`.
+
+    """
+    trimming_slices = get_trimming_slices(**kwargs)
+    bounds = {dim: trimming_slices.get(dim, slice(None)).indices(
+        mesh_mask.sizes[dim])[:2] for dim in ("y", "x")}
+
+    if "lon" not in region and "lat" not in region:
+        window = {}
+        for dim, (start, stop) in bounds.items():
+            sub_start, sub_stop, _ = slice(
+                *region.get(dim, (None, None))).indices(stop - start)
+            window[dim] = slice(start + sub_start, start + sub_stop)
+        return window
+
+    y_start, y_stop = bounds["y"]
+    x_start, x_stop = bounds["x"]
+    inside = np.ones((y_stop - y_start, x_stop - x_start), dtype=bool)
+    if "lon" in region:
+        west, east = region["lon"]
+        lon = _get_horizontal_values(mesh_mask, "llon_cc", **kwargs)
+        lon = lon[y_start:y_stop, x_start:x_stop]
+        if east - west < 360:
+            inside &= (lon - west) % 360 <= (east - west) % 360
+    if "lat" in region:
+        south, north = region["lat"]
+        lat = _get_horizontal_values(mesh_mask, "llat_cc", **kwargs)
+        lat = lat[y_start:y_stop, x_start:x_stop]
+        inside &= (lat >= south) & (lat <= north)
+
+    if not inside.any():
+        raise ValueError("There are no grid points in {}.".format(region))
+    rows = np.flatnonzero(inside.any(axis=1))
+    columns = np.flatnonzero(inside.any(axis=0))
+    return {"y": slice(y_start + rows[0], y_start + rows[-1] + 1),
+            "x": slice(x_start + columns[0], x_start + columns[-1] + 1)}
+
+
+def _get_grid_window(region_slices, sizes, **kwargs):
+    """Translate a window of raw indices to the dims of the trimmed grid."""
+    trimming_slices = get_trimming_slices(**kwargs)
+    window = {}
+    for dim in ("y", "x"):
+        start = trimming_slices.get(dim, slice(None)).indices(sizes[dim])[0]
+        grid_slice = slice(region_slices[dim].start - start,
+                           region_slices[dim].stop - start)
+        window[dim + "_c"] = window[dim + "_r"] = grid_slice
+    return window
+
+
 def create_minimal_coords_ds(mesh_mask, **kwargs):
     """Create a minimal set of coordinates from a mesh-mask dataset.
 
@@ -187,7 +304,9 @@ def copy_vars(return_ds, raw_ds, **kwargs):
     """Copy variables and map them to the correct grid.
 
     This copies all variables defined in `xorca.orca_names.orca_variables` from
-    `raw_ds` to `return_ds`.
+    `raw_ds` to `return_ds`.  Variables marked as `"time_varying"` keep their
+    time dimension if they have one in `raw_ds`.  Attributes for unpacking
+    (see `xorca.orca_names.packing_attrs`) are kept as well.
     """
     for key, names in get_name_dict("orca_variables", **kwargs).items():
         new_name = key
@@ -195,14 +314,89 @@ def copy_vars(return_ds, raw_ds, **kwargs):
         old_names = names.get("old_names", [new_name, ])
         for old_name in old_names:
             if old_name in raw_ds:
+                dims = new_dims
+                if (names.get("time_varying", False) and
+                        "t" in raw_ds[old_name].dims):
+                    dims = ["t", ] + new_dims
+                attrs = {k: v for k, v in raw_ds[old_name].attrs.items()
+                         if k in orca_names.packing_attrs}
                 try:
-                    return_ds[new_name] = (new_dims, raw_ds[old_name].data)
+                    return_ds[new_name] = (dims, raw_ds[old_name].data, attrs)
                     break
                 except ValueError as e:
                     pass
     return return_ds
 
 
+def is_packed(da):
+    """Does `da` still carry attributes for unpacking?
+
+    This includes floating point variables with fill values, which are masked
+    by `unpack` as well.
+    """
+    return any(k in da.attrs for k in orca_names.packing_attrs)
+
+
+def unpack(da, dtype="float32"):
+    """Lazily unpack a variable loaded with `decode_cf="lazy"`.
+
+    Fill values are replaced by NaN and `scale_factor` and `add_offset` are
+    applied.  For dask arrays, this is an element-wise operation on each chunk
+    which is fused with the reading and with subsequent operations, so packed
+    variables never have to be held in memory in full precision.  Variables
+    which are not packed are returned unchanged.
+
+    Parameters
+    ----------
+    da : data array
+        Packed variable.
+    dtype : str | dtype
+        Data type of the unpacked variable.  Default is `"float32"`.  Floating
+        point variables keep their own precision if it is higher (so float64
+        variables with fill values are masked, but not cast to float32).
+
+    Returns
+    -------
+    data array
+        The packing attributes are moved to the encoding, so that writing the
+        variable packs it again.
+
+    """
+    if not is_packed(da):
+        return da
+
+    if np.issubdtype(da.dtype, np.floating):
+        dtype = np.promote_types(dtype, da.dtype)
+
+    attrs = dict(da.attrs)
+    packing = {k: attrs.pop(k) for k in orca_names.packing_attrs
+               if k in attrs}
+
+    data = da.data
+    unpacked = data.astype(dtype)
+    for k in ("_FillValue", "missing_value"):
+        if k in packing:
+            fill_value = np.asarray(packing[k]).astype(data.dtype)
+            unpacked = np.where(data == fill_value, np.nan, unpacked)
+    if "scale_factor" in packing:
+        unpacked = unpacked * np.asarray(packing["scale_factor"], dtype)
+    if "add_offset" in packing:
+        unpacked = unpacked + np.asarray(packing["add_offset"], dtype)
+
+    unpacked = da.copy(data=unpacked.astype(dtype, copy=False))
+    unpacked.attrs = attrs
+    unpacked.encoding = dict(da.encoding, dtype=da.dtype, **packing)
+    return unpacked
+
+
+def unpack_variables(ds, dtype="float32"):
+    """Lazily unpack all packed variables of `ds`.  See `unpack`."""
+    ds = ds.copy()
+    for name in [v for v in ds.variables if is_packed(ds[v])]:
+        ds[name] = unpack(ds[name], dtype=dtype)
+    return ds
+
+
 def rename_dims(ds, **kwargs):
     """Rename dimensions.
 
@@ -262,12 +456,222 @@ def get_all_compatible_chunk_sizes(chunks, dobj):
     return {k: v for k, v in chunks.items() if k in dobj.dims}
 
 
+def get_input_chunks_for_target(ds, target_ds_chunks, **kwargs):
+    """Find input chunks yielding the target chunks after preprocessing.
+
+    Each dimension of the input ds is mapped to a dimension of the
+    grid-aware dataset with `xorca.orca_names.rename_dims` and
+    `xorca.orca_names.target_dims`.  Then, the target chunks are calculated
+    for the trimmed length of this dimension and the trimmed halo points (see
+    `get_trimming_slices`) are added to the first and the last chunk.
+
+    Parameters
+    ----------
+    ds : dataset
+        Input dataset with the dimensions (not the data) as stored on disk.
+    target_ds_chunks : dict
+        Chunks for the final data set.
+
+    Returns
+    -------
+    dict
+        Chunks (as tuples) for all dimensions of `ds` that can be mapped to a
+        dimension of `target_ds_chunks`.
+
+    """
+    from dask.array.core import normalize_chunks
+
+    rename_dict = get_name_dict("rename_dims", **kwargs)
+    target_dims = get_name_dict("target_dims", **kwargs)
+    trimming_slices = get_trimming_slices(**kwargs)
+
+    chunks = {}
+    for dim, size in ds.sizes.items():
+        renamed_dim = rename_dict.get(dim, dim)
+        target_dim = target_dims.get(renamed_dim)
+        if target_dim not in target_ds_chunks:
+            continue
+        start, stop = 0, size
+        if renamed_dim in trimming_slices:
+            start, stop, _ = trimming_slices[renamed_dim].indices(size)
+        if stop <= start:
+            continue
+        dim_chunks = list(normalize_chunks(target_ds_chunks[target_dim],
+                                           shape=(stop - start, ))[0])
+        dim_chunks[0] += start
+        dim_chunks[-1] += size - stop
+        chunks[dim] = tuple(dim_chunks)
+    return chunks
+
+
+def get_vars_not_matching_chunks(ds, chunks):
+    """Return names of all dask-backed variables not chunked like `chunks`."""
+    from dask.array.core import normalize_chunks
+
+    def _matches(var):
+        return all(
+            var_chunks == normalize_chunks(chunks[dim], shape=(size, ))[0]
+            for dim, size, var_chunks in zip(var.dims, var.shape, var.chunks)
+            if dim in chunks)
+
+    return [name for name, var in ds.variables.items()
+            if var.chunks is not None and not _matches(var)]
+
+
 def set_time_independent_vars_to_coords(ds):
     """Make sure all time-independent variables are coordinates."""
     return ds.set_coords([v for v in ds.data_vars.keys()
                           if 't' not in ds[v].dims])
 
 
+def apply_compact_dtypes(ds, **kwargs):
+    """Cast masks and scale factors to compact data types.
+
+    This casts all variables defined in `xorca.orca_names.compact_dtypes`.
+    Masks become booleans (which can be applied with `where` instead of
+    multiplying) and scale factors become single precision.
+    """
+    for k, dtype in get_name_dict("compact_dtypes", **kwargs).items():
+        if k in ds.variables:
+            ds[k] = ds[k].astype(dtype)
+    return ds
+
+
+def get_mesh_cache_key(aux_files, **kwargs):
+    """Return a key identifying the result of processing `aux_files`.
+
+    The key is made of the resolved paths and the modification times of all
+    files and of the representation of all `kwargs` (like the trimming, the
+    `update_*` dicts, and the chunks).  For Zarr stores, only the
+    modification time of the directory is considered.
+
+    Returns
+    -------
+    tuple | None
+        None if any of the files is not a local path (like a glob statement
+        or a store object) and cannot be cached.
+
+    """
+    try:
+        files = tuple((os.path.realpath(os.fspath(af)),
+                       os.stat(af).st_mtime_ns)
+                      for af in aux_files)
+    except (TypeError, OSError):
+        return None
+    return (files, repr(sorted(kwargs.items(), key=lambda item: item[0])))
+
+
+def _get_nbytes_in_memory(ds):
+    """Bytes of all variables of `ds` which are not backed by dask."""
+    return sum(var.nbytes for var in ds.variables.values()
+               if var.chunks is None)
+
+
+def clear_mesh_cache():
+    """Forget all aux files and grid templates of earlier loads."""
+    mesh_cache.clear()
+
+
+def get_grid_template(mesh_mask, **kwargs):
+    """Create the grid-aware coordinates of a mesh mask.
+
+    These are the minimal coordinates (see `create_minimal_coords_ds`) and
+    the coordinates from `xorca.orca_names.orca_coords` copied from the
+    trimmed mesh mask.  The template can be passed to `preprocess_orca` for
+    all data files on the same grid.
+
+    If `mesh_mask` is given as files, the template is kept in the process-wide
+    `mesh_cache` and is only created again if one of the files changed.
+
+    Parameters
+    ----------
+    mesh_mask : Dataset | Path | sequence | string
+        See `preprocess_orca`.
+    **kwargs
+        Trimming and `update_*` dicts.  See `preprocess_orca`.
+
+    Returns
+    -------
+    xarray dataset
+
+    """
+    cache_key = None
+    if not isinstance(mesh_mask, xr.Dataset):
+        files = mesh_mask
+        if isinstance(files, (str, os.PathLike)):
+            files = [files, ]
+        cache_key = get_mesh_cache_key(files, grid_template=True, **kwargs)
+        grid_template = mesh_cache.get(cache_key)
+        if grid_template is not None:
+            return grid_template
+        mesh_mask = open_mf_or_dataset(mesh_mask, **kwargs)
+
+    mesh_mask = trim_and_squeeze(mesh_mask, **kwargs)
+    grid_template = create_minimal_coords_ds(mesh_mask, **kwargs)
+    grid_template = copy_coords(grid_template, mesh_mask, **kwargs)
+
+    if cache_key is not None:
+        mesh_cache.put(cache_key, grid_template,
+                       nbytes=_get_nbytes_in_memory(grid_template))
+    return grid_template
+
+
+class MeshHandle(object):
+    """Light-weight reference to the grid of a mesh mask.
+
+    A handle only holds the paths of the aux files and the arguments for
+    processing them.  It is small, hashable, and can be pickled, so it can be
+    sent to the workers of a distributed cluster with every task.  The grid
+    template is only created when it is first needed in a process and is then
+    taken from the `mesh_cache` of this process (see `get_grid_template`).
+
+    Calling the handle with a data set preprocesses it, so it can be passed
+    as `preprocess` to `xr.open_mfdataset` directly:
+    ```python
+    ds = xr.open_mfdataset(data_files, parallel=True,
+                           preprocess=MeshHandle(aux_files))
+    ```
+
+    Parameters
+    ----------
+    aux_files : Path | sequence | string
+        Paths of the aux files (which are visible to all workers).
+    **kwargs
+        Arguments of `preprocess_orca` (like the trimming and the `update_*`
+        dicts) used for creating the grid template and for preprocessing.
+
+    """
+
+    def __init__(self, aux_files, **kwargs):
+        if isinstance(aux_files, (str, os.PathLike)):
+            aux_files = [aux_files, ]
+        self.aux_files = tuple(os.path.abspath(os.fspath(af))
+                               for af in aux_files)
+        self.kwargs = dict(kwargs)
+
+    def _key(self):
+        return (self.aux_files,
+                repr(sorted(self.kwargs.items(), key=lambda item: item[0])))
+
+    def __eq__(self, other):
+        return isinstance(other, MeshHandle) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "MeshHandle({!r}, **{!r})".format(list(self.aux_files),
+                                                 self.kwargs)
+
+    def get_grid_template(self):
+        """Return the (cached) grid template.  See `get_grid_template`."""
+        return get_grid_template(list(self.aux_files), **self.kwargs)
+
+    def __call__(self, ds):
+        """Preprocess `ds`.  See `preprocess_orca`."""
+        return preprocess_orca(self, ds, **self.kwargs)
+
+
 def preprocess_orca(mesh_mask, ds, **kwargs):
     """Preprocess orca datasets before concatenating.
 
@@ -278,18 +682,31 @@ def preprocess_orca(mesh_mask, ds, **kwargs):
         preprocess=(lambda ds:
                     preprocess_orca(mesh_mask, ds)))
     ```
+    With `parallel=True` on a distributed cluster, use a `MeshHandle`
+    instead, which is cheap to send to the workers:
+    ```python
+    ds = xr.open_mfdataset(data_files, parallel=True,
+                           preprocess=MeshHandle(aux_files))
+    ```
 
     Parameters
     ----------
-    mesh_mask : Dataset | Path | sequence | string
-        An xarray `Dataset` or anything accepted by `xr.open_mfdataset` or,
-        `xr.open_dataset`: A single file name, a sequence of Paths or file
-        names, a glob statement.
+    mesh_mask : Dataset | MeshHandle | Path | sequence | string
+        An xarray `Dataset`, a `MeshHandle`, or anything accepted by
+        `xr.open_mfdataset` or, `xr.open_dataset`: A single file name, a
+        sequence of Paths or file names, a glob statement.
     ds : xarray dataset
         Xarray dataset to be processed before concatenating.
     input_ds_chunks : dict
         Chunks for the ds to be preprocessed.  Pass chunking for any input
         dimension that might be in the input data.
+    compact_dtypes : bool
+        Cast masks to booleans and scale factors to single precision?  See
+        `apply_compact_dtypes`.  Default is False.
+    grid_template : xarray dataset
+        The grid-aware coordinates of `mesh_mask` as returned by
+        `get_grid_template`.  If given, `mesh_mask` is not processed again.
+        Default is None.
 
     Returns
     -------
@@ -302,17 +719,18 @@ def preprocess_orca(mesh_mask, ds, **kwargs):
     ds = ds.chunk(input_ds_chunks)
 
     # construct minimal grid-aware data set from mesh-mask info
-    if not isinstance(mesh_mask, xr.Dataset):
-        mesh_mask = open_mf_or_dataset(mesh_mask, **kwargs)
-    mesh_mask = trim_and_squeeze(mesh_mask, **kwargs)
-    return_ds = create_minimal_coords_ds(mesh_mask, **kwargs)
+    grid_template = kwargs.pop("grid_template", None)
+    if grid_template is None and isinstance(mesh_mask, MeshHandle):
+        grid_template = mesh_mask.get_grid_template()
+    if grid_template is None:
+        grid_template = get_grid_template(mesh_mask, **kwargs)
+    return_ds = grid_template.copy()
 
     # make sure dims are called correctly and trim input ds
     ds = rename_dims(ds, **kwargs)
     ds = trim_and_squeeze(ds, **kwargs)
 
-    # copy coordinates from the mesh-mask and from the data set
-    return_ds = copy_coords(return_ds, mesh_mask, **kwargs)
+    # copy coordinates from the data set
     return_ds = copy_coords(return_ds, ds, **kwargs)
 
     # copy variables from the data set
@@ -324,202 +742,502 @@ def preprocess_orca(mesh_mask, ds, **kwargs):
     # make everything that does not depend on time a coord
     return_ds = set_time_independent_vars_to_coords(return_ds)
 
+    if kwargs.get("compact_dtypes", False):
+        return_ds = apply_compact_dtypes(return_ds, **kwargs)
+
     return return_ds
 
 
+def get_time_varying_vars(ds, **kwargs):
+    """Return names of all variables which vary in time only for some runs.
+
+    These are all variables marked as `"time_varying"` in
+    `xorca.orca_names.orca_variables` (like the vertical scale factors of runs
+    with variable volume) which come with a time dimension in `ds`.
+    """
+    orca_variables = get_name_dict("orca_variables", **kwargs)
+    return [v for v in ds.variables
+            if orca_variables.get(v, {}).get("time_varying", False) and
+            "t" in ds[v].dims]
+
+
+def update_with_aux_info(ds, aux_xorca, **kwargs):
+    """Add time-independent info from a preprocessed aux dataset.
+
+    Time-varying versions of variables already present in `ds` (like `e3t`
+    read from the data files of a run with variable volume) are not
+    overridden by their static counterparts.
+    """
+    time_varying = get_time_varying_vars(ds, **kwargs)
+    ds.update(aux_xorca.drop_vars([v for v in time_varying
+                                   if v in aux_xorca.variables]))
+    return ds
+
+
+def collapse_dask_graphs(ds):
+    """Collapse the dask graph of each variable into a single layer.
+
+    The graph of each variable is culled and all linear chains of tasks (like
+    opening, renaming, trimming, squeezing, and copying) are fused.  This
+    keeps the time the scheduler spends optimizing the graph from growing
+    with the number of layers added per input file.  For fully fusing the
+    chunks with the reads, open the input files with `inline_array=True`.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+
+    Returns
+    -------
+    xarray dataset
+        With each variable backed by a dask graph of a single layer.
+
+    """
+    import dask
+
+    ds = ds.copy()
+    for name, var in ds.variables.items():
+        if var.chunks is not None:
+            ds[name] = var.copy(data=dask.optimize(var.data)[0])
+    return ds
+
+
 def _get_first_time_step_if_any(dobj):
     if "t" in dobj.coords:
         return dobj.coords["t"].data[0]
 
 
+def _load_xorca_dataset(data_files, aux_files, decode_cf, open_dataset,
+                        loader, **kwargs):
+    """Create a grid-aware NEMO dataset opening files with `open_dataset`.
+
+    `loader` is a stable identity of `open_dataset` (like its name and the
+    representation of its options) used in the key of the mesh cache.
+    """
+
+    # Everything changing the processing of the aux files goes into the key
+    # of the mesh cache.
+    use_mesh_cache = kwargs.pop("mesh_cache", True)
+    cache_key_kwargs = {k: v for k, v in kwargs.items()
+                        if k not in ("report", "max_workers", "variables",
+                                     "t_start", "t_end")}
+
+    # Open only the files needed.  The time range is known from catalogs (see
+    # `xorca.catalog`) or from file names following the XIOS conventions.
+    # Files at the edges of the time range are sliced after opening.
+    variables = kwargs.pop("variables", None)
+    t_start = kwargs.pop("t_start", None)
+    t_end = kwargs.pop("t_end", None)
+    select_time = t_start is not None or t_end is not None
+
+    def _select_files(data_files):
+        from . import catalog
+        if catalog.is_catalog(data_files):
+            return catalog.select_files(data_files, variables=variables,
+                                        t_start=t_start, t_end=t_end)
+        if select_time:
+            return catalog.select_files_by_name(data_files, t_start=t_start,
+                                                t_end=t_end)
+        return data_files
+
+    if isinstance(data_files, dict):
+        data_files = {member: _select_files(files)
+                      for member, files in data_files.items()}
+    else:
+        data_files = _select_files(data_files)
+
+    default_target_ds_chunks = {
+        "member": 1,
+        "t": 1,
+        "z_c": 2, "z_l": 2,
+        "y_c": 200, "y_r": 200,
+        "x_c": 200, "x_r": 200
+    }
+    target_ds_chunks = kwargs.pop("target_ds_chunks",
+                                  default_target_ds_chunks)
+
+    # Unless the input chunks are given, derive them from the target chunks
+    # so that no rechunking of the final ds is necessary.  Get and remove
+    # (pop) the input_ds_chunks from kwargs to make sure that chunking is not
+    # applied again during preprocess_orca.
+    derive_input_chunks = "input_ds_chunks" not in kwargs
+    input_ds_chunks = kwargs.pop("input_ds_chunks", None)
+
+    def _get_input_chunks(ds):
+        if derive_input_chunks:
+            return get_input_chunks_for_target(ds, target_ds_chunks,
+                                               **kwargs)
+        return get_all_compatible_chunk_sizes(input_ds_chunks, ds)
+
+    # Uncompressed netCDF3 aux files can be used as memory maps
+    memmap_aux_files = kwargs.pop("memmap_aux_files", False)
+
+    def _is_memmappable(af):
+        return (memmap_aux_files and
+                backends.detect_format(af) == "netcdf3")
+
+    # Include the arrays in the chunk tasks to enable fusing the graph.
+    collapse_graph = kwargs.pop("collapse_graph", False)
+    if collapse_graph:
+        open_dataset = functools.partial(open_dataset, inline_array=True)
+
+    # Keep packed variables packed and only decode the times, which are
+    # needed for sorting and combining.
+    if decode_cf == "lazy":
+        open_dataset = functools.partial(open_dataset, mask_and_scale=False)
+        decode_cf = True
+
+    # Number of threads opening the members of ensembles
+    max_workers = kwargs.pop("max_workers", None)
+
+    # Time the stages only if there is a report
+    report = kwargs.pop("report", None)
+    stage = profiling.get_stage_timer(report)
+
+    # Reuse the aux files opened and processed by earlier loads
+    cache_key = None
+    if use_mesh_cache:
+        cache_key = get_mesh_cache_key(aux_files, loader=loader,
+                                       **cache_key_kwargs)
+    cached = mesh_cache.get(cache_key) if cache_key is not None else None
+
+    # Find the window of the region in the (first suitable) aux file.  All
+    # files are then opened lazily and cut to the window before chunking, so
+    # nothing outside of the window is read.  The window already excludes the
+    # points to be trimmed.  Input which is already on the grid is cut to the
+    # same window along the grid-aware dims.
+    region = kwargs.pop("region", None)
+    region_slices = None
+    if cached is not None:
+        region_slices = cached["region_slices"]
+    elif region is not None:
+        with stage("region"):
+            for af in aux_files:
+                try:
+                    mesh_mask = rename_dims(open_dataset(af, decode_cf=False),
+                                            **kwargs)
+                    region_slices = get_region_slices(mesh_mask, region,
+                                                      **kwargs)
+                    region_slices.update(_get_grid_window(
+                        region_slices, mesh_mask.sizes, **kwargs))
+                    break
+                except KeyError:
+                    pass
+            else:
+                raise ValueError("Could not find the region {} in the aux "
+                                 "files.".format(region))
+    if region is not None:
+        kwargs.update(y_slice=(None, None), x_slice=(None, None))
+
+    def _open_chunked(path, opener, **open_kwargs):
+        if region_slices is None:
+            with stage("probe", path):
+                chunks = _get_input_chunks(opener(path, **open_kwargs))
+            with stage("open", path):
+                return rename_dims(opener(path, chunks=chunks, **open_kwargs),
+                                   **kwargs)
+        with stage("open", path):
+            ds = rename_dims(opener(path, **open_kwargs), **kwargs)
+            ds = ds.isel(get_all_compatible_chunk_sizes(region_slices, ds))
+            return ds.chunk(_get_input_chunks(ds))
+
+    # First, read aux files to learn about all dimensions.  Then, open again
+    # and specify chunking for all applicable dims.  It is very important to
+    # already pass the `chunks` arg to `open_[mf]dataset`, to ensure
+    # distributed performance.
+    if cached is None:
+        aux_ds = xr.Dataset()
+        for af in aux_files:
+            opener = (backends.open_netcdf3_memmap if _is_memmappable(af)
+                      else open_dataset)
+            aux_ds.update(_open_chunked(af, opener, decode_cf=False))
+
+        # Process the mesh only once for all data files
+        with stage("mesh"):
+            grid_template = get_grid_template(aux_ds, **kwargs)
+            aux_xorca = preprocess_orca(aux_ds, aux_ds,
+                                        grid_template=grid_template,
+                                        **kwargs)
+        cached = {"aux_ds": aux_ds, "aux_xorca": aux_xorca,
+                  "grid_template": grid_template,
+                  "region_slices": region_slices}
+        if cache_key is not None:
+            mesh_cache.put(cache_key, cached,
+                           nbytes=_get_nbytes_in_memory(aux_xorca))
+    aux_ds, aux_xorca, grid_template = (
+        cached["aux_ds"], cached["aux_xorca"], cached["grid_template"])
+
+    # Again, we first have to open all data sets to filter the input chunks.
+    def _open_and_combine(data_files):
+        datasets = []
+        for df in data_files:
+            ds = _open_chunked(df, open_dataset, decode_cf=decode_cf)
+            if select_time and "t" in ds.indexes:
+                ds = ds.sel(t=slice(t_start, t_end))
+                if ds.sizes["t"] == 0:
+                    continue
+            with stage("preprocess", df):
+                datasets.append(preprocess_orca(
+                    aux_ds, ds, grid_template=grid_template, **kwargs))
+
+        if not datasets:
+            raise ValueError("No time steps between {} and {}.".format(
+                t_start, t_end))
+
+        # Automatically combine all data files
+        with stage("sort"):
+            datasets = sorted(datasets, key=_get_first_time_step_if_any)
+        with stage("combine"):
+            return xr.combine_by_coords(datasets)
+
+    # Members of ensembles are opened in parallel.  All members are
+    # preprocessed with the same aux ds, so their coordinates are the same
+    # (dask) arrays and are kept only once.
+    if isinstance(data_files, dict):
+        from concurrent.futures import ThreadPoolExecutor
+        import pandas as pd
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            members = list(executor.map(_open_and_combine,
+                                        data_files.values()))
+        with stage("combine"):
+            ds_xorca = xr.concat(
+                members, dim=pd.Index(list(data_files), name="member"),
+                data_vars="all", coords="minimal", compat="override")
+    else:
+        ds_xorca = _open_and_combine(data_files)
+
+    # Add info from aux files
+    with stage("aux"):
+        ds_xorca = update_with_aux_info(ds_xorca, aux_xorca, **kwargs)
+
+    # Chunk the final ds.  With input chunks derived from the target chunks,
+    # this is a no-op for all variables that could be opened at the target
+    # chunks.
+    with stage("chunk"):
+        target_chunks = get_all_compatible_chunk_sizes(target_ds_chunks,
+                                                       ds_xorca)
+        to_rechunk = get_vars_not_matching_chunks(ds_xorca, target_chunks)
+        if derive_input_chunks and to_rechunk:
+            warnings.warn(
+                "Could not open {} at the target chunks {}.  These will be "
+                "rechunked.".format(to_rechunk, target_chunks),
+                RuntimeWarning)
+        ds_xorca = ds_xorca.chunk(target_chunks)
+
+    if collapse_graph:
+        with stage("collapse"):
+            ds_xorca = collapse_dask_graphs(ds_xorca)
+
+    if report is not None:
+        report.add_dataset_info(ds_xorca)
+
+    return ds_xorca
+
+
 def load_xorca_dataset(data_files=None, aux_files=None, decode_cf=True,
                        **kwargs):
     """Create a grid-aware NEMO dataset.
 
     Parameters
     ----------
-    data_files : Path | sequence | string
+    data_files : Path | sequence | string | pandas data frame
         Anything accepted by `xr.open_mfdataset` or, `xr.open_dataset`: A
         single file name, a sequence of Paths or file names, a glob statement.
+        Or a catalog as returned by `xorca.catalog.scan_files`.
     aux_files : Path | sequence | string
         Anything accepted by `xr.open_mfdataset` or, `xr.open_dataset`: A
         single file name, a sequence of Paths or file names, a glob statement.
     input_ds_chunks : dict
         Chunks for the ds to be preprocessed.  Pass chunking for any input
-        dimension that might be in the input data.
+        dimension that might be in the input data.  By default, the input
+        chunks are derived from `target_ds_chunks` so that the final data set
+        does not need to be rechunked (see `get_input_chunks_for_target`).  A
+        warning is issued if this is not possible.
     target_ds_chunks : dict
         Chunks for the final data set.  Pass chunking for any of the likely
         output dims: `("t", "z_c", "z_l", "y_c", "y_r", "x_c", "x_r")`
-    decode_cf : bool
-        Do we want the CF decoding to be done already?  Default is True.
+    decode_cf : bool | str
+        Do we want the CF decoding to be done already?  Default is True.  With
+        `"lazy"`, only times are decoded and packed variables (like int16 with
+        `scale_factor` and `add_offset`) are kept packed.  They are unpacked
+        per chunk with `unpack`, which the functions in `xorca.calc` do
+        automatically.
+    compact_dtypes : bool
+        Cast masks to booleans and scale factors to single precision?  The
+        functions in `xorca.calc` keep single precision and only accumulate
+        sums in double precision.  Default is False.
+    report : xorca.profiling.LoadReport
+        Collect timings of all stages and the size of the resulting dask
+        graph in this report.  Default is None (no timing).
+    collapse_graph : bool
+        Collapse the dask graph of each variable into a single layer with
+        chunk tasks directly reading from the files?  See
+        `collapse_dask_graphs`.  Default is False.
+    memmap_aux_files : bool
+        Open uncompressed netCDF3 aux files as read-only memory maps?  See
+        `xorca.backends.open_netcdf3_memmap`.  Default is False.
+    region : dict
+        Only read a window of the grid covering this region.  Either a box
+        `{"lon": (west, east), "lat": (south, north)}` or an index window
+        `{"y": (start, stop), "x": (start, stop)}` along the trimmed grid.
+        See `get_region_slices`.  Default is None (the whole grid).
+    mesh_cache : bool
+        Reuse the aux files opened and processed by earlier loads with the
+        same aux files (unchanged on disk) and the same arguments?  See
+        `mesh_cache` and `get_mesh_cache_key`.  Default is True.
+    variables : sequence
+        With a catalog of data files (see `xorca.catalog.scan_files`), only
+        open the files containing any of these variables.  Default is None
+        (all files).
+    t_start, t_end : datetime like
+        Only load the time steps in this range (including both ends).  Files
+        outside of the range are not opened if this is known from a catalog
+        or from file names following the XIOS conventions (see
+        `xorca.catalog.select_files_by_name`).  All other files are skipped
+        before preprocessing.  Default is None (open ended).
 
     Returns
     -------
     dataset
 
     """
-    
-    default_input_ds_chunks = {
-        "time_counter": 1, "t": 1,
-        "z": 2, "deptht": 2, "depthu": 2, "depthv": 2, "depthw": 2,
-        "y": 200, "x": 200
-    }
-    # get and remove (pop) the input_ds_chunks from kwargs
-    # to make sure that chunking is not applied again during preprocess_orca
-    input_ds_chunks = kwargs.pop("input_ds_chunks",
-                                 default_input_ds_chunks)
+    return _load_xorca_dataset(data_files, aux_files, decode_cf,
+                               xr.open_dataset, "xarray.open_dataset",
+                               **kwargs)
 
-    default_target_ds_chunks = {
-        "t": 1,
-        "z_c": 2, "z_l": 2,
-        "y_c": 200, "y_r": 200,
-        "x_c": 200, "x_r": 200
-    }
-    target_ds_chunks = kwargs.get("target_ds_chunks",
-                                  default_target_ds_chunks)
 
-    # First, read aux files to learn about all dimensions.  Then, open again
-    # and specify chunking for all applicable dims.  It is very important to
-    # already pass the `chunks` arg to `open_[mf]dataset`, to ensure
-    # distributed performance.
-    _aux_files_chunks = map(
-        lambda af: get_all_compatible_chunk_sizes(
-            input_ds_chunks, xr.open_dataset(af, decode_cf=False)),
-        aux_files)
-    aux_ds = xr.Dataset()
-    for af, ac in zip(aux_files, _aux_files_chunks):
-        aux_ds.update(
-            rename_dims(xr.open_dataset(af, decode_cf=False,
-                                        chunks=ac)))
-    # Again, we first have to open all data sets to filter the input chunks.
-    _data_files_chunks = map(
-        lambda df: get_all_compatible_chunk_sizes(
-            input_ds_chunks, xr.open_dataset(df, decode_cf=decode_cf)),
-        data_files)
-
-    # Automatically combine all data files
-    ds_xorca = xr.combine_by_coords(
-        sorted(
-            map(
-                lambda ds: preprocess_orca(aux_ds, ds, **kwargs),
-                map(lambda df, chunks: rename_dims(
-                    xr.open_dataset(df, chunks=chunks, decode_cf=decode_cf),
-                    **kwargs),
-                    data_files, _data_files_chunks)),
-            key=_get_first_time_step_if_any))
+def _get_backend_opener(backend_options):
+    """Return `xorca.backends.open_dataset` with options and its identity."""
+    def _open_dataset(path, **open_kwargs):
+        return backends.open_dataset(
+            path, backend_options=backend_options, **open_kwargs)
 
-    # Add info from aux files
-    ds_xorca.update(preprocess_orca(aux_ds, aux_ds, **kwargs))
-
-    # Chunk the final ds
-    ds_xorca = ds_xorca.chunk(
-        get_all_compatible_chunk_sizes(target_ds_chunks, ds_xorca))
-
-    return ds_xorca
+    loader = ("xorca.backends.open_dataset",
+              repr(sorted((backend_options or {}).items(),
+                          key=lambda item: item[0])))
+    return _open_dataset, loader
 
 
 def load_xorca_dataset_auto(data_files=None, aux_files=None, decode_cf=True,
-                       **kwargs):
+                            backend_options=None, **kwargs):
     """Create a grid-aware NEMO dataset from netcdf files or zarr stores.
 
+    The format of each file is detected with `xorca.backends.detect_format`
+    (from the file content or the layout of the store), and the file is then
+    opened with the matching backend.
+
     Parameters
     ----------
-    data_files : Path | sequence | string
-        Either Netcdf files or Zarr stores containing the data. 
-        Anything accepted by `xr.open_mfdataset`, or `xr.open_dataset`, or
-        `xr.open_zarr`: A single path or file name, a sequence of Paths or
-        file names, a glob statement.
+    data_files : Path | sequence | string | pandas data frame
+        Either Netcdf files, Zarr stores, or Kerchunk reference files
+        containing the data.  A sequence of Paths or file names, or a catalog
+        as returned by `xorca.catalog.scan_files`.
     aux_files : Path | sequence | string
-        Anything accepted by `xr.open_mfdataset`, or `xr.open_dataset`, or
-        `xr.open_zarr`: A single path or file name, a sequence of Paths or
-        file names, a glob statement.
+        Either Netcdf files, Zarr stores, or Kerchunk reference files
+        containing the mesh mask.  A sequence of Paths or file names.
     input_ds_chunks : dict
         Chunks for the ds to be preprocessed.  Pass chunking for any input
-        dimension that might be in the input data.
+        dimension that might be in the input data.  By default, the input
+        chunks are derived from `target_ds_chunks` so that the final data set
+        does not need to be rechunked (see `get_input_chunks_for_target`).  A
+        warning is issued if this is not possible.
     target_ds_chunks : dict
         Chunks for the final data set.  Pass chunking for any of the likely
         output dims: `("t", "z_c", "z_l", "y_c", "y_r", "x_c", "x_r")`
-    decode_cf : bool
-        Do we want the CF decoding to be done already?  Default is True.
+    decode_cf : bool | str
+        Do we want the CF decoding to be done already?  Default is True.  With
+        `"lazy"`, only times are decoded and packed variables (like int16 with
+        `scale_factor` and `add_offset`) are kept packed.  They are unpacked
+        per chunk with `unpack`, which the functions in `xorca.calc` do
+        automatically.
+    compact_dtypes : bool
+        Cast masks to booleans and scale factors to single precision?  The
+        functions in `xorca.calc` keep single precision and only accumulate
+        sums in double precision.  Default is False.
+    report : xorca.profiling.LoadReport
+        Collect timings of all stages and the size of the resulting dask
+        graph in this report.  Default is None (no timing).
+    collapse_graph : bool
+        Collapse the dask graph of each variable into a single layer with
+        chunk tasks directly reading from the files?  See
+        `collapse_dask_graphs`.  Default is False.
+    backend_options : dict
+        Options per format passed to the backends.  Example:
+        `{"zarr": {"consolidated": True}, "netcdf4": {"cache": False}}`.
+        See `xorca.backends.open_dataset`.
+    memmap_aux_files : bool
+        Open uncompressed netCDF3 aux files as read-only memory maps?  See
+        `xorca.backends.open_netcdf3_memmap`.  Default is False.
+    region : dict
+        Only read a window of the grid covering this region.  Either a box
+        `{"lon": (west, east), "lat": (south, north)}` or an index window
+        `{"y": (start, stop), "x": (start, stop)}` along the trimmed grid.
+        See `get_region_slices`.  Default is None (the whole grid).
+    mesh_cache : bool
+        Reuse the aux files opened and processed by earlier loads with the
+        same aux files (unchanged on disk) and the same arguments?  See
+        `mesh_cache` and `get_mesh_cache_key`.  Default is True.
+    variables : sequence
+        With a catalog of data files (see `xorca.catalog.scan_files`), only
+        open the files containing any of these variables.  Default is None
+        (all files).
+    t_start, t_end : datetime like
+        Only load the time steps in this range (including both ends).  Files
+        outside of the range are not opened if this is known from a catalog
+        or from file names following the XIOS conventions (see
+        `xorca.catalog.select_files_by_name`).  All other files are skipped
+        before preprocessing.  Default is None (open ended).
 
     Returns
     -------
     dataset
 
     """
+    open_dataset, loader = _get_backend_opener(backend_options)
+    return _load_xorca_dataset(data_files, aux_files, decode_cf,
+                               open_dataset, loader, **kwargs)
 
-    default_input_ds_chunks = {
-        "time_counter": 1, "t": 1,
-        "z": 2, "deptht": 2, "depthu": 2, "depthv": 2, "depthw": 2,
-        "y": 200, "x": 200
-    }
-    # get and remove (pop) the input_ds_chunks from kwargs
-    # to make sure that chunking is not applied again during preprocess_orca
-    input_ds_chunks = kwargs.pop("input_ds_chunks",
-                                 default_input_ds_chunks)
 
-    default_target_ds_chunks = {
-        "t": 1,
-        "z_c": 2, "z_l": 2,
-        "y_c": 200, "y_r": 200,
-        "x_c": 200, "x_r": 200
-    }
-    target_ds_chunks = kwargs.get("target_ds_chunks",
-                                  default_target_ds_chunks)
-    
-    # Generalized function to enable reading of boh netcdf files and zarr
-    # stores
-    def _open_dataset_or_zarr(*args, **kwargs):
-        try:
-            return xr.open_dataset(*args, **kwargs)
-        except:
-            return xr.open_zarr(*args, **kwargs)
-        else:
-            raise ValueError(
-                "Could not open dataset or zarr with" +
-                f"args={args} and kwargs={kwargs}."
-            )
+def load_xorca_ensemble(data_files=None, aux_files=None, decode_cf=True,
+                        backend_options=None, max_workers=None, **kwargs):
+    """Create a grid-aware NEMO dataset of an ensemble on the same grid.
 
-    # First, read aux files to learn about all dimensions.  Then, open again
-    # and specify chunking for all applicable dims.  It is very important to
-    # already pass the `chunks` arg to `open_[mf]dataset`, to ensure
-    # distributed performance.
-    _aux_files_chunks = map(
-        lambda af: get_all_compatible_chunk_sizes(
-            input_ds_chunks, _open_dataset_or_zarr(af, decode_cf=False)),
-        aux_files)
-    aux_ds = xr.Dataset()
-    for af, ac in zip(aux_files, _aux_files_chunks):
-        aux_ds.update(
-            rename_dims(_open_dataset_or_zarr(
-                af, decode_cf=False, chunks=ac
-            ))
-        )
-    
-    # Again, we first have to open all data sets to filter the input chunks.
-    _data_files_chunks = map(
-        lambda df: get_all_compatible_chunk_sizes(
-            input_ds_chunks, _open_dataset_or_zarr(df, decode_cf=decode_cf)),
-        data_files)
-
-    # Automatically combine all data files
-    ds_xorca = xr.combine_by_coords(
-        sorted(
-            map(
-                lambda ds: preprocess_orca(aux_ds, ds, **kwargs),
-                map(lambda df, chunks: rename_dims(
-                    _open_dataset_or_zarr(
-                        df, chunks=chunks, decode_cf=decode_cf
-                    ),
-                    **kwargs),
-                    data_files, _data_files_chunks)),
-            key=_get_first_time_step_if_any))
+    The aux files are opened and preprocessed only once.  The members are
+    opened in parallel threads and concatenated along a new dimension
+    `"member"`.  All coordinates (including the metrics and masks) are stored
+    once and shared by all members, so only the data variables have a
+    `"member"` dimension.  With one member per chunk (the default), reductions
+    over the members (like `ds.votemper.std("member")`) stream over the
+    members without holding the whole ensemble in memory.
 
-    # Add info from aux files
-    ds_xorca.update(preprocess_orca(aux_ds, aux_ds, **kwargs))
+    All members should cover the same time steps.  Otherwise, the data
+    variables are filled with NaN where a member has no data.
 
-    # Chunk the final ds
-    ds_xorca = ds_xorca.chunk(
-        get_all_compatible_chunk_sizes(target_ds_chunks, ds_xorca))
+    Parameters
+    ----------
+    data_files : dict
+        The data files or catalogs (see `load_xorca_dataset_auto`) for each
+        member.  The keys are used as the coordinate `"member"`.
+    aux_files : Path | sequence | string
+        Files containing the mesh mask.  See `load_xorca_dataset_auto`.
+    decode_cf : bool | str
+        See `load_xorca_dataset`.
+    backend_options : dict
+        See `load_xorca_dataset_auto`.
+    max_workers : int
+        Number of threads opening the members.  Defaults to the default of
+        `concurrent.futures.ThreadPoolExecutor`.
+    **kwargs
+        All other arguments of `load_xorca_dataset`.  Target chunks can
+        include `"member"`.
 
-    return ds_xorca
+    Returns
+    -------
+    dataset
+
+    """
+    open_dataset, loader = _get_backend_opener(backend_options)
+    return _load_xorca_dataset(data_files, aux_files, decode_cf,
+                               open_dataset, loader, max_workers=max_workers,
+                               **kwargs)
@@ -21,6 +21,8 @@ orca_coords = {
     "llon_rr": {"dims": ["y_r", "x_r"], "old_names": ["glamf", ]}
 }
 
+# Variables marked as `"time_varying"` may also come with a leading time
+# dimension (e.g., the vertical scale factors of runs with variable volume).
 orca_variables = {
     "sobowlin": {"dims": ["t", "y_c", "x_c"]},
     "sohefldo": {"dims": ["t", "y_c", "x_c"]},
@@ -65,16 +67,20 @@ orca_variables = {
     "vovecrtz": {"dims": ["t", "z_l", "y_c", "x_c"]},
     "e1t": {"dims": ["y_c", "x_c"]},
     "e2t": {"dims": ["y_c", "x_c"]},
-    "e3t": {"dims": ["z_c", "y_c", "x_c"], "old_names": ["e3t", "e3t_0"]},
+    "e3t": {"dims": ["z_c", "y_c", "x_c"], "old_names": ["e3t", "e3t_0"],
+            "time_varying": True},
     "e1u": {"dims": ["y_c", "x_r"]},
     "e2u": {"dims": ["y_c", "x_r"]},
-    "e3u": {"dims": ["z_c", "y_c", "x_r"], "old_names": ["e3u", "e3u_0"]},
+    "e3u": {"dims": ["z_c", "y_c", "x_r"], "old_names": ["e3u", "e3u_0"],
+            "time_varying": True},
     "e1v": {"dims": ["y_r", "x_c"]},
     "e2v": {"dims": ["y_r", "x_c"]},
-    "e3v": {"dims": ["z_c", "y_r", "x_c"], "old_names": ["e3v", "e3v_0"]},
+    "e3v": {"dims": ["z_c", "y_r", "x_c"], "old_names": ["e3v", "e3v_0"],
+            "time_varying": True},
     "e1f": {"dims": ["y_r", "x_r"]},
     "e2f": {"dims": ["y_r", "x_r"]},
-    "e3w": {"dims": ["z_l", "y_c", "x_c"], "old_names": ["e3w", "e3w_0"]},
+    "e3w": {"dims": ["z_l", "y_c", "x_c"], "old_names": ["e3w", "e3w_0"],
+            "time_varying": True},
     "tmask": {"dims": ["z_c", "y_c", "x_c"]},
     "umask": {"dims": ["z_c", "y_c", "x_r"]},
     "vmask": {"dims": ["z_c", "y_r", "x_c"]},
@@ -93,6 +99,74 @@ orca_variables = {
     "fmaskpac": {"dims": ["y_r", "x_r"], "old_names": ["tmaskpac", ]}
 }
 
+# Masks and vertical scale factors making up the thickness weights of the
+# different grid points.  W points re-use the T mask.
+thickness_weights = {
+    "t": {"mask": "tmask", "e3": "e3t", "dims": ["z_c", "y_c", "x_c"]},
+    "u": {"mask": "umask", "e3": "e3u", "dims": ["z_c", "y_c", "x_r"]},
+    "v": {"mask": "vmask", "e3": "e3v", "dims": ["z_c", "y_r", "x_c"]},
+    "w": {"mask": "tmask", "e3": "e3w", "dims": ["z_l", "y_c", "x_c"]}
+}
+
+# Coordinates and land masks of the grid points used for the region masks
+# generated from polygons (see `xorca.regions`).
+region_masks = {
+    "t": {"lon": "llon_cc", "lat": "llat_cc", "mask": "tmask"},
+    "u": {"lon": "llon_cr", "lat": "llat_cr", "mask": "umask"},
+    "v": {"lon": "llon_rc", "lat": "llat_rc", "mask": "vmask"},
+    "f": {"lon": "llon_rr", "lat": "llat_rr", "mask": "fmask"}
+}
+
+# Polygons of regions (as sequences of `(lon, lat)` vertices) for which masks
+# are generated by `xorca.regions.add_region_masks`.  Add your own with
+# `update_region_polygons={"name": [(lon, lat), ...]}`.
+region_polygons = {}
+
+# Tracers of the budgets in `xorca.budget`.  The `"factor"` converts the
+# volume integrals of the tracer to the units of the budget (`rho0 * cp` as
+# in NEMO for heat in `[W]`, and `rho0 / 1000` for salt in `[kg/s]`).
+# Surface fluxes (positive downward) are in the units of the budget per area.
+budget_tracers = {
+    "heat": {"tracer": "votemper", "surface_flux": "sohefldo",
+             "factor": 1026.0 * 3991.86795711963, "units": "W",
+             "content_units": "J"},
+    "salt": {"tracer": "vosaline", "surface_flux": None,
+             "factor": 1026.0e-3, "units": "kg/s", "content_units": "kg"}
+}
+
+# Data types used with `compact_dtypes=True`:  Masks are stored as booleans
+# and scale factors in single precision.
+compact_dtypes = {
+    "tmask": "bool",
+    "umask": "bool",
+    "vmask": "bool",
+    "fmask": "bool",
+    "tmaskatl": "bool",
+    "tmaskind": "bool",
+    "tmaskpac": "bool",
+    "umaskatl": "bool",
+    "umaskind": "bool",
+    "umaskpac": "bool",
+    "vmaskatl": "bool",
+    "vmaskind": "bool",
+    "vmaskpac": "bool",
+    "fmaskatl": "bool",
+    "fmaskind": "bool",
+    "fmaskpac": "bool",
+    "e1t": "float32",
+    "e2t": "float32",
+    "e1u": "float32",
+    "e2u": "float32",
+    "e1v": "float32",
+    "e2v": "float32",
+    "e1f": "float32",
+    "e2f": "float32",
+    "e3t": "float32",
+    "e3u": "float32",
+    "e3v": "float32",
+    "e3w": "float32"
+}
+
 rename_dims = {
     "time_counter": "t",
     "Z": "z",
@@ -100,6 +174,37 @@ rename_dims = {
     "X": "x"
 }
 
+# Dimensions of the grid-aware data set the (renamed) input dimensions end up
+# in.  Chunks of the input dimensions are derived from the chunks of these.
+# Input which is already on the grid (like stores written by
+# `xorca.rechunk.rechunk_to_time_series`) keeps its dimensions.
+target_dims = {
+    "t": "t",
+    "z": "z_c",
+    "nav_lev": "z_c",
+    "deptht": "z_c",
+    "depthu": "z_c",
+    "depthv": "z_c",
+    "depthw": "z_l",
+    "y": "y_c",
+    "x": "x_c",
+    "z_c": "z_c",
+    "z_l": "z_l",
+    "y_c": "y_c",
+    "y_r": "y_r",
+    "x_c": "x_c",
+    "x_r": "x_r"
+}
+
+# Attributes of packed variables which are kept (and applied lazily with
+# `xorca.lib.unpack`) when loading with `decode_cf="lazy"`.
+packing_attrs = (
+    "_FillValue",
+    "missing_value",
+    "scale_factor",
+    "add_offset"
+)
+
 z_dims = (
     "z_c",
     "z_l",
@@ -114,3 +219,13 @@ t_dims = (
     "t",
     "time_counter"
 )
+
+# Grid types of the data files by the name of their vertical dimension.  Used
+# if the grid type is not part of the file name (like `*_grid_T.nc` written by
+# XIOS).  See `xorca.catalog`.
+grid_types = {
+    "deptht": "T",
+    "depthu": "U",
+    "depthv": "V",
+    "depthw": "W"
+}
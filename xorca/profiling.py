@@ -0,0 +1,119 @@
+"""Timing reports for the loading pipeline."""
+
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoadReport(object):
+    """Collect timings and graph metrics while loading a dataset.
+
+    Pass an instance to `xorca.lib.load_xorca_dataset` (or
+    `load_xorca_dataset_auto`) with the `report` argument.  Without a report,
+    no timing is done at all.
+
+    Every finished stage is also logged to the `"xorca.profiling"` logger
+    (level `DEBUG`) and passed to all callbacks.
+
+    Parameters
+    ----------
+    callbacks : sequence
+        Functions called as `callback(stage, duration, file_name)` after each
+        stage.  `file_name` is `None` for stages not related to a single file.
+
+    Attributes
+    ----------
+    stages : dict
+        Total time in seconds spent in each stage.  Stages are `"region"`
+        (only with `region`), `"probe"` (learning about the dimensions of the
+        files), `"open"`, `"mesh"` (processing the aux files, skipped if they
+        are found in the mesh cache), `"preprocess"`, `"sort"`, `"combine"`,
+        `"aux"` (adding info from the aux files), `"chunk"`, and `"collapse"`
+        (only with `collapse_graph=True`).
+    file_times : list
+        Tuples `(stage, file_name, duration)` for all per-file stages.
+    n_tasks : int
+        Number of tasks in the dask graph of the loaded dataset.
+    n_layers : int
+        Number of layers in the dask graph of the loaded dataset.
+    nbytes : int
+        Number of bytes of all variables in the loaded dataset.  This is what
+        would be read when computing everything.
+
+    """
+
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+        self.stages = {}
+        self.file_times = []
+        self.n_tasks = None
+        self.n_layers = None
+        self.nbytes = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, file_name=None):
+        """Time a stage of the loading pipeline."""
+        start = time.perf_counter()
+        yield
+        duration = time.perf_counter() - start
+
+        # Stages may run in parallel threads (see `load_xorca_ensemble`).
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + duration
+            if file_name is not None:
+                file_name = str(file_name)
+                self.file_times.append((name, file_name, duration))
+
+        logger.debug("%s%s took %.3f s", name,
+                     "" if file_name is None else f" ({file_name})",
+                     duration)
+        for callback in self.callbacks:
+            callback(name, duration, file_name)
+
+    def add_dataset_info(self, ds):
+        """Record graph size and number of bytes of the loaded dataset."""
+        graph = ds.__dask_graph__()
+        if graph is not None:
+            self.n_tasks = len(graph)
+            self.n_layers = len(getattr(graph, "layers", [graph, ]))
+        else:
+            self.n_tasks = self.n_layers = 0
+        self.nbytes = ds.nbytes
+        logger.debug("loaded dataset has %d tasks in %d layers and %d bytes",
+                     self.n_tasks, self.n_layers, self.nbytes)
+
+    @property
+    def total(self):
+        """Total time in seconds spent in all stages."""
+        return sum(self.stages.values())
+
+    def slowest_files(self, n=5, stage="open"):
+        """Return the `n` files which took longest in a stage."""
+        file_times = [ft for ft in self.file_times if ft[0] == stage]
+        return sorted(file_times, key=lambda ft: ft[2], reverse=True)[:n]
+
+    def __repr__(self):
+        lines = [f"<LoadReport: {self.total:.3f} s>"]
+        lines += [f"  {name:<12s} {duration:10.3f} s"
+                  for name, duration in self.stages.items()]
+        if self.n_tasks is not None:
+            lines.append(f"  {self.n_tasks} tasks in {self.n_layers} layers,"
+                         f" {self.nbytes} bytes")
+        return "\n".join(lines)
+
+
+def get_stage_timer(report=None):
+    """Return `report.stage` or a function returning a no-op context."""
+    if report is None:
+        return _no_stage
+    return report.stage
+
+
+@contextmanager
+def _no_stage(name, file_name=None):
+    yield
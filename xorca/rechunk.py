@@ -0,0 +1,125 @@
+"""Write grid-aware data sets to Zarr stores chunked for time series."""
+
+from itertools import product
+
+import numpy as np
+
+from .lib import get_all_compatible_chunk_sizes
+
+
+def get_write_blocks(sizes, chunks, itemsize, max_mem):
+    """Split a variable into blocks which can be held in memory one by one.
+
+    Each block is made of whole target chunks.  Blocks are grown along the
+    last dimensions first, so that reading a block touches as few of the
+    (horizontally chunked) input chunks as possible.  If a single target chunk
+    is larger than `max_mem`, it is split along `"t"` and written in slabs.
+
+    Parameters
+    ----------
+    sizes : dict
+        Sizes of all dimensions of the variable (in order).
+    chunks : dict
+        Target chunk size for each dimension.  Dimensions not in `chunks` are
+        not chunked.
+    itemsize : int
+        Bytes per element.
+    max_mem : int
+        Maximal number of bytes per block.
+
+    Returns
+    -------
+    list
+        Dicts with a slice for each dimension.
+
+    """
+    block = {dim: min(chunks.get(dim, size), size)
+             for dim, size in sizes.items()}
+    nbytes = itemsize * int(np.prod(list(block.values())))
+
+    if nbytes > max_mem and "t" in block:
+        # write slabs of time steps into the same chunks
+        bytes_per_step = nbytes // block["t"]
+        block["t"] = max(1, max_mem // bytes_per_step)
+    else:
+        for dim in reversed([d for d in sizes if d != "t"]):
+            n_chunks = -(-sizes[dim] // block[dim])
+            factor = min(n_chunks, max(1, max_mem // nbytes))
+            block[dim] *= factor
+            nbytes *= factor
+            if factor < n_chunks:
+                break
+
+    slices = [[slice(start, min(start + block[dim], size))
+               for start in range(0, size, block[dim])]
+              for dim, size in sizes.items()]
+    return [dict(zip(sizes, block_slices))
+            for block_slices in product(*slices)]
+
+
+def rechunk_to_time_series(ds, store, chunks=None, max_mem="256MB"):
+    """Write the data variables of `ds` to a Zarr store chunked in time.
+
+    Output split into many files usually comes in chunks of one (or a few)
+    time steps.  Extracting long time series from these touches all chunks of
+    the whole run.  This writes the data variables to a Zarr store with chunks
+    spanning all time steps.
+
+    The data are transposed in blocks of whole target chunks which are each
+    read, held in memory, and written, one after the other.  No block is
+    larger than `max_mem`, so this runs on a single node without a cluster.
+    Target chunks larger than `max_mem` are filled in slabs of time steps.
+
+    Only the data variables and their dimension coordinates are written.  The
+    grid info is taken from the aux files when reading the store again:
+    ```python
+    ds = load_xorca_dataset(data_files=data_files, aux_files=aux_files)
+    rechunk_to_time_series(ds, "time_series.zarr")
+    ds_ts = load_xorca_dataset_auto(
+        data_files=["time_series.zarr", ], aux_files=aux_files,
+        target_ds_chunks={"t": -1, "z_c": 1, "y_c": 64, "x_c": 64})
+    ```
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        Grid-aware data set as returned by `xorca.lib.load_xorca_dataset`.
+    store : Path | str | MutableMapping
+        Zarr store.  Will be overwritten.
+    chunks : dict
+        Target chunks.  Defaults to all time steps and 64 points in `"y"` and
+        `"x"` for each vertical level.
+    max_mem : int | str
+        Maximal size of the blocks held in memory.  Strings like `"1GB"` are
+        parsed with `dask.utils.parse_bytes`.  Defaults to `"256MB"`.
+
+    """
+    from dask.utils import parse_bytes
+
+    default_chunks = {
+        "t": -1,
+        "z_c": 1, "z_l": 1,
+        "y_c": 64, "y_r": 64,
+        "x_c": 64, "x_r": 64
+    }
+    if chunks is None:
+        chunks = default_chunks
+    if isinstance(max_mem, str):
+        max_mem = parse_bytes(max_mem)
+
+    ds = ds.drop_vars([c for c in ds.coords if c not in ds.dims])
+    chunks = {dim: ds.sizes[dim] if size in (-1, None) else size
+              for dim, size in
+              get_all_compatible_chunk_sizes(chunks, ds).items()}
+
+    # Write the metadata and the dimension coordinates only.  The chunks of
+    # the template define the chunks of the store.
+    ds.chunk(chunks).to_zarr(store, mode="w", compute=False)
+
+    # Writes are sequential, so filling a chunk in several slabs is safe.
+    for name, var in ds.data_vars.items():
+        for region in get_write_blocks(dict(zip(var.dims, var.shape)), chunks,
+                                       var.dtype.itemsize, max_mem):
+            block = ds[[name]].isel(region).compute()
+            block = block.drop_vars(list(block.coords))
+            block.to_zarr(store, region=region, safe_chunks=False)
@@ -0,0 +1,239 @@
+"""Masks of regions defined by polygons on all grid points.
+
+Masks of ocean basins like `tmaskatl` are only available if the mesh mask
+happens to contain them.  Here, masks are generated for arbitrary regions
+given as polygons in longitude and latitude.  They are added as coordinates
+`"{t,u,v,f}mask{name}"`, so they can be used like the masks from the mesh
+mask (e.g., with `xorca.calc.calculate_moc(ds, region=name)`).
+
+Finding the points inside a polygon needs all coordinates of the grid.  The
+results are therefore cached per mesh and polygon as bit masks (one bit per
+grid point), in memory and optionally in files.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from .lib import get_name_dict
+
+
+# Bit masks (and their shapes) per mesh and polygon
+_region_mask_cache = {}
+
+
+def points_in_polygon(lon, lat, polygon):
+    """Find all points inside a polygon.
+
+    This is the even-odd rule for rays pointing east, vectorized over all
+    points.  Longitudes are compared modulo 360:  The vertices of polygons
+    crossing the date line are given with continuous longitudes (like
+    `(170, 0), (190, 0), ...`) and the points are shifted to the same range.
+
+    Parameters
+    ----------
+    lon, lat : array like
+        Coordinates of the points in degrees.
+    polygon : array like
+        Sequence of `(lon, lat)` vertices.  The polygon is closed
+        automatically.
+
+    Returns
+    -------
+    numpy array
+        Booleans with the shape of the points.
+
+    """
+    polygon = np.asarray(polygon, dtype=float)
+    west = polygon[:, 0].min()
+    lon = (np.asarray(lon, dtype=float) - west) % 360 + west
+    lat = np.asarray(lat, dtype=float)
+
+    inside = np.zeros(np.broadcast(lon, lat).shape, dtype=bool)
+    for (lon_0, lat_0), (lon_1, lat_1) in zip(
+            polygon, np.roll(polygon, -1, axis=0)):
+        crosses = (lat_0 > lat) != (lat_1 > lat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lon_cross = lon_0 + (lat - lat_0) * (lon_1 - lon_0) / (
+                lat_1 - lat_0)
+        inside ^= crosses & (lon < lon_cross)
+    return inside
+
+
+def _get_polygons(region):
+    """Return a list of polygons for a polygon or a sequence of polygons."""
+    if np.ndim(region[0][0]) == 0:
+        return [np.asarray(region, dtype=float), ]
+    return [np.asarray(polygon, dtype=float) for polygon in region]
+
+
+def _get_coordinate_reader(ds):
+    """Return a function reading each coordinate of `ds` only once."""
+    values = {}
+
+    def _read(name):
+        if name not in values:
+            values[name] = np.ascontiguousarray(ds[name].values, dtype=float)
+        return values[name]
+
+    return _read
+
+
+def _get_mesh_hash(read, **kwargs):
+    names = get_name_dict("region_masks", **kwargs)["t"]
+    key = hashlib.sha1()
+    for name in (names["lon"], names["lat"]):
+        values = read(name)
+        key.update(str(values.shape).encode())
+        key.update(values.tobytes())
+    return key.hexdigest()
+
+
+def get_mesh_hash(ds, **kwargs):
+    """Hash the coordinates of the T points of `ds`.
+
+    This identifies the mesh in the keys of the cached region masks (see
+    `get_region_bits`).
+    """
+    return _get_mesh_hash(_get_coordinate_reader(ds), **kwargs)
+
+
+def _get_cache_key(mesh_hash, polygons):
+    """Combine the hash of the mesh with a hash of the polygons."""
+    key = hashlib.sha1(mesh_hash.encode())
+    for polygon in polygons:
+        key.update(polygon.tobytes())
+    return key.hexdigest()
+
+
+def _find_region_bits(read, polygons, **kwargs):
+    """Find the points inside the polygons on all grid points as bits."""
+    bits = {}
+    for grid_point, names in get_name_dict("region_masks", **kwargs).items():
+        lon, lat = read(names["lon"]), read(names["lat"])
+        inside = np.zeros(lon.shape, dtype=bool)
+        for polygon in polygons:
+            inside |= points_in_polygon(lon, lat, polygon)
+        bits[grid_point] = (np.packbits(inside, axis=None), inside.shape)
+    return bits
+
+
+def _get_region_bits(read, region, cache_dir=None, mesh_hash=None,
+                     **kwargs):
+    """See `get_region_bits`.  `read` is a `_get_coordinate_reader`."""
+    polygons = _get_polygons(region)
+    if mesh_hash is None:
+        mesh_hash = _get_mesh_hash(read, **kwargs)
+    key = _get_cache_key(mesh_hash, polygons)
+    if key in _region_mask_cache:
+        return _region_mask_cache[key]
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(str(cache_dir),
+                                  "region_mask_{}.npz".format(key))
+    if cache_file is not None and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            bits = {grid_point: (cached[grid_point],
+                                 tuple(cached[grid_point + "_shape"]))
+                    for grid_point in get_name_dict("region_masks",
+                                                    **kwargs)}
+    else:
+        bits = _find_region_bits(read, polygons, **kwargs)
+        if cache_file is not None:
+            os.makedirs(str(cache_dir), exist_ok=True)
+            tmp_file = cache_file + ".tmp.npz"
+            np.savez(tmp_file, **{
+                name: value
+                for grid_point, (packed, shape) in bits.items()
+                for name, value in [(grid_point, packed),
+                                    (grid_point + "_shape", shape)]})
+            os.replace(tmp_file, cache_file)
+
+    _region_mask_cache[key] = bits
+    return bits
+
+
+def get_region_bits(ds, region, cache_dir=None, mesh_hash=None, **kwargs):
+    """Return the (cached) bit masks of a region on all grid points.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    region : array like
+        Sequence of `(lon, lat)` vertices of a polygon, or a sequence of
+        polygons (the region is their union).  See `points_in_polygon`.
+    cache_dir : Path | str
+        Also cache the bit masks in files in this directory, so they are
+        shared between sessions.  Default is None (only cache in memory).
+    mesh_hash : str
+        Hash of the mesh (see `get_mesh_hash`).  Pass it to get the masks of
+        many regions without reading and hashing the coordinates for each of
+        them.  Default is None (hash the coordinates of `ds`).
+
+    Returns
+    -------
+    dict
+        With packed bits (see `numpy.packbits`) and the shape for each grid
+        point.
+
+    """
+    return _get_region_bits(_get_coordinate_reader(ds), region,
+                            cache_dir=cache_dir, mesh_hash=mesh_hash,
+                            **kwargs)
+
+
+def clear_region_mask_cache():
+    """Forget all region masks cached in memory."""
+    _region_mask_cache.clear()
+
+
+def add_region_masks(ds, regions=None, cache_dir=None, **kwargs):
+    """Add masks of regions on all grid points as coordinates.
+
+    For each region `name`, this adds the boolean masks `"tmask{name}"`,
+    `"umask{name}"`, `"vmask{name}"`, and `"fmask{name}"`.  Like the basin
+    masks of the mesh masks, they are two dimensional and are false on land
+    (at the surface).
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        A grid-aware dataset as produced by `xorca.lib.preprocess_orca`.
+    regions : dict
+        Polygons (see `get_region_bits`) per region name.  Defaults to the
+        regions from `xorca.orca_names.region_polygons`, which can be updated
+        with `update_region_polygons`.
+    cache_dir : Path | str
+        See `get_region_bits`.
+
+    Returns
+    -------
+    xarray dataset
+
+    """
+    if regions is None:
+        regions = get_name_dict("region_polygons", **kwargs)
+    region_masks = get_name_dict("region_masks", **kwargs)
+
+    # read and hash the coordinates only once for all regions
+    ds = ds.copy()
+    read = _get_coordinate_reader(ds)
+    mesh_hash = _get_mesh_hash(read, **kwargs)
+    for name, region in regions.items():
+        bits = _get_region_bits(read, region, cache_dir=cache_dir,
+                                mesh_hash=mesh_hash, **kwargs)
+        for grid_point, names in region_masks.items():
+            packed, shape = bits[grid_point]
+            inside = np.unpackbits(packed, count=int(np.prod(shape)))
+            inside = inside.reshape(shape).astype(bool)
+            mask = ds[names["lon"]].copy(data=inside).reset_coords(drop=True)
+            if names["mask"] in ds.variables:
+                land_mask = ds[names["mask"]]
+                if "z_c" in land_mask.dims:
+                    land_mask = land_mask.isel(z_c=0)
+                mask = mask & land_mask.astype(bool).reset_coords(drop=True)
+            ds.coords["{}mask{}".format(grid_point, name)] = mask
+    return ds
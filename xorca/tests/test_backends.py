@@ -0,0 +1,110 @@
+"""Test the detection of formats and the backends."""
+
+import numpy as np
+import os
+import pickle
+import pytest
+import xarray as xr
+
+from xorca import backends
+
+
+@pytest.fixture(scope="function")
+def temp_dir(tmpdir_factory):
+    temp_dir = tmpdir_factory.mktemp('data')
+    yield temp_dir
+    temp_dir.remove()
+
+
+def _get_data_set():
+    return xr.Dataset(
+        {"votemper": (("time_counter", "z", "y", "x"),
+                      np.ones((2, 3, 4, 5)))},
+        coords={"time_counter": np.array(["2000-01-01", "2000-01-02"],
+                                         dtype="datetime64[ns]")})
+
+
+@pytest.mark.parametrize(
+    "write_kwargs, file_name, file_format",
+    [({"format": "NETCDF3_CLASSIC"}, "data.nc", "netcdf3"),
+     ({"format": "NETCDF4"}, "data.nc", "netcdf4"),
+     ({"format": "NETCDF4"}, "data_without_suffix", "netcdf4"),
+     (None, "data.zarr", "zarr"),
+     (None, "store_without_suffix", "zarr")])
+def test_detect_format(temp_dir, write_kwargs, file_name, file_format):
+    path = str(temp_dir.join(file_name))
+    ds = _get_data_set()
+    if write_kwargs is None:
+        ds.to_zarr(path)
+    else:
+        ds.to_netcdf(path, **write_kwargs)
+
+    assert backends.detect_format(path) == file_format
+
+    ds_reread = backends.open_dataset(path, chunks={})
+    assert ds_reread.votemper.shape == ds.votemper.shape
+
+
+def test_detect_format_unknown(temp_dir):
+    path = str(temp_dir.join("unknown.txt"))
+    with open(path, "w") as f:
+        f.write("no data")
+
+    with pytest.raises(ValueError):
+        backends.detect_format(path)
+
+
+def test_backend_options(temp_dir, monkeypatch):
+    path = str(temp_dir.join("data.nc"))
+    _get_data_set().to_netcdf(path, format="NETCDF4")
+
+    calls = []
+
+    def _open(path, **kwargs):
+        calls.append(kwargs)
+        return xr.open_dataset(path)
+
+    monkeypatch.setitem(backends.backends, "netcdf4",
+                        {"open": _open, "options": {"cache": False}})
+
+    backends.open_dataset(path, chunks={})
+    backends.open_dataset(path, backend_options={"netcdf4": {"lock": False},
+                                                 "zarr": {"foo": "bar"}})
+
+    assert calls[0] == {"cache": False, "chunks": {}}
+    assert calls[1] == {"cache": False, "lock": False}
+
+
+def test_open_netcdf3_memmap(temp_dir):
+    path = str(temp_dir.join("mesh_mask.nc"))
+    ds = _get_data_set()
+    ds["e1t"] = (("y", "x"), np.arange(20.0).reshape(4, 5))
+    ds.to_netcdf(path, format="NETCDF3_64BIT")
+
+    ds_mm = backends.open_netcdf3_memmap(path)
+
+    # lazy arrays in native byte order which are only created once
+    assert ds_mm.e1t.variable._in_memory is False
+    assert ds_mm.e1t.dtype == np.float64
+    assert backends.open_netcdf3_memmap(path) is ds_mm
+    np.testing.assert_array_equal(ds_mm.e1t.values, ds.e1t.values)
+
+    ds_chunked = backends.open_netcdf3_memmap(path, chunks={"y": 2},
+                                              decode_cf=True)
+    assert ds_chunked.e1t.chunks == ((2, 2), (5, ))
+    assert ds_chunked.time_counter.dtype == ds.time_counter.dtype
+
+    # the graph only holds the layout of the variables, not their data
+    ds_large = xr.Dataset({"e1t": (("y", "x"), np.ones((200, 300)))})
+    mtime = os.stat(path).st_mtime_ns
+    ds_large.to_netcdf(path, format="NETCDF3_64BIT")
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    ds_chunked = backends.open_netcdf3_memmap(path, chunks={"y": 50})
+    assert ds_chunked.e1t.dtype.isnative
+    assert len(pickle.dumps(ds_chunked.e1t.data)) < ds_large.e1t.nbytes / 20
+    np.testing.assert_array_equal(
+        pickle.loads(pickle.dumps(ds_chunked.e1t.data)).compute(),
+        ds_large.e1t.values)
+
+    # changed files replace their entries
+    assert len(backends._memmapped_datasets) == 1
@@ -0,0 +1,180 @@
+"""Test the budgets of regions."""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from xorca.budget import calculate_advective_convergence, calculate_budget
+from xorca.calc import add_thickness_weights
+from xorca.halo import get_north_fold_halo
+from xorca.orca_names import budget_tracers
+
+
+def _get_budget_ds(N_t=3, N_z=4, N_y=6, N_x=8, seed=137):
+    """Grid-aware data set with T points at lon = 45 x - 170.
+
+    The northern boundary is closed and the vertical velocity vanishes at the
+    surface, so that the domain as a whole has no advective fluxes.
+    """
+    rng = np.random.RandomState(seed=seed)
+
+    coords = {
+        "t": (["t", ], np.arange(N_t).astype("datetime64[D]")),
+        "z_c": (["z_c", ], np.arange(1, N_z + 1), {"axis": "Z"}),
+        "z_l": (["z_l", ], np.arange(1, N_z + 1) - 0.5,
+                {"axis": "Z", "c_grid_axis_shift": - 0.5}),
+        "y_c": (["y_c", ], np.arange(1, N_y + 1), {"axis": "Y"}),
+        "y_r": (["y_r", ], np.arange(1, N_y + 1) + 0.5,
+                {"axis": "Y", "c_grid_axis_shift": 0.5}),
+        "x_c": (["x_c", ], np.arange(1, N_x + 1), {"axis": "X"}),
+        "x_r": (["x_r", ], np.arange(1, N_x + 1) + 0.5,
+                {"axis": "X", "c_grid_axis_shift": 0.5}),
+        "depth_c": (["z_c", ], - 10.0 * np.arange(N_z) - 5.0),
+        "depth_l": (["z_l", ], - 10.0 * np.arange(N_z)),
+    }
+    lon_c = 45.0 * np.arange(N_x) - 170.0
+    lat_c = np.linspace(-60, 60, N_y)
+    for y, x, dims in [("c", "c", ["y_c", "x_c"]), ("c", "r", ["y_c", "x_r"]),
+                       ("r", "c", ["y_r", "x_c"]), ("r", "r", ["y_r", "x_r"])]:
+        llon, llat = np.meshgrid(lon_c + (22.5 if x == "r" else 0),
+                                 lat_c + (12.0 if y == "r" else 0))
+        coords["llon_" + y + x] = (dims, llon)
+        coords["llat_" + y + x] = (dims, llat)
+    for e, dims in [("e1t", ["y_c", "x_c"]), ("e2t", ["y_c", "x_c"]),
+                    ("e2u", ["y_c", "x_r"]), ("e1v", ["y_r", "x_c"])]:
+        coords[e] = (dims, 1.0e4 * (1 + 0.1 * rng.rand(N_y, N_x)))
+
+    tmask = np.ones((N_z, N_y, N_x))
+    tmask[2:, :2, :] = 0  # shallow shelf in the south
+    tmask[:, 3, 4] = 0  # an island
+    umask = tmask * np.roll(tmask, -1, axis=-1)
+    vmask = tmask * np.roll(tmask, -1, axis=-2)
+    vmask[:, -1] = 0
+    e3 = 10.0 * np.ones((N_z, N_y, N_x))
+    e3[-1] = 5.0 + 5.0 * rng.rand(N_y, N_x)  # partial bottom cells
+    coords["e3t"] = (["z_c", "y_c", "x_c"], e3)
+    coords["e3u"] = (["z_c", "y_c", "x_r"], e3)
+    coords["e3v"] = (["z_c", "y_r", "x_c"], e3)
+    coords["tmask"] = (["z_c", "y_c", "x_c"], tmask)
+    coords["umask"] = (["z_c", "y_c", "x_r"], umask)
+    coords["vmask"] = (["z_c", "y_r", "x_c"], vmask)
+
+    trend = np.arange(N_t)[:, np.newaxis, np.newaxis, np.newaxis]
+    w = rng.randn(N_t, N_z, N_y, N_x) * tmask
+    w[:, 0] = 0
+    data_vars = {
+        "votemper": (["t", "z_c", "y_c", "x_c"],
+                     (10 + rng.randn(1, N_z, N_y, N_x) + 0.5 * trend) *
+                     tmask),
+        "vozocrtx": (["t", "z_c", "y_c", "x_r"],
+                     rng.randn(N_t, N_z, N_y, N_x) * umask),
+        "vomecrty": (["t", "z_c", "y_r", "x_c"],
+                     rng.randn(N_t, N_z, N_y, N_x) * vmask),
+        "vovecrtz": (["t", "z_l", "y_c", "x_c"], 1e-3 * w),
+        "sohefldo": (["t", "y_c", "x_c"], 100.0 * np.ones((N_t, N_y, N_x))),
+    }
+    return xr.Dataset(data_vars=data_vars, coords=coords)
+
+
+@pytest.fixture(params=[False, True], ids=["numpy", "dask"])
+def budget_ds(request):
+    ds = _get_budget_ds()
+    if request.param:
+        ds = ds.chunk({"t": 1, "z_c": 2, "z_l": 2,
+                       "y_c": 3, "y_r": 3, "x_c": 4, "x_r": 4})
+    return ds
+
+
+halves = {"west": [(-180, -90), (0, -90), (0, 90), (-180, 90)],
+          "east": [(0, -90), (180, -90), (180, 90), (0, 90)]}
+
+
+def test_advective_convergence_vanishes_globally(budget_ds):
+    conv = calculate_advective_convergence(budget_ds, "votemper")
+    assert conv.dims == ("t", "z_c", "y_c", "x_c")
+    assert (conv.where(budget_ds.tmask == 0, 0) == 0).all()
+    scale = abs(conv).sum(["z_c", "y_c", "x_c"])
+    np.testing.assert_allclose(
+        (conv.sum(["z_c", "y_c", "x_c"]) / scale).values, 0, atol=1e-12)
+
+
+@pytest.mark.parametrize("fold_type", ["T", "F"])
+def test_advective_convergence_through_north_fold(budget_ds, fold_type):
+    # open the northern boundary
+    vmask = budget_ds.vmask.values.copy()
+    vmask[:, -1] = budget_ds.tmask.values[:, -1]
+    ds = budget_ds.assign_coords(vmask=(budget_ds.vmask.dims, vmask))
+    ds["vomecrty"] = ds.vomecrty.where(
+        ds.y_r < ds.y_r[-1], 0.5 * ds.vmask).transpose(*ds.vomecrty.dims)
+
+    conv = calculate_advective_convergence(ds, "votemper",
+                                           fold_type=fold_type)
+    conv_closed = calculate_advective_convergence(ds, "votemper",
+                                                  fold_type=None)
+
+    # only the flux through the northern faces of the last row changes
+    tracer = ds.votemper.where(ds.tmask > 0, 0).reset_coords(drop=True)
+    tracer_north = get_north_fold_halo(tracer, fold_type).isel(y_c=0)
+    ve = (ds.e1v * ds.e3v * ds.vomecrty).where(ds.vmask > 0, 0).isel(y_r=-1)
+    conv_last = (conv_closed.isel(y_c=-1) - 0.5 * ve * tracer_north).where(
+        ds.tmask.isel(y_c=-1) > 0, 0)
+    np.testing.assert_allclose(
+        conv.isel(y_c=-1).values,
+        conv_last.transpose(*conv.isel(y_c=-1).dims).values)
+    np.testing.assert_allclose(conv.isel(y_c=slice(0, -1)).values,
+                               conv_closed.isel(y_c=slice(0, -1)).values)
+    assert not np.allclose(conv.values, conv_closed.values)
+
+
+def test_budget_terms(budget_ds):
+    factor = budget_tracers["heat"]["factor"]
+    budget = calculate_budget(budget_ds, "heat", regions=halves).compute()
+    assert dict(budget.sizes) == {"t": 3, "region": 2}
+    assert list(budget.region.values) == ["west", "east"]
+
+    # fluxes between the halves through the faces of the U points west of
+    # the T points at x = 0 and east of the T points at x = 3
+    ds = budget_ds
+    temp_u = 0.5 * (ds.votemper.values +
+                    np.roll(ds.votemper.values, -1, axis=-1))
+    flux_u = (ds.e2u.values * ds.e3u.values * ds.vozocrtx.values *
+              temp_u).sum(axis=(1, 2))
+    np.testing.assert_allclose(budget.advection.sel(region="west").values,
+                               factor * (flux_u[:, -1] - flux_u[:, 3]))
+    np.testing.assert_allclose(budget.advection.sum("region").values, 0,
+                               atol=1e-12 * factor * abs(flux_u).max())
+
+    volume = (ds.e1t * ds.e2t * ds.e3t * ds.tmask).sum().values
+    np.testing.assert_allclose(budget.storage.sum("region").values,
+                               factor * 0.5 / 86400 * volume)
+    area = (ds.e1t * ds.e2t * ds.tmask.isel(z_c=0)).sum().values
+    np.testing.assert_allclose(budget.surface.sum("region").values,
+                               100.0 * area)
+    xr.testing.assert_allclose(
+        budget.residual,
+        budget.storage - budget.advection - budget.surface)
+
+
+def test_budget_regions_and_depth_ranges(budget_ds):
+    ds = add_thickness_weights(budget_ds, grid_points=("t", ))
+    budget = calculate_budget(ds, regions=halves).compute()
+
+    # existing masks and the whole domain are found by default
+    ds.coords["tmaskwest"] = ((budget_ds.llon_cc < 0) & (
+        budget_ds.tmask.isel(z_c=0) > 0)).reset_coords(drop=True)
+    budget_default = calculate_budget(ds, depth_range=(0, 1e4)).compute()
+    assert list(budget_default.region.values) == ["global", "west"]
+    xr.testing.assert_allclose(budget_default.sel(region="west"),
+                               budget.sel(region="west"))
+    # the advection vanishes globally up to rounding errors
+    xr.testing.assert_allclose(budget_default.sel(region="global", drop=True),
+                               budget.sum("region"), atol=1.0)
+
+    # the surface flux only enters at the surface
+    upper = calculate_budget(ds, regions=["global"], depth_range=(0, 15))
+    lower = calculate_budget(ds, regions=["global"], depth_range=(15, 1e4))
+    assert (upper.surface > 0).all()
+    assert (lower.surface == 0).all()
+    xr.testing.assert_allclose((upper + lower)[["content", "advection"]],
+                               budget_default.sel(region=["global"])[
+                                   ["content", "advection"]], atol=1.0)
@@ -0,0 +1,465 @@
+"""Test the calculations with grid-aware data sets."""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from xorca.calc import (_get_psi_lsq_solver, add_thickness_weights,
+                        calculate_divergence, calculate_eke, calculate_moc,
+                        calculate_psi, calculate_speed,
+                        calculate_thickness_weights,
+                        calculate_vertical_integral, calculate_vertical_mean,
+                        calculate_vertical_remapping, calculate_vorticity,
+                        StreamingMoments)
+from xorca.halo import pad_north_fold
+from xorca.lib import apply_compact_dtypes
+
+
+def _get_xorca_data_set(N_t=3, N_z=6, N_y=10, N_x=12, seed=137):
+    """Create a small random grid-aware data set."""
+    rng = np.random.RandomState(seed=seed)
+
+    depth_l = np.arange(N_z) * 10.0
+    depth_c = depth_l + 5.0
+
+    tmask = np.ones((N_z, N_y, N_x))
+    tmask[3:, :2, :] = 0  # shallow shelf in the south
+    tmask[:, 4:6, 3:5] = 0  # an island
+
+    coords = {
+        "t": (["t", ], np.arange(N_t).astype("datetime64[D]")),
+        "z_c": (["z_c", ], np.arange(1, N_z + 1), {"axis": "Z"}),
+        "z_l": (["z_l", ], np.arange(1, N_z + 1) - 0.5,
+                {"axis": "Z", "c_grid_axis_shift": - 0.5}),
+        "y_c": (["y_c", ], np.arange(1, N_y + 1), {"axis": "Y"}),
+        "y_r": (["y_r", ], np.arange(1, N_y + 1) + 0.5,
+                {"axis": "Y", "c_grid_axis_shift": 0.5}),
+        "x_c": (["x_c", ], np.arange(1, N_x + 1), {"axis": "X"}),
+        "x_r": (["x_r", ], np.arange(1, N_x + 1) + 0.5,
+                {"axis": "X", "c_grid_axis_shift": 0.5}),
+        "depth_c": (["z_c", ], - depth_c),
+        "depth_l": (["z_l", ], - depth_l),
+    }
+    for gp, dims in [("cc", ["y_c", "x_c"]), ("cr", ["y_c", "x_r"]),
+                     ("rc", ["y_r", "x_c"]), ("rr", ["y_r", "x_r"])]:
+        coords["llat_" + gp] = (dims, np.linspace(-80, 80, N_y)[:, np.newaxis]
+                                * np.ones((1, N_x)))
+        coords["llon_" + gp] = (dims, np.linspace(-180, 180, N_x)[np.newaxis]
+                                * np.ones((N_y, 1)))
+    for e, dims in [("e1t", ["y_c", "x_c"]), ("e2t", ["y_c", "x_c"]),
+                    ("e1u", ["y_c", "x_r"]), ("e2u", ["y_c", "x_r"]),
+                    ("e1v", ["y_r", "x_c"]), ("e2v", ["y_r", "x_c"]),
+                    ("e1f", ["y_r", "x_r"]), ("e2f", ["y_r", "x_r"])]:
+        coords[e] = (dims, 1.0e4 * (1 + 0.1 * rng.rand(N_y, N_x)))
+    e3 = 10.0 * np.ones((N_z, N_y, N_x))
+    e3[-1] = 5.0 + 5.0 * rng.rand(N_y, N_x)  # partial bottom cells
+    coords["e3t"] = (["z_c", "y_c", "x_c"], e3)
+    coords["e3u"] = (["z_c", "y_c", "x_r"], e3)
+    coords["e3v"] = (["z_c", "y_r", "x_c"], e3)
+    coords["e3w"] = (["z_l", "y_c", "x_c"], 10.0 * np.ones((N_z, N_y, N_x)))
+    coords["tmask"] = (["z_c", "y_c", "x_c"], tmask)
+    coords["umask"] = (["z_c", "y_c", "x_r"],
+                       tmask * np.roll(tmask, -1, axis=-1))
+    coords["vmask"] = (["z_c", "y_r", "x_c"],
+                       tmask * np.roll(tmask, -1, axis=-2))
+    coords["fmask"] = (["z_c", "y_r", "x_r"],
+                       coords["umask"][1] * np.roll(coords["umask"][1], -1,
+                                                    axis=-2))
+
+    data_vars = {
+        name: (["t", "z_c", ] + dims,
+               rng.randn(N_t, N_z, N_y, N_x) * coords[mask][1])
+        for name, dims, mask in [
+            ("votemper", ["y_c", "x_c"], "tmask"),
+            ("vosaline", ["y_c", "x_c"], "tmask"),
+            ("vozocrtx", ["y_c", "x_r"], "umask"),
+            ("vomecrty", ["y_r", "x_c"], "vmask")]}
+
+    return xr.Dataset(data_vars=data_vars, coords=coords)
+
+
+@pytest.fixture(params=[False, True], ids=["numpy", "dask"])
+def xorca_ds(request):
+    ds = _get_xorca_data_set()
+    if request.param:
+        ds = ds.chunk({"t": 1, "z_c": 2, "z_l": 2,
+                       "y_c": 5, "y_r": 5, "x_c": 6, "x_r": 6})
+    return ds
+
+
+@pytest.mark.parametrize("grid_point", ["t", "u", "v", "w"])
+def test_thickness_weights_full_column(xorca_ds, grid_point):
+    e3 = {"t": "e3t", "u": "e3u", "v": "e3v", "w": "e3w"}[grid_point]
+    mask = {"t": "tmask", "u": "umask", "v": "vmask", "w": "tmask"}[
+        grid_point]
+    weights = calculate_thickness_weights(xorca_ds, grid_point)
+
+    np.testing.assert_allclose(
+        weights.values, xorca_ds[e3].values * xorca_ds[mask].values)
+
+
+@pytest.mark.parametrize("depth_range", [(0, 30), (12.5, 37.5), (0, 1e4)])
+def test_thickness_weights_depth_range(xorca_ds, depth_range):
+    weights = calculate_thickness_weights(xorca_ds, "t",
+                                          depth_range=depth_range)
+    full_weights = calculate_thickness_weights(xorca_ds, "t")
+
+    # column thickness in the range is the range clipped to the bottom
+    bottom = full_weights.sum("z_c")
+    expected = (bottom.clip(max=depth_range[1]) - depth_range[0]).clip(min=0)
+    np.testing.assert_allclose(weights.sum("z_c").values, expected.values)
+
+
+def test_add_thickness_weights_is_reused(xorca_ds):
+    ds = add_thickness_weights(xorca_ds)
+    assert all("weights_" + gp in ds.coords for gp in "tuvw")
+
+    # weights present as coords will be used without recomputing them
+    ds.coords["weights_t"] = 2 * ds.coords["weights_t"]
+    np.testing.assert_allclose(
+        calculate_vertical_integral(ds, ds.votemper).values,
+        2 * calculate_vertical_integral(xorca_ds, xorca_ds.votemper).values)
+
+
+def test_vertical_integral_and_mean(xorca_ds):
+    vint = calculate_vertical_integral(xorca_ds, xorca_ds.votemper)
+    vint_here = (xorca_ds.votemper * xorca_ds.e3t *
+                 xorca_ds.tmask).sum("z_c")
+    np.testing.assert_allclose(vint.values, vint_here.transpose(
+        *vint.dims).values)
+
+    vmean = calculate_vertical_mean(xorca_ds, xorca_ds.votemper,
+                                    depth_range=(0, 30))
+    vmean_here = xorca_ds.votemper.isel(z_c=slice(0, 3)).where(
+        xorca_ds.tmask.isel(z_c=slice(0, 3)) > 0).mean("z_c")
+    np.testing.assert_allclose(vmean.values, vmean_here.transpose(
+        *vmean.dims).values)
+
+
+def test_vertical_remapping_is_conservative(xorca_ds):
+    bounds = np.linspace(-5, 5, 11)
+    remapped = calculate_vertical_remapping(
+        xorca_ds, xorca_ds.vosaline, xorca_ds.votemper, bounds)
+    assert remapped.dims == ("t", "layer", "y_c", "x_c")
+    assert remapped.name == "vosaline"
+    if xorca_ds.chunks:
+        assert remapped.chunks[-2:] == (xorca_ds.chunks["y_c"],
+                                        xorca_ds.chunks["x_c"])
+    np.testing.assert_allclose(remapped.layer, np.arange(-4.5, 5))
+
+    content = (remapped.fillna(0) * remapped.e3_layer).sum("layer")
+    vint = calculate_vertical_integral(xorca_ds, xorca_ds.vosaline)
+    np.testing.assert_allclose(content.values,
+                               vint.transpose(*content.dims).values,
+                               atol=1e-10)
+    column = (xorca_ds.e3t * xorca_ds.tmask).sum("z_c")
+    np.testing.assert_allclose(remapped.e3_layer.sum("layer").values,
+                               column.broadcast_like(content).values)
+
+
+def test_vertical_remapping_to_depth_layers(xorca_ds):
+    # layers bounded by the cell faces reproduce the data on the levels
+    depth = - xorca_ds.depth_c.broadcast_like(xorca_ds.votemper)
+    bounds = np.append(- xorca_ds.depth_l.values, 60.0)
+    remapped = calculate_vertical_remapping(
+        xorca_ds, xorca_ds.votemper, depth, bounds)
+    expected = xorca_ds.votemper.where(xorca_ds.tmask > 0)
+    np.testing.assert_allclose(remapped.values, expected.values)
+    np.testing.assert_allclose(
+        remapped.e3_layer.values,
+        (xorca_ds.e3t * xorca_ds.tmask).broadcast_like(expected).values)
+
+
+def test_calculate_psi_shape(xorca_ds):
+    psi = calculate_psi(xorca_ds)
+    assert set(psi.dims) == {"t", "y_r", "x_r"}
+    np.testing.assert_allclose(psi.isel(y_r=-1, x_r=-1).values, 0)
+
+
+def test_time_varying_e3(xorca_ds):
+    ds = xorca_ds.copy()
+    factor = xr.DataArray([1.0, 1.1, 0.9], dims=["t", ])
+    ds["e3t"] = ds.e3t * factor
+    ds["e3u"] = ds.e3u * factor
+
+    vint = calculate_vertical_integral(ds, ds.votemper, depth_range=(0, 30))
+    assert "t" in vint.dims
+
+    psi = calculate_psi(ds)
+    psi_static = calculate_psi(xorca_ds)
+    np.testing.assert_allclose(
+        (psi / factor).transpose(*psi_static.dims).values,
+        psi_static.values, atol=1e-12)
+
+
+def test_calculate_moc(xorca_ds):
+    moc = calculate_moc(xorca_ds)
+
+    # integrate zonally and from the bottom up to the upper face of each cell
+    Ve3 = (xorca_ds.vomecrty * xorca_ds.e3v * xorca_ds.e1v *
+           xorca_ds.vmask).sum("x_c")
+    moc_here = - Ve3.isel(z_c=slice(None, None, -1)).cumsum("z_c").isel(
+        z_c=slice(None, None, -1)) / 1.0e6
+
+    np.testing.assert_allclose(
+        moc.transpose("t", "z_l", "y_r").values,
+        moc_here.transpose("t", "z_c", "y_r").values, atol=1e-12)
+    assert "lat_moc" in moc.coords
+
+
+def test_compact_dtypes(xorca_ds):
+    ds = apply_compact_dtypes(xorca_ds.copy())
+    for v in ["vozocrtx", "vomecrty"]:
+        ds[v] = ds[v].astype(np.float32)
+
+    assert ds.tmask.dtype == bool
+    assert ds.e3t.dtype == np.float32
+
+    for func in [calculate_moc, calculate_psi, calculate_speed]:
+        result = func(ds)
+        result_ref = func(xorca_ds)
+        assert result.dtype == np.float32
+        np.testing.assert_allclose(
+            result.transpose(*result_ref.dims).values, result_ref.values,
+            rtol=1e-4, atol=1e-4 * float(abs(result_ref).max()))
+
+
+def test_packed_variables(xorca_ds):
+    # pack like NEMO output stored as int16
+    ds = xorca_ds.copy()
+    for v in ["votemper", "vozocrtx", "vomecrty"]:
+        packed = (ds[v] / 1.0e-3).round().fillna(-32768).astype(np.int16)
+        ds[v] = packed.assign_attrs(scale_factor=1.0e-3, _FillValue=-32768)
+
+    for func in [calculate_moc, calculate_psi, calculate_speed]:
+        result = func(ds)
+        result_ref = func(xorca_ds)
+        np.testing.assert_allclose(
+            result.transpose(*result_ref.dims).values, result_ref.values,
+            rtol=1e-3, atol=1e-3 * float(abs(result_ref).max()))
+
+    mean = calculate_vertical_mean(ds, ds.votemper)
+    mean_ref = calculate_vertical_mean(xorca_ds, xorca_ds.votemper)
+    np.testing.assert_allclose(mean.values, mean_ref.values, atol=1e-3)
+
+
+def _get_transports_from_psi(psi):
+    """Return the transports given by the stream function `psi` on F points.
+
+    The transports follow from `U = - d psi / dy` and `V = d psi / dx` with
+    psi vanishing south of the first row and being periodic in X.
+    """
+    U_flux = - np.diff(psi, axis=0, prepend=0)
+    V_flux = np.diff(psi, axis=-1, prepend=psi[:, -1:])
+    return U_flux, V_flux
+
+
+def _set_barotropic_velocities(ds, U_flux, V_flux):
+    """Set velocities constant with depth yielding the given transports."""
+    for v, flux, mask, e3, e in [("vozocrtx", U_flux, "umask", "e3u", "e2u"),
+                                 ("vomecrty", V_flux, "vmask", "e3v", "e1v")]:
+        depth = (ds[e3] * ds[mask]).sum("z_c")
+        velocity = (flux / (depth * ds[e])).where(depth > 0, 0)
+        ds[v] = (velocity * ds[mask]).expand_dims(t=ds.t).transpose(
+            *ds[v].dims)
+    return ds
+
+
+def _get_psi_with_island(N_y, N_x):
+    y, x = np.meshgrid(np.arange(N_y), np.arange(N_x), indexing="ij")
+    psi = 1.0e6 * (np.sin(2 * np.pi * x / N_x) * y + 0.1 * y ** 2)
+    # psi is constant along the coasts of the island
+    psi[3:6, 2:5] = psi[3, 2]
+    return psi
+
+
+@pytest.mark.parametrize("integrate_along", ["Y", "X", "lsq"])
+def test_calculate_psi_recovers_psi(xorca_ds, integrate_along):
+    psi_true = _get_psi_with_island(xorca_ds.y_r.size, xorca_ds.x_r.size)
+    ds = _set_barotropic_velocities(xorca_ds.copy(),
+                                    *_get_transports_from_psi(psi_true))
+    psi = calculate_psi(ds, integrate_along=integrate_along)
+
+    expected = (psi_true - psi_true[-1, -1]) / 1.0e6
+    assert psi.dims == ("t", "y_r", "x_r")
+    for psi_t in psi.transpose("t", "y_r", "x_r").values:
+        np.testing.assert_allclose(psi_t, expected, atol=1e-6)
+
+
+def test_calculate_psi_lsq_removes_divergence(xorca_ds):
+    psi_true = _get_psi_with_island(xorca_ds.y_r.size, xorca_ds.x_r.size)
+    U_flux, V_flux = _get_transports_from_psi(psi_true)
+
+    # add a divergent flow (the gradient of a potential on T points) far
+    # from the island and the northern boundary
+    phi = np.zeros_like(psi_true)
+    phi[7:9, 6:10] = 1.0e6
+    U_flux += np.roll(phi, -1, axis=-1) - phi
+    V_flux += np.roll(phi, -1, axis=0) - phi
+
+    ds = _set_barotropic_velocities(xorca_ds.copy(), U_flux, V_flux)
+    psi_lsq = calculate_psi(ds, integrate_along="lsq")
+    psi_y = calculate_psi(ds, integrate_along="Y")
+
+    expected = (psi_true - psi_true[-1, -1]) / 1.0e6
+    np.testing.assert_allclose(psi_lsq.isel(t=0).values, expected,
+                               atol=1e-6)
+    assert not np.allclose(psi_y.isel(t=0).values, expected, atol=1e-6)
+
+    with pytest.raises(ValueError):
+        calculate_psi(ds, integrate_along="Z")
+
+
+def test_calculate_psi_lsq_graph_is_serializable(xorca_ds):
+    cloudpickle = pytest.importorskip("cloudpickle")
+    psi_true = _get_psi_with_island(xorca_ds.y_r.size, xorca_ds.x_r.size)
+    ds = _set_barotropic_velocities(xorca_ds.copy(),
+                                    *_get_transports_from_psi(psi_true))
+    ds = ds.chunk({"t": 1})
+
+    # the solver is only created when the graph is computed
+    _get_psi_lsq_solver.cache_clear()
+    psi = calculate_psi(ds, integrate_along="lsq")
+    assert _get_psi_lsq_solver.cache_info().misses == 0
+
+    psi = cloudpickle.loads(cloudpickle.dumps(psi))
+    expected = (psi_true - psi_true[-1, -1]) / 1.0e6
+    for psi_t in psi.transpose("t", "y_r", "x_r").values:
+        np.testing.assert_allclose(psi_t, expected, atol=1e-6)
+    assert _get_psi_lsq_solver.cache_info().misses == 1
+
+
+def _shift(da, dim, shift):
+    """Shift periodically along X and with zeros outside of Y."""
+    if dim.startswith("x"):
+        return da.roll({dim: shift})
+    return da.shift({dim: shift}, fill_value=0)
+
+
+def _on(da, **dims):
+    """Move `da` to other grid points by renaming its dims."""
+    return da.drop_vars(list(da.coords)).rename(dims)
+
+
+@pytest.mark.parametrize("fold_type", [None, "T", "F"])
+def test_calculate_vorticity(xorca_ds, fold_type):
+    zeta = calculate_vorticity(xorca_ds, fold_type=fold_type)
+
+    ds = xorca_ds.compute()
+    ue = ds.e1u * ds.vozocrtx
+    ve = ds.e2v * ds.vomecrty
+    ue_north = _shift(ue, "y_c", -1)
+    if fold_type is not None:
+        ue_north = pad_north_fold(ue, fold_type, sign=-1.0).isel(
+            y_c=slice(1, None))
+    zeta_here = (_on(_shift(ve, "x_c", -1) - ve, x_c="x_r") -
+                 _on(ue_north, y_c="y_r") + _on(ue, y_c="y_r")) / _on(
+                     ds.e1f * ds.e2f)
+    zeta_here = zeta_here.where(_on(ds.fmask) > 0)
+
+    assert zeta.dims == ("t", "z_c", "y_r", "x_r")
+    np.testing.assert_allclose(zeta.values,
+                               zeta_here.transpose(*zeta.dims).values)
+
+
+def test_calculate_divergence(xorca_ds):
+    div = calculate_divergence(xorca_ds)
+
+    ds = xorca_ds.compute()
+    ue = ds.e2u * ds.e3u * ds.vozocrtx
+    ve = ds.e1v * ds.e3v * ds.vomecrty
+    div_here = (_on(ue - _shift(ue, "x_r", 1), x_r="x_c") +
+                _on(ve - _shift(ve, "y_r", 1), y_r="y_c")) / _on(
+                    ds.e1t * ds.e2t * ds.e3t)
+    div_here = div_here.where(_on(ds.tmask) > 0)
+
+    assert div.dims == ("t", "z_c", "y_c", "x_c")
+    np.testing.assert_allclose(div.values,
+                               div_here.transpose(*div.dims).values)
+
+
+def test_calculate_eke(xorca_ds):
+    eke = calculate_eke(xorca_ds)
+
+    ds = xorca_ds.compute()
+    u2 = (ds.vozocrtx - ds.vozocrtx.mean("t")) ** 2
+    v2 = (ds.vomecrty - ds.vomecrty.mean("t")) ** 2
+    eke_here = 0.25 * (_on(u2 + _shift(u2, "x_r", 1), x_r="x_c") +
+                       _on(v2 + _shift(v2, "y_r", 1), y_r="y_c"))
+    eke_here = eke_here.where(_on(ds.tmask) > 0)
+
+    assert eke.dims == ("t", "z_c", "y_c", "x_c")
+    np.testing.assert_allclose(eke.values,
+                               eke_here.transpose(*eke.dims).values)
+
+    # relative to a given mean
+    eke_no_mean = calculate_eke(xorca_ds, mean=0.0 * xorca_ds.isel(t=0))
+    assert float(eke_no_mean.sum()) > float(eke.sum())
+
+
+@pytest.fixture(params=[False, True], ids=["numpy", "dask"])
+def long_xorca_ds(request):
+    ds = _get_xorca_data_set(N_t=7)
+    ds["votemper"] = ds.votemper + 20.0  # large mean, small anomalies
+    if request.param:
+        ds = ds.chunk({"t": 2, "y_c": 5, "y_r": 5})
+    return ds
+
+
+def test_streaming_moments(long_xorca_ds):
+    moments = StreamingMoments(variables=["vosaline"], fold_type=None)
+    moments.update(long_xorca_ds, t_block=3)
+
+    ds = long_xorca_ds.compute()
+    assert moments.n == 7
+    assert moments.t_last == ds.t.values[-1]
+    for name in ["vosaline", "votemper", "vomecrty"]:
+        np.testing.assert_allclose(
+            moments.mean(name).transpose(*ds[name].dims[1:]).values,
+            ds[name].mean("t").values)
+
+    # v'T' with T interpolated to the V points (closed in the north)
+    T = ds.votemper
+    T_v = 0.5 * (_on(T, y_c="y_r") + _on(_shift(T, "y_c", -1), y_c="y_r"))
+    v = ds.vomecrty.drop_vars(list(ds.vomecrty.coords))
+    vT_here = ((v - v.mean("t")) * (T_v - T_v.mean("t"))).mean("t")
+    vT = moments.covariance("vomecrty", "votemper")
+    assert vT.name == "vomecrty_votemper"
+    np.testing.assert_allclose(vT.transpose(*vT_here.dims).values,
+                               vT_here.values, atol=1e-12)
+
+    eke = moments.eke()
+    eke_here = calculate_eke(ds).mean("t")
+    np.testing.assert_allclose(
+        eke.where(_on(ds.tmask) > 0).transpose(*eke_here.dims).values,
+        eke_here.values)
+
+
+@pytest.mark.parametrize("calendar", ["standard", "noleap"])
+def test_streaming_moments_resume(long_xorca_ds, tmp_path, calendar):
+    if calendar != "standard":
+        long_xorca_ds = long_xorca_ds.assign_coords(t=xr.date_range(
+            "2001-02-27", periods=long_xorca_ds.sizes["t"], calendar=calendar,
+            use_cftime=True))
+    one_pass = StreamingMoments().update(long_xorca_ds, t_block=7)
+
+    # a state without any time steps
+    checkpoint = tmp_path / "moments.nc"
+    StreamingMoments().to_netcdf(checkpoint)
+    empty = StreamingMoments.from_netcdf(checkpoint)
+    assert empty.n == 0 and empty.t_last is None and empty.state is None
+
+    empty.update(long_xorca_ds.isel(t=slice(0, 4)), t_block=2,
+                 checkpoint=checkpoint)
+    resumed = StreamingMoments.from_netcdf(checkpoint)
+    assert resumed.n == 4
+    assert resumed.t_last == long_xorca_ds.t.values[3]
+    assert "t_last" not in resumed.state
+    # time steps already accumulated are skipped
+    resumed.update(long_xorca_ds, t_block=2, checkpoint=checkpoint)
+
+    assert resumed.n == 7
+    assert resumed.products == one_pass.products
+    for name in one_pass.state.data_vars:
+        np.testing.assert_allclose(resumed.state[name].values,
+                                   one_pass.state[name].values, atol=1e-12)
@@ -0,0 +1,179 @@
+"""Test the catalogs of data files."""
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from xorca.catalog import (get_grid_type, get_time_range_from_file_name,
+                           is_catalog, scan_files, select_files,
+                           select_files_by_name)
+from xorca.lib import load_xorca_dataset
+from xorca.profiling import LoadReport
+
+
+def _write_files(path, N_y=10, N_x=12, N_z=3):
+    """Write a mesh mask and monthly T and U files for three months."""
+    mesh_mask = xr.Dataset(
+        {name: (("t", "z", "y", "x"), np.ones((1, N_z, N_y, N_x)))
+         for name in ["tmask", "umask", "vmask", "fmask"]},
+        coords={"z": range(N_z), "y": range(N_y), "x": range(N_x)})
+    mesh_mask["e1t"] = (("t", "y", "x"), np.ones((1, N_y, N_x)))
+    mm_file = str(path / "mesh_mask.nc")
+    mesh_mask.to_netcdf(mm_file)
+
+    files = []
+    for month in ["2000-01", "2000-02", "2000-03"]:
+        times = pd.date_range(month, periods=2, freq="14D")
+        last_day = (times[0] + pd.offsets.MonthEnd()).strftime("%Y%m%d")
+        for grid, depth, name in [("T", "deptht", "votemper"),
+                                  ("U", "depthu", "vozocrtx")]:
+            ds = xr.Dataset(
+                {name: (("time_counter", depth, "y", "x"),
+                        np.random.randn(2, N_z, N_y, N_x))},
+                coords={"time_counter": times})
+            files.append(str(path / "ORCA_14d_{}_{}_grid_{}.nc".format(
+                times[0].strftime("%Y%m%d"), last_day, grid)))
+            ds.to_netcdf(files[-1])
+    return mm_file, files
+
+
+def test_get_grid_type():
+    assert get_grid_type("ORCA025_1d_20000101_grid_T.nc", {}) == "T"
+    assert get_grid_type("ORCA025_1d_20000101_gridU.nc", {}) == "U"
+    assert get_grid_type("mesh_mask.nc", {"depthv": 46}) == "V"
+    assert get_grid_type("mesh_mask.nc", {"z": 46}) is None
+
+
+def test_scan_files(tmp_path):
+    mm_file, files = _write_files(tmp_path)
+    catalog = scan_files(files[::-1] + [mm_file, ], max_workers=4)
+
+    assert is_catalog(catalog)
+    assert len(catalog) == 7
+    assert catalog.file[0] == mm_file  # no grid type and no time
+    assert pd.isna(catalog.t_start[0])
+    assert list(catalog.grid[1:]) == ["T"] * 3 + ["U"] * 3
+    assert list(catalog.file[1:4]) == files[0::2]
+    row = catalog.iloc[1]
+    assert row.t_start == pd.Timestamp("2000-01-01")
+    assert row.t_end == pd.Timestamp("2000-01-15")
+    assert row.n_t == 2
+    assert row.variables == ("votemper", )
+    assert row.dims == {"t": 2, "deptht": 3, "y": 10, "x": 12}
+
+
+def test_scan_files_errors(tmp_path):
+    _, files = _write_files(tmp_path)
+    missing = str(tmp_path / "missing.nc")
+    with pytest.raises(Exception):
+        scan_files(files + [missing, ])
+    with pytest.warns(RuntimeWarning, match="missing.nc"):
+        catalog = scan_files(files + [missing, ], errors="warn")
+    assert len(catalog) == len(files)
+
+
+def test_select_files(tmp_path):
+    mm_file, files = _write_files(tmp_path)
+    catalog = scan_files(files + [mm_file, ])
+
+    assert select_files(catalog, variables=["votemper"]) == files[0::2]
+    assert select_files(catalog, grid="U") == files[1::2]
+    assert select_files(catalog, grid="U", t_start="2000-01-10",
+                        t_end="2000-02-10") == files[1:4:2]
+    # files without time steps are always needed
+    assert select_files(catalog, t_start="2000-03-01") == (
+        [mm_file, ] + files[4:])
+
+
+def test_load_xorca_dataset_from_catalog(tmp_path):
+    mm_file, files = _write_files(tmp_path)
+    catalog = scan_files(files)
+
+    return_ds = load_xorca_dataset(data_files=catalog, aux_files=[mm_file, ],
+                                   variables=["votemper"])
+    return_ds_ref = load_xorca_dataset(data_files=files[0::2],
+                                       aux_files=[mm_file, ])
+
+    assert "vozocrtx" not in return_ds
+    xr.testing.assert_identical(return_ds, return_ds_ref)
+
+
+def test_get_time_range_from_file_name():
+    assert get_time_range_from_file_name(
+        "ORCA025.L46-KFS006_1d_19580101_19581231_grid_T.nc") == (
+            pd.Timestamp("1958-01-01"), pd.Timestamp("1958-12-31"))
+    assert get_time_range_from_file_name(
+        "/data/ORCA12_1h_195801010000_195801312300_grid_U.nc") == (
+            pd.Timestamp("1958-01-01"), pd.Timestamp("1958-01-31"))
+    assert get_time_range_from_file_name("mesh_mask.nc") is None
+    assert get_time_range_from_file_name("run_12345678_99999999.nc") is None
+
+
+def test_select_files_by_name(tmp_path):
+    mm_file, files = _write_files(tmp_path)
+    assert select_files_by_name(files + [mm_file, ], t_start="2000-02-01",
+                                t_end="2000-02-29") == files[2:4] + [mm_file]
+    assert select_files_by_name(files, t_start="2000-01-31") == files
+    assert select_files_by_name(files, t_start="2000-02-01") == files[2:]
+    assert select_files_by_name(files, t_end="2000-01-31") == files[:2]
+
+
+@pytest.mark.parametrize("source", ["names", "catalog", "time"])
+def test_load_xorca_dataset_time_range(tmp_path, source):
+    mm_file, files = _write_files(tmp_path)
+    data_files = files[0::2]
+    if source == "catalog":
+        data_files = scan_files(data_files)
+    elif source == "time":
+        # names without time ranges
+        data_files = []
+        for n, f in enumerate(files[0::2]):
+            data_files.append(str(tmp_path / "T_{}.nc".format(n)))
+            xr.open_dataset(f).load().to_netcdf(data_files[-1])
+
+    report = LoadReport()
+    return_ds = load_xorca_dataset(
+        data_files=data_files, aux_files=[mm_file, ], report=report,
+        t_start="2000-01-10", t_end="2000-02-10")
+    return_ds_ref = load_xorca_dataset(data_files=files[0::2],
+                                       aux_files=[mm_file, ])
+
+    xr.testing.assert_identical(
+        return_ds,
+        return_ds_ref.sel(t=slice("2000-01-10", "2000-02-10")))
+    opened = [ft for ft in report.file_times if ft[0] == "open"]
+    preprocessed = [ft for ft in report.file_times if ft[0] == "preprocess"]
+    assert len(preprocessed) == 2
+    assert len(opened) == (4 if source == "time" else 3)
+
+    with pytest.raises(ValueError, match="No time steps"):
+        load_xorca_dataset(data_files=data_files, aux_files=[mm_file, ],
+                           t_start="2001-01-01")
+
+
+def test_select_files_noleap(tmp_path):
+    mm_file, files = _write_files(tmp_path)
+    noleap_files = []
+    for n, year in enumerate([2001, 2002]):
+        times = xr.date_range("{}-02-01".format(year), periods=2, freq="14D",
+                              calendar="noleap", use_cftime=True)
+        ds = xr.open_dataset(files[0]).load().assign_coords(
+            time_counter=times)
+        noleap_files.append(str(tmp_path / "noleap_{}.nc".format(n)))
+        ds.to_netcdf(noleap_files[-1])
+    catalog = scan_files(noleap_files + [mm_file, ])
+    assert catalog["t_start"][1].calendar == "noleap"
+
+    assert select_files(catalog, t_start="2001-02-15") == (
+        [mm_file, ] + noleap_files)
+    assert select_files(catalog, t_start="2001-02-16") == (
+        [mm_file, ] + noleap_files[1:])
+    assert select_files(catalog, t_end="2001-12-31") == (
+        [mm_file, ] + noleap_files[:1])
+
+    return_ds = load_xorca_dataset(data_files=scan_files(noleap_files),
+                                   aux_files=[mm_file, ],
+                                   t_start="2001-02-10", t_end="2002-02-01")
+    assert [str(t) for t in return_ds.t.values] == [
+        "2001-02-15 00:00:00", "2002-02-01 00:00:00"]
@@ -0,0 +1,162 @@
+"""Test the north-fold aware halos."""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from xorca.halo import (diff, get_fold_type, get_north_fold_halo, interp,
+                        pad_north_fold)
+
+
+def _apply_nemo_lbc(raw, fold_type, grid_point, sign=1.0):
+    """Apply the cyclic and north-fold boundary conditions like NEMO.
+
+    This is a direct (0-based) translation of the loops of `lbc_nfd` acting
+    on the full grid including the halo columns and rows.
+    """
+    raw = raw.copy()
+    N_y, N_x = raw.shape
+    raw[:, 0] = raw[:, -2]
+    raw[:, -1] = raw[:, 1]
+
+    # mirrored column and source row (from the north) of the last row
+    if fold_type == "T":
+        mirror = {"t": lambda i: N_x - i, "u": lambda i: N_x - i - 1,
+                  "v": lambda i: N_x - i, "f": lambda i: N_x - i - 1}
+        source_row = {"t": 3, "u": 3, "v": 4, "f": 4}
+    else:
+        mirror = {"t": lambda i: N_x - i - 1, "u": lambda i: N_x - i - 2,
+                  "v": lambda i: N_x - i - 1, "f": lambda i: N_x - i - 2}
+        source_row = {"t": 2, "u": 2, "v": 3, "f": 3}
+
+    for i in range(N_x):
+        j = mirror[grid_point](i)
+        if 0 <= j < N_x:
+            raw[-1, i] = sign * raw[-source_row[grid_point], j]
+    return raw
+
+
+def _get_trimmed(raw, grid_point):
+    dims = {"t": ("y_c", "x_c"), "u": ("y_c", "x_r"),
+            "v": ("y_r", "x_c"), "f": ("y_r", "x_r")}[grid_point]
+    trimmed = raw[1:-1, 1:-1]
+    coords = {dims[0]: np.arange(trimmed.shape[0]) + 1.0,
+              dims[1]: np.arange(trimmed.shape[1]) + 1.0}
+    return xr.DataArray(trimmed, dims=dims, coords=coords)
+
+
+@pytest.mark.parametrize("fold_type", ["T", "F"])
+@pytest.mark.parametrize("grid_point", ["t", "u", "v", "f"])
+@pytest.mark.parametrize("sign", [1.0, -1.0])
+@pytest.mark.parametrize("chunks", [None, {"x": 3}])
+def test_north_fold_halo(fold_type, grid_point, sign, chunks):
+    raw = np.random.RandomState(seed=137).randn(9, 14)
+    raw = _apply_nemo_lbc(raw, fold_type, grid_point, sign=sign)
+    # the last row of the trimmed grid is not affected by the fold
+    trimmed = _get_trimmed(raw, grid_point)
+    halo_row = raw[-1, 1:-1]
+    if chunks is not None:
+        trimmed = trimmed.chunk({trimmed.dims[1]: chunks["x"]})
+
+    halo = get_north_fold_halo(trimmed, fold_type, sign=sign)
+    np.testing.assert_allclose(halo.values[0], halo_row)
+
+    padded = pad_north_fold(trimmed, fold_type, sign=sign)
+    assert padded.shape == (8, 12)
+    assert float(padded[padded.dims[0]][-1]) == 8.0
+    np.testing.assert_allclose(padded.values[:-1], trimmed.values)
+
+
+def _get_folded_ds(fold_type):
+    """Grid-aware coordinates of a folded grid."""
+    rng = np.random.RandomState(seed=137)
+    ds = xr.Dataset()
+    for grid_point, dims, suffix in [("t", ("y_c", "x_c"), "cc"),
+                                     ("v", ("y_r", "x_c"), "rc")]:
+        for name, scale in [("llat_", 60.0), ("llon_", 180.0)]:
+            raw = _apply_nemo_lbc(scale * rng.rand(9, 14), fold_type,
+                                  grid_point)
+            if fold_type == "T" and grid_point == "t":
+                # the pivot row is symmetric
+                raw[-2, 8:] = raw[-2, 6:0:-1]
+            if fold_type == "F" and grid_point == "v":
+                raw[-2, 7:] = raw[-2, 6::-1]
+            ds.coords[name + suffix] = _get_trimmed(raw, grid_point)
+    N_y, N_x = ds.llat_cc.shape
+    ds = ds.assign_coords({
+        "y_c": ("y_c", np.arange(1, N_y + 1), {"axis": "Y"}),
+        "y_r": ("y_r", np.arange(1, N_y + 1) + 0.5,
+                {"axis": "Y", "c_grid_axis_shift": 0.5}),
+        "x_c": ("x_c", np.arange(1, N_x + 1), {"axis": "X"}),
+        "x_r": ("x_r", np.arange(1, N_x + 1) + 0.5,
+                {"axis": "X", "c_grid_axis_shift": 0.5})})
+    return ds
+
+
+def _get_regular_ds(N_y=7, N_x=12):
+    """Grid-aware coordinates of a regular grid (without a fold)."""
+    lon, lat = np.meshgrid(30.0 * np.arange(N_x) - 180.0,
+                           np.linspace(-60.0, 60.0, N_y))
+    return _get_folded_ds("T").assign_coords({
+        "llon_cc": (("y_c", "x_c"), lon), "llat_cc": (("y_c", "x_c"), lat),
+        "llon_rc": (("y_r", "x_c"), lon),
+        "llat_rc": (("y_r", "x_c"), lat + 10.0)})
+
+
+@pytest.mark.parametrize("fold_type", ["T", "F"])
+def test_get_fold_type(fold_type):
+    ds = _get_folded_ds(fold_type)
+    assert get_fold_type(ds) == fold_type
+
+    # longitudes are compared modulo 360
+    ds["llon_cc"] = ds.llon_cc + 360.0 * (ds.x_c > 6)
+    ds["llon_rc"] = ds.llon_rc - 360.0 * (ds.x_c > 6)
+    assert get_fold_type(ds) == fold_type
+
+    ds.attrs["jperio"] = {"T": 6, "F": 4}[fold_type]
+    assert get_fold_type(ds) != fold_type
+
+    ds.attrs["jperio"] = 1
+    assert get_fold_type(ds) is None
+
+
+def test_get_fold_type_without_fold():
+    ds = _get_folded_ds("T")
+    ds["llat_cc"] = ds.llat_cc + ds.x_c
+    ds["llat_rc"] = ds.llat_rc + ds.x_c
+    assert get_fold_type(ds) is None
+
+    # the last rows of regular grids have constant latitudes, but their
+    # longitudes are not mirrored, also in windows of the grid
+    ds = _get_regular_ds()
+    assert get_fold_type(ds) is None
+    assert get_fold_type(ds.isel(x_c=slice(2, 9))) is None
+
+    da = ds.llat_cc
+    for function in [diff, interp]:
+        xr.testing.assert_identical(function(ds, da, "Y"),
+                                    function(ds, da, "Y", fold_type=None))
+
+
+@pytest.mark.parametrize("fold_type", ["T", "F"])
+def test_diff_and_interp_across_fold(fold_type):
+    ds = _get_folded_ds(fold_type)
+    rng = np.random.RandomState(seed=42)
+    raw = _apply_nemo_lbc(rng.randn(9, 14), fold_type, "t")
+    da = _get_trimmed(raw, "t")
+
+    # last row of differences reaches across the fold
+    da_diff = diff(ds, da, "Y", fold_type=fold_type)
+    assert da_diff.dims == ("y_r", "x_c")
+    np.testing.assert_allclose(da_diff.values,
+                               raw[2:, 1:-1] - raw[1:-1, 1:-1])
+
+    da_interp = interp(ds, da, "Y", fold_type=fold_type)
+    np.testing.assert_allclose(da_interp.values,
+                               0.5 * (raw[2:, 1:-1] + raw[1:-1, 1:-1]))
+
+    # X is periodic
+    da_diff_x = diff(ds, da, "X")
+    assert da_diff_x.dims == ("y_c", "x_r")
+    np.testing.assert_allclose(da_diff_x.values,
+                               np.roll(da.values, -1, axis=-1) - da.values)
@@ -1,13 +1,19 @@
 """Test the pre-processing lib."""
 
 from itertools import product
+import subprocess
+import sys
+
 import numpy as np
 import pytest
 import xarray as xr
 
-from xorca.lib import (create_minimal_coords_ds, get_name_dict, rename_dims,
-                       trim_and_squeeze)
+from xorca.lib import (copy_vars, create_minimal_coords_ds,
+                       get_input_chunks_for_target, get_name_dict,
+                       rename_dims, trim_and_squeeze, unpack,
+                       unpack_variables)
 from xorca import orca_names
+from xorca.cache import LRUCache
 
 
 @pytest.mark.parametrize(
@@ -166,3 +172,97 @@ def test_get_name_dict(dict_name, update_dict):
         (k in dict_updated.keys()) and
         (v == dict_updated[k])
         for k, v in dict_updated_here.items())
+
+
+@pytest.mark.parametrize(
+    "model_config, expected_y, expected_x",
+    [("GLOBAL", (31, 30, 30, 9), (51, 49)),
+     ("NEST", (30, 30, 30, 10), (50, 50))])
+def test_get_input_chunks_for_target(model_config, expected_y, expected_x):
+    ds = xr.Dataset({"votemper": (("time_counter", "deptht", "y", "x"),
+                                  np.empty((4, 10, 100, 100)))})
+    chunks = get_input_chunks_for_target(
+        ds, {"t": 2, "z_c": 3, "y_c": 30, "x_c": 50},
+        model_config=model_config)
+
+    assert chunks == {"time_counter": (2, 2), "deptht": (3, 3, 3, 1),
+                      "y": expected_y, "x": expected_x}
+
+
+@pytest.mark.parametrize("chunks", [None, {"x": 2}])
+def test_unpack(chunks):
+    packed = xr.DataArray(np.array([[-32768, 0, 100], [200, -32768, 300]],
+                                   dtype="int16"),
+                          dims=("y", "x"),
+                          attrs={"scale_factor": 0.01, "add_offset": 5.0,
+                                 "_FillValue": -32768, "units": "degC"})
+    if chunks is not None:
+        packed = packed.chunk(chunks)
+
+    unpacked = unpack(packed)
+
+    assert unpacked.dtype == np.float32
+    assert unpacked.chunks == packed.chunks
+    assert unpacked.attrs == {"units": "degC"}
+    assert unpacked.encoding["scale_factor"] == 0.01
+    np.testing.assert_allclose(unpacked.values,
+                               [[np.nan, 5.0, 6.0], [7.0, np.nan, 8.0]])
+
+    # unpacking twice or unpacking whole datasets does not change anything
+    assert unpack(unpacked) is unpacked
+    xr.testing.assert_identical(
+        unpack_variables(xr.Dataset({"votemper": packed}))["votemper"],
+        unpacked.rename("votemper"))
+
+
+def test_unpack_keeps_float64():
+    # fill values of floating point variables opened with `decode_cf=False`
+    # are masked without lowering the precision
+    e1t = xr.DataArray(np.array([1.0e4 + 1.0e-6, 1.0e20]), dims=("x", ),
+                       attrs={"_FillValue": 1.0e20, "missing_value": 1.0e20})
+    assert unpack(e1t).dtype == np.float64
+    np.testing.assert_array_equal(unpack(e1t).values, [1.0e4 + 1.0e-6, np.nan])
+    copied = copy_vars(xr.Dataset(), xr.Dataset({"e1t": e1t.expand_dims(
+        y=1)}))
+    assert copied.e1t.attrs == e1t.attrs
+
+    # scaled floating point variables are unpacked in double precision
+    scaled = e1t.assign_attrs(scale_factor=2.0)
+    assert unpack(scaled).dtype == np.float64
+    np.testing.assert_array_equal(unpack(scaled).values,
+                                  [2.0e4 + 2.0e-6, np.nan])
+
+
+def test_lru_cache():
+    cache = LRUCache(max_entries=2, max_bytes="1kB")
+    cache.put("a", 1, nbytes=100)
+    cache.put("b", 2, nbytes=100)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3, nbytes=100)
+    assert "b" not in cache and "a" in cache and "c" in cache
+
+    # too large to be cached at all
+    cache.put("d", 4, nbytes=2000)
+    assert "d" not in cache and len(cache) == 2
+
+    # evicted until both bounds are met
+    cache.put("e", 5, nbytes=950)
+    assert list(k for k in "ace" if k in cache) == ["e"]
+    assert cache.nbytes == 950
+
+    cache.resize(max_bytes=500)
+    assert len(cache) == 0
+    assert cache.get("e", "missing") == "missing"
+
+
+def test_heavy_dependencies_are_imported_lazily():
+    code = ("import sys, xorca\n"
+            "assert 'xarray' not in sys.modules\n"
+            "import xorca.budget, xorca.calc, xorca.catalog, xorca.halo\n"
+            "import xorca.lib\n"
+            "import xorca.rechunk, xorca.regions\n"
+            "print(sorted(m for m in ('dask', 'netCDF4', 'scipy', 'xgcm',\n"
+            "                         'zarr') if m in sys.modules))\n")
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    assert output.stdout.strip() == "[]"
@@ -1,15 +1,24 @@
 """Test reading the mesh masks."""
 
 from dask.array.core import Array as dask_array
+from dask.array.core import normalize_chunks
 import numpy as np
+import os
 from pathlib import Path
+import pickle
 import pytest
+import shutil
+import warnings
 import xarray as xr
 
 from xorca.lib import (copy_coords, copy_vars, create_minimal_coords_ds,
-                       force_sign_of_coordinate, load_xorca_dataset,
-                       load_xorca_dataset_auto, open_mf_or_dataset,
-                       preprocess_orca, trim_and_squeeze)
+                       force_sign_of_coordinate, get_grid_template,
+                       get_region_slices, load_xorca_dataset,
+                       load_xorca_dataset_auto, load_xorca_ensemble,
+                       mesh_cache, MeshHandle, open_mf_or_dataset,
+                       preprocess_orca,
+                       rename_dims, trim_and_squeeze, unpack)
+from xorca.profiling import LoadReport
 
 
 # Seed the RNG
@@ -149,6 +158,18 @@ def temp_dir(tmpdir_factory):
     temp_dir.remove()
 
 
+_mm_dims = {"t": 1, "z": 46, "y": 100, "x": 100}
+
+
+@pytest.fixture(scope="function")
+def mesh_mask_file(temp_dir):
+    """Write a NaN-filled mesh mask and return its file name."""
+    mock_up_mm = _get_nan_filled_data_set(_mm_dims, _mm_vars_nn_msh_3)
+    file_name = str(temp_dir.join("mesh_mask.nc"))
+    mock_up_mm.to_netcdf(file_name)
+    return file_name
+
+
 @pytest.mark.parametrize('set_mm_coords', [False, True])
 @pytest.mark.parametrize('variables',
                          [_mm_vars_nn_msh_3,
@@ -370,3 +391,420 @@ def test_auto_load_xorca_dataset(temp_dir, variables, dims, set_mm_coords,
 
     if update_var_dict:
         assert "e_3_t" in return_ds
+
+
+@pytest.mark.parametrize('loader', [load_xorca_dataset,
+                                    load_xorca_dataset_auto])
+def test_load_time_varying_e3(temp_dir, mesh_mask_file, loader):
+    # data file with two time steps of time-varying vertical scale factors
+    shape = (2, _mm_dims["z"], _mm_dims["y"], _mm_dims["x"])
+    data = xr.Dataset(
+        {"e3t": (("time_counter", "deptht", "y", "x"), np.ones(shape)),
+         "votemper": (("time_counter", "deptht", "y", "x"), np.ones(shape))},
+        coords={"time_counter": np.array(["2000-01-01", "2000-01-02"],
+                                         dtype="datetime64[ns]")})
+    data_file_name = str(temp_dir.join("grid_T.nc"))
+    data.to_netcdf(data_file_name)
+
+    return_ds = loader(data_files=[data_file_name, ],
+                       aux_files=[mesh_mask_file, ])
+
+    assert return_ds["e3t"].dims == ("t", "z_c", "y_c", "x_c")
+    assert return_ds["e3t"].chunks == return_ds["votemper"].chunks
+    assert float(return_ds["e3t"].max()) == 1.0
+
+    # other scale factors are still read from the mesh mask
+    assert "t" not in return_ds["e3u"].dims
+
+
+@pytest.mark.parametrize('data_format', ["netcdf", "zarr"])
+def test_auto_load_xorca_dataset_formats(temp_dir, data_format):
+    mock_up_mm = _get_nan_filled_data_set(_mm_dims, _mm_vars_nn_msh_3)
+
+    if data_format == "zarr":
+        file_name = str(temp_dir.join("mesh_mask.zarr"))
+        mock_up_mm.to_zarr(file_name)
+    else:
+        file_name = str(temp_dir.join("mesh_mask.nc"))
+        mock_up_mm.to_netcdf(file_name)
+
+    return_ds = load_xorca_dataset_auto(
+        data_files=[file_name, ], aux_files=[file_name, ])
+
+    assert isinstance(return_ds["e3t"].data, dask_array)
+
+
+def test_load_xorca_dataset_memmap_aux_files(temp_dir):
+    mock_up_mm = _get_nan_filled_data_set(_mm_dims, _mm_vars_nn_msh_3)
+    file_name = str(temp_dir.join("mesh_mask.nc"))
+    mock_up_mm.to_netcdf(file_name, format="NETCDF3_64BIT")
+
+    return_ds = load_xorca_dataset(
+        data_files=[file_name, ], aux_files=[file_name, ],
+        memmap_aux_files=True)
+    return_ds_ref = load_xorca_dataset(
+        data_files=[file_name, ], aux_files=[file_name, ])
+
+    assert isinstance(return_ds["e3t"].data, dask_array)
+    xr.testing.assert_identical(return_ds, return_ds_ref)
+    for name, var in return_ds.variables.items():
+        assert var.dtype == return_ds_ref[name].dtype
+
+
+def test_load_xorca_dataset_compact_dtypes(mesh_mask_file):
+    return_ds = load_xorca_dataset(
+        data_files=[mesh_mask_file, ], aux_files=[mesh_mask_file, ],
+        compact_dtypes=True)
+
+    assert return_ds["tmask"].dtype == bool
+    assert return_ds["e1t"].dtype == np.float32
+    assert return_ds["e3t"].dtype == np.float32
+
+
+def test_load_xorca_dataset_report(mesh_mask_file):
+    called = []
+    report = LoadReport(callbacks=[lambda *args: called.append(args)])
+    return_ds = load_xorca_dataset(
+        data_files=[mesh_mask_file, ], aux_files=[mesh_mask_file, ],
+        report=report)
+
+    assert set(report.stages) == {"probe", "open", "mesh", "preprocess",
+                                  "sort", "combine", "aux", "chunk"}
+    assert len(report.file_times) == 5
+    assert report.slowest_files(n=1)[0][1] == mesh_mask_file
+    assert report.n_tasks == len(return_ds.__dask_graph__())
+    assert report.n_layers > 0
+    assert report.nbytes == return_ds.nbytes
+    assert len(called) == 5 + 5
+
+
+def test_load_xorca_dataset_collapse_graph(mesh_mask_file):
+    return_ds = load_xorca_dataset(
+        data_files=[mesh_mask_file, ], aux_files=[mesh_mask_file, ],
+        collapse_graph=True)
+    return_ds_ref = load_xorca_dataset(
+        data_files=[mesh_mask_file, ], aux_files=[mesh_mask_file, ])
+
+    for v in return_ds.variables:
+        if return_ds[v].chunks is not None:
+            graph = return_ds[v].data.__dask_graph__()
+            graph_ref = return_ds_ref[v].data.__dask_graph__()
+            assert len(graph.layers) == 1
+            assert len(graph) <= len(graph_ref)
+    xr.testing.assert_identical(return_ds.compute(), return_ds_ref.compute())
+
+
+@pytest.mark.parametrize(
+    "target_ds_chunks",
+    [None, {"t": 1, "z_c": 5, "z_l": 5, "y_c": 30, "y_r": 30,
+            "x_c": 50, "x_r": 50}])
+def test_load_xorca_dataset_opens_at_target_chunks(mesh_mask_file,
+                                                   target_ds_chunks):
+    kwargs = {}
+    if target_ds_chunks is not None:
+        kwargs["target_ds_chunks"] = target_ds_chunks
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        return_ds = load_xorca_dataset(
+            data_files=[mesh_mask_file, ], aux_files=[mesh_mask_file, ],
+            **kwargs)
+
+    z_chunk, y_chunk, x_chunk = (2, 200, 200) if target_ds_chunks is None \
+        else (5, 30, 50)
+    assert return_ds["tmask"].chunks == normalize_chunks(
+        (z_chunk, y_chunk, x_chunk), shape=return_ds["tmask"].shape)
+    for v in return_ds.variables:
+        if return_ds[v].chunks is not None:
+            graph = return_ds[v].data.__dask_graph__()
+            assert not any(name.startswith("rechunk")
+                           for name in graph.layers)
+
+
+def test_load_xorca_dataset_warns_if_rechunking(temp_dir, mesh_mask_file):
+    # one time step per file cannot be opened at two time steps per chunk
+    data_file_names = []
+    for n, time in enumerate(["2000-01-01", "2000-01-02"]):
+        data = xr.Dataset(
+            {"sossheig": (("time_counter", "y", "x"),
+                          np.ones((1, _mm_dims["y"], _mm_dims["x"])))},
+            coords={"time_counter": np.array([time], dtype="datetime64[ns]")})
+        data_file_names.append(str(temp_dir.join("grid_T_{}.nc".format(n))))
+        data.to_netcdf(data_file_names[-1])
+
+    with pytest.warns(RuntimeWarning, match="sossheig"):
+        return_ds = load_xorca_dataset(
+            data_files=data_file_names, aux_files=[mesh_mask_file, ],
+            target_ds_chunks={"t": 2, "y_c": 200, "x_c": 200})
+
+    assert return_ds["sossheig"].chunks[0] == (2, )
+
+
+def test_load_xorca_dataset_lazy_decoding(temp_dir, mesh_mask_file):
+    # temperatures packed into int16 with a fill value on land
+    shape = (2, _mm_dims["z"], _mm_dims["y"], _mm_dims["x"])
+    temperature = 10.0 + np.random.RandomState(seed=137).randn(*shape)
+    temperature[:, :, :10, :] = np.nan
+    data = xr.Dataset(
+        {"votemper": (("time_counter", "deptht", "y", "x"), temperature)},
+        coords={"time_counter": np.array(["2000-01-01", "2000-01-02"],
+                                         dtype="datetime64[ns]")})
+    data_file_name = str(temp_dir.join("grid_T.nc"))
+    data.to_netcdf(data_file_name, encoding={"votemper": {
+        "dtype": "int16", "scale_factor": 0.001, "add_offset": 10.0,
+        "_FillValue": -32768}})
+
+    return_ds = load_xorca_dataset(data_files=[data_file_name, ],
+                                   aux_files=[mesh_mask_file, ],
+                                   decode_cf="lazy")
+    return_ds_ref = load_xorca_dataset(data_files=[data_file_name, ],
+                                       aux_files=[mesh_mask_file, ])
+
+    assert return_ds.votemper.dtype == np.int16
+    assert return_ds.votemper.attrs["scale_factor"] == 0.001
+    assert return_ds.t.dtype == return_ds_ref.t.dtype
+
+    votemper = unpack(return_ds.votemper)
+    assert isinstance(votemper.data, dask_array)
+    assert votemper.dtype == np.float32
+    xr.testing.assert_allclose(votemper.astype(np.float64),
+                               return_ds_ref.votemper, atol=1e-5)
+
+
+def test_load_xorca_dataset_lazy_decoding_of_floats(temp_dir, mesh_mask_file):
+    # unpacked single precision temperatures with a fill value on land
+    shape = (2, _mm_dims["z"], _mm_dims["y"], _mm_dims["x"])
+    temperature = np.random.RandomState(seed=137).rand(*shape)
+    temperature[:, :, :10, :] = np.nan
+    data = xr.Dataset(
+        {"votemper": (("time_counter", "deptht", "y", "x"),
+                      temperature.astype(np.float32))},
+        coords={"time_counter": np.array(["2000-01-01", "2000-01-02"],
+                                         dtype="datetime64[ns]")})
+    data_file_name = str(temp_dir.join("grid_T.nc"))
+    data.to_netcdf(data_file_name,
+                   encoding={"votemper": {"_FillValue": 1.0e20}})
+
+    return_ds = load_xorca_dataset(data_files=[data_file_name, ],
+                                   aux_files=[mesh_mask_file, ],
+                                   decode_cf="lazy")
+    return_ds_ref = load_xorca_dataset(data_files=[data_file_name, ],
+                                       aux_files=[mesh_mask_file, ])
+
+    # the fill values are kept and masked when unpacking
+    assert return_ds.votemper.attrs["_FillValue"] == np.float32(1.0e20)
+    votemper = unpack(return_ds.votemper)
+    assert votemper.dtype == np.float32
+    assert float(votemper.max()) <= 1.0
+    xr.testing.assert_identical(votemper.reset_coords(drop=True),
+                                return_ds_ref.votemper.reset_coords(drop=True))
+
+
+def _get_regular_mesh_mask(dims):
+    """Mesh mask with longitudes -180 + 3.6 x and latitudes -80 + 1.6 y."""
+    mock_up_mm = _get_nan_filled_data_set(dims, _mm_vars_nn_msh_3)
+    lon = -180.0 + 3.6 * np.arange(dims["x"])
+    lat = -80.0 + 1.6 * np.arange(dims["y"])
+    mock_up_mm["glamt"] = (("t", "y", "x"),
+                           np.tile(lon, (dims["t"], dims["y"], 1)))
+    mock_up_mm["gphit"] = (("t", "y", "x"),
+                           np.tile(lat[:, np.newaxis], (dims["t"], 1,
+                                                        dims["x"])))
+    return mock_up_mm
+
+
+@pytest.mark.parametrize(
+    "region, y_slice, x_slice",
+    [({"lon": (0, 36), "lat": (0, 16)}, slice(50, 61), slice(50, 61)),
+     ({"lat": (0, 16)}, slice(50, 61), slice(1, 99)),
+     # across the date line, the window spans the whole trimmed grid
+     ({"lon": (170, -170)}, slice(1, 99), slice(1, 99)),
+     ({"y": (10, 20), "x": (-5, None)}, slice(11, 21), slice(94, 99))])
+def test_get_region_slices(region, y_slice, x_slice):
+    mesh_mask = _get_regular_mesh_mask({"t": 1, "z": 2, "y": 100, "x": 100})
+    assert get_region_slices(mesh_mask, region) == {"y": y_slice,
+                                                    "x": x_slice}
+
+
+def test_get_region_slices_empty_region():
+    mesh_mask = _get_regular_mesh_mask({"t": 1, "z": 2, "y": 100, "x": 100})
+    with pytest.raises(ValueError, match="no grid points"):
+        get_region_slices(mesh_mask, {"lat": (85, 90)})
+
+
+@pytest.mark.parametrize(
+    "region", [{"lon": (0, 36), "lat": (0, 16)}, {"y": (49, 60),
+                                                  "x": (49, 60)}])
+def test_load_xorca_dataset_region(temp_dir, region):
+    mm_file_name = str(temp_dir.join("mesh_mask.nc"))
+    _get_regular_mesh_mask(_mm_dims).to_netcdf(mm_file_name)
+
+    shape = (2, _mm_dims["z"], _mm_dims["y"], _mm_dims["x"])
+    data = xr.Dataset(
+        {"votemper": (("time_counter", "deptht", "y", "x"),
+                      np.random.RandomState(seed=137).randn(*shape))},
+        coords={"time_counter": np.array(["2000-01-01", "2000-01-02"],
+                                         dtype="datetime64[ns]")})
+    data_file_name = str(temp_dir.join("grid_T.nc"))
+    data.to_netcdf(data_file_name)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        return_ds = load_xorca_dataset(
+            data_files=[data_file_name, ], aux_files=[mm_file_name, ],
+            region=region, target_ds_chunks={"t": 1, "z_c": 23, "y_c": 5,
+                                             "x_c": 5})
+    return_ds_ref = load_xorca_dataset(
+        data_files=[data_file_name, ], aux_files=[mm_file_name, ])
+
+    assert return_ds.votemper.shape == (2, 46, 11, 11)
+    assert return_ds.votemper.chunks[-2:] == ((5, 5, 1), (5, 5, 1))
+    np.testing.assert_array_equal(
+        return_ds.votemper.values,
+        return_ds_ref.votemper.isel(y_c=slice(49, 60),
+                                    x_c=slice(49, 60)).values)
+    np.testing.assert_array_equal(
+        return_ds.llon_cc.values,
+        return_ds_ref.llon_cc.isel(y_c=slice(49, 60),
+                                   x_c=slice(49, 60)).values)
+
+
+def test_load_xorca_ensemble(temp_dir, mesh_mask_file):
+    # three members with two files of one time step each
+    rng = np.random.RandomState(seed=137)
+    data_files = {}
+    for member in ["a", "b", "c"]:
+        data_files[member] = []
+        for time in ["2000-01-01", "2000-01-02"]:
+            data = xr.Dataset(
+                {"sossheig": (("time_counter", "y", "x"),
+                              rng.randn(1, _mm_dims["y"], _mm_dims["x"]))},
+                coords={"time_counter": np.array([time],
+                                                 dtype="datetime64[ns]")})
+            data_files[member].append(
+                str(temp_dir.join("{}_{}.nc".format(member, time))))
+            data.to_netcdf(data_files[member][-1])
+
+    report = LoadReport()
+    return_ds = load_xorca_ensemble(data_files=data_files,
+                                    aux_files=[mesh_mask_file, ],
+                                    max_workers=3, report=report)
+
+    assert list(return_ds.member.values) == ["a", "b", "c"]
+    assert return_ds.sossheig.dims == ("member", "t", "y_c", "x_c")
+    assert return_ds.sossheig.chunks[:2] == ((1, 1, 1), (1, 1))
+    assert "member" not in return_ds.e1t.dims
+    assert len([ft for ft in report.file_times if ft[0] == "open"]) == 7
+
+    for member, files in data_files.items():
+        return_ds_ref = load_xorca_dataset(data_files=files,
+                                           aux_files=[mesh_mask_file, ])
+        xr.testing.assert_identical(
+            return_ds.sel(member=member).drop_vars("member"), return_ds_ref)
+
+    # statistics over the members stream over the chunks of the members
+    np.testing.assert_allclose(
+        return_ds.sossheig.std("member").values,
+        np.std(return_ds.sossheig.values, axis=0))
+
+
+def test_load_xorca_dataset_mesh_cache(temp_dir, mesh_mask_file):
+    data_file_name = str(temp_dir.join("data.nc"))
+    shutil.copy(mesh_mask_file, data_file_name)
+
+    def _load(**kwargs):
+        report = LoadReport()
+        ds = load_xorca_dataset(data_files=[data_file_name, ],
+                                aux_files=[mesh_mask_file, ], report=report,
+                                **kwargs)
+        aux_opened = [ft for ft in report.file_times
+                      if ft[1] == mesh_mask_file]
+        return ds, "mesh" in report.stages or bool(aux_opened)
+
+    return_ds, processed = _load()
+    assert processed
+
+    # the same aux files and arguments skip the mesh processing
+    return_ds_cached, processed = _load()
+    assert not processed
+    xr.testing.assert_identical(return_ds_cached, return_ds)
+
+    # other arguments or changed files don't
+    _, processed = _load(model_config="NEST")
+    assert processed
+    _, processed = _load(mesh_cache=False)
+    assert processed
+    shutil.copy(mesh_mask_file, str(temp_dir.join("new_mesh_mask.nc")))
+    os.replace(str(temp_dir.join("new_mesh_mask.nc")), mesh_mask_file)
+    _, processed = _load()
+    assert processed
+
+    # the cache is bounded
+    mesh_cache.resize(max_entries=1)
+    try:
+        _, processed = _load(model_config="NEST")
+        assert processed
+        assert len(mesh_cache) == 1
+    finally:
+        mesh_cache.resize(max_entries=8)
+
+
+def test_load_xorca_dataset_auto_mesh_cache(temp_dir, mesh_mask_file):
+    data_file_name = str(temp_dir.join("data.nc"))
+    shutil.copy(mesh_mask_file, data_file_name)
+
+    def _load(**kwargs):
+        report = LoadReport()
+        load_xorca_dataset_auto(data_files=[data_file_name, ],
+                                aux_files=[mesh_mask_file, ], report=report,
+                                **kwargs)
+        return "mesh" in report.stages
+
+    # each call opens the files with a new function, but the key only
+    # depends on the backend and its options
+    mesh_cache.clear()
+    assert _load()
+    assert not _load()
+    assert len(mesh_cache) == 1
+    assert _load(backend_options={"netcdf4": {"lock": False}})
+    assert not _load(backend_options={"netcdf4": {"lock": False}})
+    assert len(mesh_cache) == 2
+
+
+def test_preprocess_orca_uses_grid_template(mesh_mask_file):
+    grid_template = get_grid_template(mesh_mask_file)
+    assert get_grid_template(mesh_mask_file) is grid_template
+    assert grid_template["llat_cc"].dims == ("y_c", "x_c")
+
+    ds = rename_dims(xr.open_dataset(mesh_mask_file, chunks={}))
+    xr.testing.assert_identical(
+        preprocess_orca(mesh_mask_file, ds),
+        preprocess_orca(None, ds, grid_template=grid_template))
+
+
+def test_mesh_handle(temp_dir, mesh_mask_file):
+    handle = MeshHandle(mesh_mask_file, model_config="GLOBAL")
+    pickled = pickle.dumps(handle)
+    assert len(pickled) < 1000
+    assert pickle.loads(pickled) == handle
+    assert hash(pickle.loads(pickled)) == hash(handle)
+    assert handle != MeshHandle(mesh_mask_file, model_config="NEST")
+    assert handle.get_grid_template() is handle.get_grid_template()
+
+    data_file_names = []
+    for n, time in enumerate(["2000-01-01", "2000-01-02"]):
+        data = xr.Dataset(
+            {"sossheig": (("time_counter", "y", "x"),
+                          np.ones((1, _mm_dims["y"], _mm_dims["x"])))},
+            coords={"time_counter": np.array([time], dtype="datetime64[ns]")})
+        data_file_names.append(str(temp_dir.join("grid_T_{}.nc".format(n))))
+        data.to_netcdf(data_file_names[-1])
+
+    ds = rename_dims(xr.open_dataset(data_file_names[0], chunks={}))
+    xr.testing.assert_identical(handle(ds),
+                                preprocess_orca(mesh_mask_file, ds))
+
+    return_ds = xr.open_mfdataset(data_file_names, parallel=True,
+                                  preprocess=MeshHandle(mesh_mask_file))
+    assert return_ds.sossheig.dims == ("t", "y_c", "x_c")
+    assert return_ds.sizes["t"] == 2
+    assert "llat_cc" in return_ds.coords
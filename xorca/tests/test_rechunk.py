@@ -0,0 +1,104 @@
+"""Test writing time-contiguous Zarr stores."""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from xorca.lib import load_xorca_dataset, load_xorca_dataset_auto
+from xorca.rechunk import get_write_blocks, rechunk_to_time_series
+
+
+@pytest.fixture(scope="function")
+def temp_dir(tmpdir_factory):
+    temp_dir = tmpdir_factory.mktemp('data')
+    yield temp_dir
+    temp_dir.remove()
+
+
+def _write_files(temp_dir, N_t=4, N_z=3, N_y=12, N_x=14, seed=137):
+    """Write a mesh mask and one grid_T file per time step."""
+    rng = np.random.RandomState(seed=seed)
+
+    mesh_mask = xr.Dataset(
+        {"tmask": (("t", "z", "y", "x"), np.ones((1, N_z, N_y, N_x)))},
+        coords={"z": range(N_z), "y": range(N_y), "x": range(N_x)})
+    aux_files = [str(temp_dir.join("mesh_mask.nc")), ]
+    mesh_mask.to_netcdf(aux_files[0])
+
+    data_files = []
+    for n, time in enumerate(np.arange("2000-01-01", N_t,
+                                       dtype="datetime64[D]")):
+        data = xr.Dataset(
+            {"votemper": (("time_counter", "deptht", "y", "x"),
+                          rng.randn(1, N_z, N_y, N_x)),
+             "sossheig": (("time_counter", "y", "x"),
+                          rng.randn(1, N_y, N_x))},
+            coords={"time_counter": np.array([time],
+                                             dtype="datetime64[ns]")})
+        data_files.append(str(temp_dir.join("grid_T_{}.nc".format(n))))
+        data.to_netcdf(data_files[-1])
+
+    return aux_files, data_files
+
+
+@pytest.mark.parametrize(
+    "max_mem, expected_blocks",
+    [(10 ** 6, [{"t": slice(0, 4), "z_c": slice(0, 3), "y_c": slice(0, 10),
+                 "x_c": slice(0, 12)}]),
+     # all time steps of one row of chunks
+     (4 * 4 * 12 * 8, [{"t": slice(0, 4), "z_c": slice(z, z + 1),
+                        "y_c": slice(y, min(y + 4, 10)),
+                        "x_c": slice(0, 12)}
+                       for z in range(3) for y in range(0, 10, 4)]),
+     # single chunks are written in slabs of two time steps
+     (2 * 4 * 4 * 8, [{"t": slice(t, t + 2), "z_c": slice(z, z + 1),
+                       "y_c": slice(y, min(y + 4, 10)),
+                       "x_c": slice(x, min(x + 4, 12))}
+                      for t in range(0, 4, 2) for z in range(3)
+                      for y in range(0, 10, 4) for x in range(0, 12, 4)])])
+def test_get_write_blocks(max_mem, expected_blocks):
+    sizes = {"t": 4, "z_c": 3, "y_c": 10, "x_c": 12}
+    chunks = {"t": 4, "z_c": 1, "y_c": 4, "x_c": 4}
+
+    assert get_write_blocks(sizes, chunks, 8, max_mem) == expected_blocks
+
+
+@pytest.mark.parametrize("max_mem", ["1MB", 200])
+def test_rechunk_to_time_series(temp_dir, max_mem):
+    aux_files, data_files = _write_files(temp_dir)
+    ds = load_xorca_dataset(data_files=data_files, aux_files=aux_files)
+
+    store = str(temp_dir.join("time_series.zarr"))
+    chunks = {"t": -1, "z_c": 1, "y_c": 4, "x_c": 4}
+    rechunk_to_time_series(ds, store, chunks=chunks, max_mem=max_mem)
+
+    ds_ts = load_xorca_dataset_auto(data_files=[store, ],
+                                    aux_files=aux_files,
+                                    target_ds_chunks=chunks)
+
+    assert ds_ts.votemper.chunks == ((4, ), (1, 1, 1), (4, 4, 2), (4, 4, 4))
+    assert ds_ts.sossheig.chunks == ((4, ), (4, 4, 2), (4, 4, 4))
+    xr.testing.assert_identical(ds_ts.compute(), ds.compute())
+
+
+@pytest.mark.parametrize("region", [{"y": (2, 7), "x": (3, 9)},
+                                    {"x": (-4, None)}])
+def test_region_of_time_series(temp_dir, region):
+    aux_files, data_files = _write_files(temp_dir)
+    ds = load_xorca_dataset(data_files=data_files, aux_files=aux_files)
+    store = str(temp_dir.join("time_series.zarr"))
+    rechunk_to_time_series(ds, store, chunks={"t": -1, "z_c": 1, "y_c": 4,
+                                              "x_c": 4})
+
+    # grid-aware input is cut to the same window as the raw files
+    ds_region = load_xorca_dataset(data_files=data_files,
+                                   aux_files=aux_files, region=region)
+    ds_ts = load_xorca_dataset_auto(data_files=[store, ],
+                                    aux_files=aux_files, region=region)
+    window = {dim: slice(*region.get(dim[0], (None, None)))
+              for dim in ("y_c", "y_r", "x_c", "x_r")}
+    ds_ref = ds.isel(window, missing_dims="ignore")
+    xr.testing.assert_identical(ds_ts.compute(), ds_region.compute())
+    for name in ["votemper", "sossheig", "tmask"]:
+        np.testing.assert_array_equal(ds_ts[name].values,
+                                      ds_ref[name].values)
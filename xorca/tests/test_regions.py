@@ -0,0 +1,166 @@
+"""Test the masks of regions defined by polygons."""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from xorca import regions
+from xorca.calc import calculate_moc
+from xorca.regions import (add_region_masks, clear_region_mask_cache,
+                           points_in_polygon)
+
+
+def _get_regular_ds(N_z=3, N_y=9, N_x=18):
+    """Grid-aware data set with T points at lon = 20 x - 170, lat = 20 y - 80.
+
+    U, V, and F points are half a grid spacing east and / or north.
+    """
+    lon_c = 20.0 * np.arange(N_x) - 170.0
+    lat_c = 20.0 * np.arange(N_y) - 80.0
+    lon = {"c": lon_c, "r": lon_c + 10.0}
+    lat = {"c": lat_c, "r": lat_c + 10.0}
+    dims = {"c": "_c", "r": "_r"}
+
+    coords = {
+        "z_c": (["z_c", ], np.arange(1, N_z + 1), {"axis": "Z"}),
+        "z_l": (["z_l", ], np.arange(1, N_z + 1) - 0.5,
+                {"axis": "Z", "c_grid_axis_shift": - 0.5}),
+        "y_c": (["y_c", ], np.arange(1, N_y + 1), {"axis": "Y"}),
+        "y_r": (["y_r", ], np.arange(1, N_y + 1) + 0.5,
+                {"axis": "Y", "c_grid_axis_shift": 0.5}),
+        "x_c": (["x_c", ], np.arange(1, N_x + 1), {"axis": "X"}),
+        "x_r": (["x_r", ], np.arange(1, N_x + 1) + 0.5,
+                {"axis": "X", "c_grid_axis_shift": 0.5}),
+        "depth_l": (["z_l", ], - 10.0 * np.arange(N_z)),
+    }
+    for y, x in [("c", "c"), ("c", "r"), ("r", "c"), ("r", "r")]:
+        yx_dims = ["y" + dims[y], "x" + dims[x]]
+        llon, llat = np.meshgrid(lon[x], lat[y])
+        coords["llon_" + y + x] = (yx_dims, (llon + 180) % 360 - 180)
+        coords["llat_" + y + x] = (yx_dims, llat)
+
+    tmask = np.ones((N_z, N_y, N_x), dtype=bool)
+    tmask[:, 4, 3] = False  # an island
+    for mask, yx_dims in [("tmask", ["y_c", "x_c"]),
+                          ("umask", ["y_c", "x_r"]),
+                          ("vmask", ["y_r", "x_c"]),
+                          ("fmask", ["y_r", "x_r"])]:
+        coords[mask] = (["z_c", ] + yx_dims, tmask)
+    coords["e1v"] = (["y_r", "x_c"], np.ones((N_y, N_x)))
+    coords["e3v"] = (["z_c", "y_r", "x_c"], np.ones((N_z, N_y, N_x)))
+
+    vomecrty = np.random.RandomState(seed=137).randn(2, N_z, N_y, N_x)
+    return xr.Dataset(
+        {"vomecrty": (["t", "z_c", "y_r", "x_c"], vomecrty)},
+        coords=coords)
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    clear_region_mask_cache()
+    yield
+    clear_region_mask_cache()
+
+
+def test_points_in_polygon():
+    lon, lat = np.meshgrid(np.arange(-175, 180, 10), np.arange(-85, 90, 10))
+    square = [(0, 0), (30, 0), (30, 30), (0, 30)]
+    inside = points_in_polygon(lon, lat, square)
+    np.testing.assert_array_equal(
+        inside, (lon > 0) & (lon < 30) & (lat > 0) & (lat < 30))
+
+    # across the date line with continuous longitudes of the vertices
+    pacific = [(160, -20), (200, -20), (200, 20), (160, 20)]
+    inside = points_in_polygon(lon, lat, pacific)
+    np.testing.assert_array_equal(
+        inside, (abs(lon) > 160) & (abs(lat) < 20))
+
+    # a triangle
+    inside = points_in_polygon([5, 15, 25], [5, 15, 5],
+                               [(0, 0), (20, 0), (0, 20)])
+    np.testing.assert_array_equal(inside, [True, False, False])
+
+
+def test_add_region_masks():
+    ds = _get_regular_ds()
+    box = [(-45, -25), (45, -25), (45, 25), (-45, 25)]
+    ds_masks = add_region_masks(ds, update_region_polygons={"box": box})
+
+    for grid_point, lon, lat in [("t", "llon_cc", "llat_cc"),
+                                 ("u", "llon_cr", "llat_cr"),
+                                 ("v", "llon_rc", "llat_rc"),
+                                 ("f", "llon_rr", "llat_rr")]:
+        mask = ds_masks[grid_point + "maskbox"]
+        assert mask.dtype == bool
+        assert mask.dims == ds[lon].dims
+        expected = ((abs(ds[lon]) < 45) & (abs(ds[lat]) < 25) &
+                    ds[grid_point + "mask"].isel(z_c=0))
+        np.testing.assert_array_equal(mask.values, expected.values)
+    assert not ds_masks.tmaskbox.isel(y_c=4, x_c=3)
+
+
+def test_region_masks_are_cached(tmp_path, monkeypatch):
+    ds = _get_regular_ds()
+    box = {"box": [(-45, -25), (45, -25), (45, 25), (-45, 25)]}
+    ds_masks = add_region_masks(ds, regions=box, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("region_mask_*.npz"))) == 1
+
+    def _fail(*args):
+        raise AssertionError("The grid was scanned again.")
+
+    monkeypatch.setattr(regions, "points_in_polygon", _fail)
+
+    # from memory
+    xr.testing.assert_identical(
+        add_region_masks(ds, regions=box, cache_dir=tmp_path), ds_masks)
+
+    # from the files
+    clear_region_mask_cache()
+    xr.testing.assert_identical(
+        add_region_masks(ds, regions=box, cache_dir=tmp_path), ds_masks)
+
+    # other polygons are not cached yet
+    with pytest.raises(AssertionError, match="scanned"):
+        add_region_masks(ds, regions={"other": box["box"][::-1][:3]})
+
+
+def test_region_masks_hash_the_mesh_once(monkeypatch):
+    ds = _get_regular_ds()
+    boxes = {"box{}".format(n): [(lon, lat + 20 * n) for lon, lat in
+                                 [(-45, -25), (45, -25), (45, 25), (-45, 25)]]
+             for n in range(3)}
+
+    hashed = []
+    get_mesh_hash = regions._get_mesh_hash
+
+    def _get_mesh_hash(*args, **kwargs):
+        hashed.append(1)
+        return get_mesh_hash(*args, **kwargs)
+
+    monkeypatch.setattr(regions, "_get_mesh_hash", _get_mesh_hash)
+    ds_masks = add_region_masks(ds, regions=boxes)
+    assert len(hashed) == 1
+
+    # the same masks as for each region on its own
+    clear_region_mask_cache()
+    for name, box in boxes.items():
+        np.testing.assert_array_equal(
+            add_region_masks(ds, regions={name: box})["tmask" + name].values,
+            ds_masks["tmask" + name].values)
+    assert regions.get_mesh_hash(ds) == get_mesh_hash(
+        regions._get_coordinate_reader(ds))
+
+
+def test_calculate_moc_with_region_masks():
+    ds = _get_regular_ds()
+    box = [(-180, -25), (180, -25), (180, 25), (-180, 25)]
+    ds_masks = add_region_masks(ds, regions={"box": box})
+
+    moc = calculate_moc(ds_masks, region="box")
+    assert moc.name == "mocbox"
+
+    ds_ref = ds.copy()
+    ds_ref.coords["vmask"] = ds.vmask & ds_masks.vmaskbox
+    xr.testing.assert_allclose(
+        moc.drop_vars("lat_mocbox"),
+        calculate_moc(ds_ref).drop_vars("lat_moc").rename("mocbox"))